@@ -54,6 +54,11 @@ class AuxiliaryController():
         self._tx_buf = bytearray( [0] * (self.SPI_BUFFER_SIZE + 1))
         self._rx_mv = memoryview(self._rx_buf)
         self._tx_mv = memoryview(self._tx_buf)
+        # Slices of the package number and of the data, created once
+        self._rx_package_mv = self._rx_mv[self.SPI_BUFFER_SIZE:]
+        self._tx_package_mv = self._tx_mv[self.SPI_BUFFER_SIZE:]
+        self._rx_data_mv = self._rx_mv[0:self.SPI_BUFFER_SIZE]
+        self._tx_data_mv = self._tx_mv[0:self.SPI_BUFFER_SIZE]
         self._spi = spi
         self.package_count = 0
         self.battery_millivolts = 0
@@ -116,9 +121,8 @@ class AuxiliaryController():
         try:
 
             self.prepare_next_package()
-            i = self.size
 
-            self._spi.send_recv(self._tx_mv[i:(i+1)], self._rx_mv[i:(i+1)])
+            self._spi.send_recv(self._tx_package_mv, self._rx_package_mv)
 
             if not self.check_package_validity():
                 self._restart = True
@@ -126,7 +130,7 @@ class AuxiliaryController():
                 if not self._verbose:
                     return False
 
-            self._spi.send_recv(self._tx_mv[0:self.size], self._rx_mv[0:self.size])
+            self._spi.send_recv(self._tx_data_mv, self._rx_data_mv)
 
         except Exception as e:
             print(e)
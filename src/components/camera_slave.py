@@ -20,8 +20,14 @@
 #OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #SOFTWARE.
 
-from pyb import Pin
+from pyb import Pin, ExtInt
 import sensor
+import utime
+from ustruct import unpack_from
+
+from utils.image import rle565_decode, crc16, create_crc16_table
+from utils.dynamic_spi import MicrosecondHistogram
+from components.camera_slave_control import CameraSlaveControl
 
 class CameraSlave():
 
@@ -32,36 +38,253 @@ class CameraSlave():
     rx_buff = None
     tx_buff = None
 
-    def __init__(self, spi, width, height, alloc_tx_buff=False, alloc_rx_buff=False, pin_data_ready=None, sync_cancel_condition=None):
+    def __init__(self, spi, width, height, alloc_tx_buff=False, alloc_rx_buff=False, pin_data_ready=None, sync_cancel_condition=None, compression=False, receiver=None):
         self.spi = spi
         if alloc_tx_buff:
             self.tx_buff = sensor.alloc_extra_fb(width, height, sensor.RGB565)
         if alloc_rx_buff:
             self.rx_buff = sensor.alloc_extra_fb(width, height, sensor.RGB565)
+        if receiver is None:
+            receiver = alloc_rx_buff
         self.pin_data_ready = Pin(pin_data_ready, Pin.IN)
+        # The slave lowers the pin when it waits for the master with a frame. The falling edge is
+        # latched by the interrupt, the pin is only read after an edge (see sync_ready).
+        self._ready_edge = False
+        self._ready_interrupt = ExtInt(pin_data_ready, ExtInt.IRQ_FALLING, Pin.PULL_NONE, self._ready_callback)
+        self._sync_start_us = None # Pending sync (sync_start)
+        self._sync_timeout_ms = 0
+        self.sync_timeout_ms = 1000
+        self.timed_out = False
+        self.timeouts = 0
+        self.wait_us = MicrosecondHistogram() # From sync_start to the exchange of the frame
+        self.wait_us_last = 0
         if not sync_cancel_condition:
             self.sync_cancel_condition = lambda: False
         else:
             self.sync_cancel_condition = sync_cancel_condition
 
         self.control = CameraSlaveControl()
-
-    def sync(self, ignore_busy=False):
-        if not ignore_busy:
-            while self.pin_data_ready and self.pin_data_ready.value() == 1:
-                if self.sync_cancel_condition():
-                    return False
+        # The slave builds each frame with the control received after the previous one
+        self.frame_format = CameraSlaveControl.FORMAT_QVGA # Format of the frame in frame_buff
+        self._next_frame_format = CameraSlaveControl.FORMAT_QVGA
+
+        # QVGA frames are received in the target buffer of the sync (rx_buff by default), the caller
+        # can pass its own frame buffer (the screen one) to avoid copying them. QQVGA frames are
+        # received in qqvga_buff, they are scaled or blended into the target by the caller.
+        # Every frame received is checked against its header. The payloads which fit in staging_buff
+        # (the compressed and the QQVGA ones) are received there first, so a frame which fails the
+        # check leaves the previous one in frame_buff. A failed QVGA raw frame leaves the target torn.
+        # Both buffers are only allocated by alloc_receive_buffs, without them only raw QVGA frames
+        # are received.
+        self.receiver = receiver
+        self._compression = compression
+        # Grey 160x120 thermal frame sent to the slave while the FORMAT_FUSED frames are requested
+        self.thermal_buff = None
+        self.staging_buff = None
+        self.qqvga_buff = None
+        self._target_buff = None
+        self._accept_repeat = False
+        self._header = bytearray(CameraSlaveControl.HEADER_BYTES)
+        self._payload_ack = bytearray(1)
+        self._crc_table = create_crc16_table()
+        self.frame_buff = None # Buffer of the last frame received
+        self.frame_valid = False # frame_buff holds a complete frame
+        self.frame_counter = 0 # Header of the frame in frame_buff
+        self.frame_time_ms = 0
+        self.frame_fresh = False # The last sync received a new frame
+        self.received_frames = 0
+        self.repeated_frames = 0 # Syncs which skipped the payload, the slave had no newer frame
+        self.compressed_frames = 0
+        self.invalid_frames = 0 # Frames which failed the header, crc or decoding checks
+        if receiver and alloc_rx_buff:
+            self.alloc_receive_buffs()
+
+    def alloc_receive_buffs(self):
+        """ Allocates staging_buff and qqvga_buff (once), compression is requested from then on.
+        The caller without rx_buff allocates them when it first needs visual frames, until then
+        they take no frame buffer memory. """
+        if self.staging_buff is not None:
+            return
+        if self._compression:
+            staging_bytes = CameraSlaveControl.COMPRESSED_MAX_BYTES
+            self.control.compression = CameraSlaveControl.CODEC_RLE565
+        else:
+            staging_bytes = CameraSlaveControl.FRAME_BYTES[CameraSlaveControl.FORMAT_QQVGA]
+        self.staging_buff = sensor.alloc_extra_fb(320, staging_bytes // 320, sensor.GRAYSCALE)
+        self.qqvga_buff = sensor.alloc_extra_fb(160, 120, sensor.RGB565)
+
+    def _ready_callback(self, line):
+        self._ready_edge = True
+
+    def sync_start(self, timeout_ms=None, target_buff=None, accept_repeat=False):
+        """ Starts waiting for the slave, sync_poll exchanges the frame once it is ready.
+        A QVGA frame is received in target_buff (rx_buff when None). With accept_repeat the payload
+        is skipped when the slave has no newer frame than the one in frame_buff, which the caller
+        still has (in frame_buff or on the screen). """
+        self._target_buff = self.rx_buff if target_buff is None else target_buff
+        self._accept_repeat = accept_repeat
+        self._ready_edge = self.pin_data_ready.value() == 0
+        self._sync_start_us = utime.ticks_us()
+        self._sync_timeout_ms = self.sync_timeout_ms if timeout_ms is None else timeout_ms
+        self.timed_out = False
+
+    def sync_ready(self):
+        """ The slave waits for the master. An edge whose pin is high again was a ready window which
+        is over, the slave lowers the pin again when it can send. """
+        if not self._ready_edge:
+            return False
+        if self.pin_data_ready.value() == 0:
+            return True
+        self._ready_edge = False
+        return False
+
+    def sync_poll(self):
+        """ None while the slave is not ready (or the bus is in use), otherwise the result of the
+        exchange (see sync). False as well when the sync is cancelled or times out. """
+        if self._sync_start_us is None:
+            return False
+        if not self.sync_ready() or self.spi.locked:
+            if self.sync_cancel_condition():
+                self._sync_start_us = None
+                return False
+            if utime.ticks_diff(utime.ticks_us(), self._sync_start_us) > self._sync_timeout_ms * 1000:
+                self._sync_start_us = None
+                self.timed_out = True
+                self.timeouts += 1
+                return False
+            return None
+        self.wait_us_last = utime.ticks_diff(utime.ticks_us(), self._sync_start_us)
+        self.wait_us.add(self.wait_us_last)
+        return self._exchange()
+
+    def sync(self, ignore_busy=False, timeout_ms=None, target_buff=None, accept_repeat=False):
+        """ Exchanges a frame and the control. False when cancelled, timed out or when the received
+        frame failed the checks, frame_valid tells whether frame_buff still holds the previous frame.
+        frame_fresh tells whether a new frame was received (see sync_start for the repeats). """
+        if ignore_busy:
+            self._target_buff = self.rx_buff if target_buff is None else target_buff
+            self._accept_repeat = accept_repeat
+            return self._exchange()
+        self.sync_start(timeout_ms, target_buff, accept_repeat)
+        result = self.sync_poll()
+        while result is None:
+            result = self.sync_poll()
+        return result
+
+    def _exchange(self):
+        self._sync_start_us = None
+        self._ready_edge = False
+        frame_bytes = CameraSlaveControl.FRAME_BYTES[self._next_frame_format]
+        valid = True
         if self.tx_buff is not None and self.rx_buff is not None:
-            self.spi.send_recv(self.tx_buff.bytearray(), self.rx_buff.bytearray())
+            self.spi.send_recv(memoryview(self.tx_buff.bytearray())[:frame_bytes], memoryview(self.rx_buff.bytearray())[:frame_bytes])
         elif self.tx_buff is not None:
-            self.spi.send(self.tx_buff.bytearray())
-        elif self.rx_buff is not None:
-            self.spi.recv(self.rx_buff.bytearray())
-
+            self.spi.send(memoryview(self.tx_buff.bytearray())[:frame_bytes])
+        elif self.receiver:
+            received = self._recv_frame()
+            self.frame_fresh = received is True
+            if received is None:
+                self.repeated_frames += 1
+            else:
+                self.received_frames += 1
+                valid = received
+                if not valid:
+                    self.invalid_frames += 1
+
+        self.control.seal(self._crc_table)
         self.spi.send(self.control.buff)
-
+        self._next_frame_format = self.control.frame_format
+
+        return valid
+
+    def _recv_frame(self):
+        """ Header and payload in a single lock, True when the frame passed the checks and is in frame_buff,
+        None when the slave has no newer frame than frame_buff and repeats are accepted (see sync_start).
+        The payload is skipped when the header does not make sense (or for a QVGA frame without target). """
+        self.spi.lock()
+        try:
+            self.spi.recv(self._header)
+            payload_bytes, codec, frame_format, counter, time_ms, crc = unpack_from(CameraSlaveControl.HEADER_FORMAT, self._header)
+            if (self._accept_repeat and self.frame_valid and counter == self.frame_counter
+                    and frame_format == self.frame_format):
+                self._send_payload_ack(CameraSlaveControl.PAYLOAD_SKIP)
+                return None
+            frame_buff = self._header_frame_buff(payload_bytes, codec, frame_format)
+            if frame_buff is None:
+                self._send_payload_ack(CameraSlaveControl.PAYLOAD_SKIP)
+                return False
+            self._send_payload_ack(CameraSlaveControl.PAYLOAD_SEND)
+            frame_bytes = CameraSlaveControl.FRAME_BYTES[frame_format]
+            staged = self.staging_buff is not None and payload_bytes <= len(self.staging_buff.bytearray())
+            payload = memoryview((self.staging_buff if staged else frame_buff).bytearray())[:payload_bytes]
+            # The slave prepares the payload after the acknowledgement
+            utime.sleep_us(self.spi.start_delay)
+            if frame_format == CameraSlaveControl.FORMAT_FUSED and self.thermal_buff is not None:
+                # The thermal frame for the next fused frame goes in the other direction. The slave sends
+                # fused frames while its control requests them, the last one sent may have been rejected.
+                thermal = memoryview(self.thermal_buff.bytearray())[:CameraSlaveControl.THERMAL_BYTES]
+                both = min(payload_bytes, CameraSlaveControl.THERMAL_BYTES)
+                self.spi.send_recv(thermal[:both], payload[:both])
+                if payload_bytes > both:
+                    self.spi.recv(payload[both:])
+                elif CameraSlaveControl.THERMAL_BYTES > both:
+                    self.spi.send(thermal[both:])
+            else:
+                self.spi.recv(payload)
+        finally:
+            self.spi.release()
+
+        check = crc16(self._header, CameraSlaveControl.HEADER_CRC_BYTES, 0xFFFF, self._crc_table)
+        if crc16(payload, payload_bytes, check, self._crc_table) != crc:
+            if not staged:
+                self.frame_buff = frame_buff
+                self.frame_valid = False
+            return False
+
+        if codec == CameraSlaveControl.CODEC_RLE565:
+            self.compressed_frames += 1
+            pixels = frame_bytes // 2
+            if rle565_decode(payload, payload_bytes // 2, frame_buff, pixels, CameraSlaveControl.FRAME_WIDTHS[frame_format]) != pixels:
+                # Only a bug of the codec, the stream passed the crc
+                self.frame_buff = frame_buff
+                self.frame_valid = False
+                return False
+        elif staged:
+            memoryview(frame_buff.bytearray())[:payload_bytes] = payload
+        self.frame_buff = frame_buff
+        self.frame_valid = True
+        self.frame_format = frame_format
+        self.frame_counter = counter
+        self.frame_time_ms = time_ms
         return True
 
+    def _header_frame_buff(self, payload_bytes, codec, frame_format):
+        """ Buffer of the frame announced by the header, None when the header does not make sense """
+        if frame_format >= len(CameraSlaveControl.FRAME_BYTES):
+            return None
+        # QVGA and fused frames go to the target
+        frame_buff = self.qqvga_buff if frame_format == CameraSlaveControl.FORMAT_QQVGA else self._target_buff
+        if codec == CameraSlaveControl.CODEC_RLE565:
+            if self.staging_buff is None or payload_bytes > len(self.staging_buff.bytearray()) or payload_bytes & 1:
+                return None
+        elif codec != CameraSlaveControl.CODEC_NONE or payload_bytes != CameraSlaveControl.FRAME_BYTES[frame_format]:
+            return None
+        return frame_buff
+
+    def _send_payload_ack(self, ack):
+        # The slave waits for it after sending the header
+        utime.sleep_us(self.spi.start_delay)
+        self._payload_ack[0] = ack
+        self.spi.send(self._payload_ack)
+
+    def reset_counters(self):
+        self.received_frames = 0
+        self.repeated_frames = 0
+        self.compressed_frames = 0
+        self.invalid_frames = 0
+        self.timeouts = 0
+        self.wait_us = MicrosecondHistogram()
+
     def increase_column_offset(self):
         self.control.column_offset += 1
 
@@ -91,62 +314,141 @@ class CameraSlave():
         self.control.row_zoom_denominator = 20
 
 
-class CameraSlaveControl():
-    COLUMN_OFFSET = const(0)
-    ROW_OFFSET = const(1)
-    COLUMN_ZOOM_NUMERATOR = const(2)
-    COLUMN_ZOOM_DENOMINATOR = const(3)
-    ROW_ZOOM_NUMERATOR = const(4)
-    ROW_ZOOM_DENOMINATOR = const(5)
-
-    def __init__(self):
-        self.buff = bytearray(6)
-
-    @property
-    def column_offset(self):
-        return self.buff[COLUMN_OFFSET]
-
-    @column_offset.setter
-    def column_offset(self, column_offset):
-        self.buff[COLUMN_OFFSET] = column_offset
-
-    @property
-    def row_offset(self):
-        return self.buff[ROW_OFFSET]
-
-    @row_offset.setter
-    def row_offset(self, row_offset):
-        self.buff[ROW_OFFSET] = row_offset
-
-    @property
-    def column_zoom_numerator(self):
-        return self.buff[COLUMN_ZOOM_NUMERATOR]
-
-    @column_zoom_numerator.setter
-    def column_zoom_numerator(self, column_zoom_numerator):
-        self.buff[COLUMN_ZOOM_NUMERATOR] = column_zoom_numerator
-
+class LinkTuner():
+    """ Fastest baudrate and start_delay of the camera slave link without errors
+
+    The candidates go from the fastest to the slowest one. calibrate() tries them in order with
+    raw QVGA frames (the longest transfer, checked by CameraSlave.sync) and keeps the first one
+    which sends test_frames without errors. update() follows the frames of the main loop and backs
+    off to the next slower baudrate, without a shorter start_delay, when more than max_errors of
+    window frames fail.
+    The test frames are received in the target_buff of check and calibrate (rx_buff of the camera
+    slave when None), the frame buffer which is free at the time of the call.
+    """
+    BAUDRATES = (54000000, 45000000, 40000000, 36000000, 30000000, 27000000, 20000000)
+    START_DELAYS = (100, 200, 300, 500, 1000)
+
+    def __init__(self, camera_slave, test_frames=8, window=64, max_errors=2, timeout_ms=1000):
+        self.camera_slave = camera_slave
+        self.candidates = [(baudrate, start_delay) for baudrate in self.BAUDRATES for start_delay in self.START_DELAYS]
+        self.test_frames = test_frames
+        self.window = window
+        self.max_errors = max_errors
+        self.timeout_ms = timeout_ms
+        self.index = None # Candidate in use, None while the link has the initial settings
+        self.backoffs = 0
+        self.calibration_requested = False
+        self._received_frames = 0
+        self._invalid_frames = 0
+        self._window_frames = 0
+        self._window_errors = 0
 
     @property
-    def column_zoom_denominator(self):
-        return self.buff[COLUMN_ZOOM_DENOMINATOR]
-
-    @column_zoom_denominator.setter
-    def column_zoom_denominator(self, column_zoom_denominator):
-        self.buff[COLUMN_ZOOM_DENOMINATOR] = column_zoom_denominator
-
-    @property
-    def row_zoom_numerator(self):
-        return self.buff[ROW_ZOOM_NUMERATOR]
-
-    @row_zoom_numerator.setter
-    def row_zoom_numerator(self, row_zoom_numerator):
-        self.buff[ROW_ZOOM_NUMERATOR] = row_zoom_numerator
+    def baudrate(self):
+        return self.camera_slave.spi.baudrate
 
     @property
-    def row_zoom_denominator(self):
-        return self.buff[ROW_ZOOM_DENOMINATOR]
+    def start_delay(self):
+        return self.camera_slave.spi.start_delay
+
+    def select(self, baudrate, start_delay):
+        """ False when they are not a candidate """
+        if (baudrate, start_delay) not in self.candidates:
+            return False
+        self._apply(self.candidates.index((baudrate, start_delay)))
+        return True
 
-    @row_zoom_denominator.setter
-    def row_zoom_denominator(self, row_zoom_denominator):
-        self.buff[ROW_ZOOM_DENOMINATOR] = row_zoom_denominator
+    def _apply(self, index):
+        self.index = index
+        baudrate, start_delay = self.candidates[index]
+        self.camera_slave.spi.set_baudrate(baudrate)
+        self.camera_slave.spi.start_delay = start_delay
+        self._window_frames = 0
+        self._window_errors = 0
+
+    def _test(self, target_buff):
+        """ Errors in test_frames frames (stops at the first one), None when the slave is not ready in time """
+        camera_slave = self.camera_slave
+        for _ in range(self.test_frames):
+            # Without the cancel condition of the main loop
+            camera_slave.sync_start()
+            start_ms = utime.ticks_ms()
+            while not camera_slave.sync_ready():
+                if utime.ticks_diff(utime.ticks_ms(), start_ms) > self.timeout_ms:
+                    return None
+            if not camera_slave.sync(ignore_busy=True, target_buff=target_buff):
+                return 1
+        return 0
+
+    def request_calibration(self):
+        """ The main loop calibrates when it syncs the next visual frame """
+        self.calibration_requested = True
+
+    def check(self, target_buff=None):
+        """ The current settings send test frames without errors """
+        return self._with_test_control(lambda: self._test(target_buff)) == 0
+
+    def calibrate(self, target_buff=None):
+        """ True when a candidate without errors was found, the slowest candidate is used otherwise.
+        The initial settings are kept when the slave does not answer. """
+        self.calibration_requested = False
+        def search():
+            initial = (self.baudrate, self.start_delay, self.index)
+            for index in range(len(self.candidates)):
+                self._apply(index)
+                errors = self._test(target_buff)
+                if errors is None:
+                    self.camera_slave.spi.set_baudrate(initial[0])
+                    self.camera_slave.spi.start_delay = initial[1]
+                    self.index = initial[2]
+                    return False
+                if errors == 0:
+                    return True
+            return False
+        return self._with_test_control(search)
+
+    def _with_test_control(self, function):
+        control = self.camera_slave.control
+        frame_format = control.frame_format
+        compression = control.compression
+        control.frame_format = CameraSlaveControl.FORMAT_QVGA
+        control.compression = CameraSlaveControl.CODEC_NONE
+        try:
+            return function()
+        finally:
+            control.frame_format = frame_format
+            control.compression = compression
+            self._received_frames = self.camera_slave.received_frames
+            self._invalid_frames = self.camera_slave.invalid_frames
+
+    def _backoff_index(self):
+        """ First candidate with a lower baudrate and the same or a longer start_delay, None without one.
+        The next candidate in the list can have a shorter start_delay, which may bring the errors back. """
+        if self.index is None:
+            return None
+        baudrate, start_delay = self.candidates[self.index]
+        for index in range(self.index + 1, len(self.candidates)):
+            if self.candidates[index][0] < baudrate and self.candidates[index][1] >= start_delay:
+                return index
+        return None
+
+    def update(self):
+        """ Call it after the syncs of the main loop, True when it moved to a slower candidate """
+        camera_slave = self.camera_slave
+        self._window_frames += camera_slave.received_frames - self._received_frames
+        self._window_errors += camera_slave.invalid_frames - self._invalid_frames
+        self._received_frames = camera_slave.received_frames
+        self._invalid_frames = camera_slave.invalid_frames
+        if self._window_errors > self.max_errors:
+            index = self._backoff_index()
+            if index is None:
+                self._window_frames = 0
+                self._window_errors = 0
+                return False
+            self.backoffs += 1
+            self._apply(index)
+            return True
+        if self._window_frames >= self.window:
+            self._window_frames = 0
+            self._window_errors = 0
+        return False
@@ -20,6 +20,10 @@
 #OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #SOFTWARE.
 
+from ustruct import pack_into, unpack_from
+
+from utils.image import crc16, MIX_ALPHA_MAX
+
 class CameraSlaveControl():
     COLUMN_OFFSET = const(0)
     ROW_OFFSET = const(1)
@@ -27,9 +31,72 @@ class CameraSlaveControl():
     COLUMN_ZOOM_DENOMINATOR = const(3)
     ROW_ZOOM_NUMERATOR = const(4)
     ROW_ZOOM_DENOMINATOR = const(5)
+    FRAME_FORMAT = const(6)
+    COMPRESSION = const(7)
+    FUSION_ALPHA = const(8)
+    FUSION_THRESHOLD_LOW = const(9)
+    FUSION_THRESHOLD_HIGH = const(10)
+    FUSION_BYTESWAP = const(11)
+    # Leading bytes of the control which change the crop, and those which change the frame sent (with
+    # the format and compression), the fusion bytes only change the blend of the next frame built
+    FOV_CONTROL_BYTES = const(6)
+    FRAME_CONTROL_BYTES = const(8)
+    # utils.image.crc16 of the previous bytes, the slave only takes a control which passes it (see load)
+    CONTROL_CRC = const(12)
+    CONTROL_BYTES = const(14)
+
+    # Frame formats of the visual camera, requested by the master for the next frame
+    FORMAT_QVGA = const(0) # 320x240 RGB565
+    FORMAT_QQVGA = const(1) # 160x120 RGB565, every second column and row of the QVGA frame
+    # 320x240 RGB565 with the thermal frame of the master blended by the slave (utils.image.qqgrey2qvga_blend
+    # with the fusion fields of the control). While the master requests it, it sends its 160x120
+    # grey thermal frame (THERMAL_BYTES) during the payload (and after it if the payload is shorter).
+    FORMAT_FUSED = const(2)
+    FRAME_BYTES = (320 * 240 * 2, 160 * 120 * 2, 320 * 240 * 2)
+    FRAME_WIDTHS = (320, 160, 320)
+    THERMAL_BYTES = const(19200)
+
+    # Codecs of the frame. With compression the frames which do not fit in COMPRESSED_MAX_BYTES are
+    # sent with CODEC_NONE.
+    CODEC_NONE = const(0)
+    CODEC_RLE565 = const(1) # utils.image.rle565_encode
+    COMPRESSED_MAX_BYTES = 320 * 240
+
+    # Header sent before every frame: payload bytes, codec, frame format, frame counter, capture time
+    # (ms, clock of the slave) and utils.image.crc16 of the previous fields (HEADER_CRC_BYTES) and the payload
+    HEADER_FORMAT = "<IBBIIH"
+    HEADER_BYTES = const(16)
+    HEADER_CRC_BYTES = const(14)
+    # Byte sent by the master after the header. The payload follows only with PAYLOAD_SEND, the
+    # master skips it when the header does not make sense or the frame counter is the one it has.
+    PAYLOAD_SEND = const(0x5A)
+    PAYLOAD_SKIP = const(0x00)
 
     def __init__(self):
-        self.buff = bytearray(6)
+        self.buff = bytearray(CONTROL_BYTES)
+        # Whole frame until the master loads its calibration, the slave rejects a zoom factor of 0
+        self.column_zoom_numerator = 20
+        self.column_zoom_denominator = 20
+        self.row_zoom_numerator = 20
+        self.row_zoom_denominator = 20
+
+    def seal(self, crc_table):
+        """ Stores the crc of the fields, the master calls it before sending the control """
+        pack_into("<H", self.buff, CONTROL_CRC, crc16(self.buff, CONTROL_CRC, 0xFFFF, crc_table))
+
+    def load(self, buff, crc_table):
+        """ Takes a control received by the slave. False keeps the current one when the crc fails or a
+        field is out of range, the slave indexes the formats and divides by the zoom factors with them. """
+        if unpack_from("<H", buff, CONTROL_CRC)[0] != crc16(buff, CONTROL_CRC, 0xFFFF, crc_table):
+            return False
+        if (buff[FRAME_FORMAT] >= len(self.FRAME_BYTES) or buff[COMPRESSION] > CODEC_RLE565
+                or buff[ROW_OFFSET] >= 240 # Rows of the visual frame, the columns fit in a byte
+                or not buff[COLUMN_ZOOM_NUMERATOR] or not buff[COLUMN_ZOOM_DENOMINATOR]
+                or not buff[ROW_ZOOM_NUMERATOR] or not buff[ROW_ZOOM_DENOMINATOR]
+                or buff[FUSION_ALPHA] > MIX_ALPHA_MAX or buff[FUSION_BYTESWAP] > 1):
+            return False
+        self.buff[:] = buff
+        return True
 
     @property
     def column_offset(self):
@@ -79,3 +146,48 @@ class CameraSlaveControl():
     @row_zoom_denominator.setter
     def row_zoom_denominator(self, row_zoom_denominator):
         self.buff[ROW_ZOOM_DENOMINATOR] = row_zoom_denominator
+
+    @property
+    def frame_format(self):
+        return self.buff[FRAME_FORMAT]
+
+    @frame_format.setter
+    def frame_format(self, frame_format):
+        self.buff[FRAME_FORMAT] = frame_format
+
+    @property
+    def frame_bytes(self):
+        return self.FRAME_BYTES[self.buff[FRAME_FORMAT]]
+
+    @property
+    def compression(self):
+        return self.buff[COMPRESSION]
+
+    @compression.setter
+    def compression(self, compression):
+        self.buff[COMPRESSION] = compression
+
+    def set_fusion(self, alpha, threshold_low, threshold_high, byteswap):
+        """ Blend of the FORMAT_FUSED frames (see Control.mix_grey_levels), grey levels out of range blend nothing """
+        if threshold_low > 255 or threshold_high < 0:
+            threshold_low, threshold_high = 255, 0
+        self.buff[FUSION_ALPHA] = alpha
+        self.buff[FUSION_THRESHOLD_LOW] = max(0, threshold_low)
+        self.buff[FUSION_THRESHOLD_HIGH] = min(255, threshold_high)
+        self.buff[FUSION_BYTESWAP] = 1 if byteswap else 0
+
+    @property
+    def fusion_alpha(self):
+        return self.buff[FUSION_ALPHA]
+
+    @property
+    def fusion_threshold_low(self):
+        return self.buff[FUSION_THRESHOLD_LOW]
+
+    @property
+    def fusion_threshold_high(self):
+        return self.buff[FUSION_THRESHOLD_HIGH]
+
+    @property
+    def fusion_byteswap(self):
+        return self.buff[FUSION_BYTESWAP]
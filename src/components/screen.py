@@ -27,7 +27,41 @@ from ustruct import pack
 import sensor
 from uctypes import bytearray_at
 
-from utils.image import pixel2pixel
+from utils.image import pixel2pixel, tile_checksums
+
+class ScreenTransfer():
+    """ Frame sent to the screen in chunks (see Screen.write_to_screen_async).
+
+    The bus stays locked from the start until the last chunk is sent, other devices using the
+    DynamicSPI lock with a release_callback are served when it completes, the ones without it
+    complete it first (see DynamicSPI.hold).
+    """
+
+    def __init__(self, screen, data, chunk_bytes):
+        self.screen = screen
+        self.data = memoryview(data.bytearray())
+        self.offset = 0
+        self.chunk_bytes = chunk_bytes
+
+    def done(self):
+        return self.offset >= len(self.data)
+
+    def send_chunk(self):
+        """ Sends the next chunk, returns True when the transfer is complete """
+        if self.done():
+            return True
+        end = min(len(self.data), self.offset + self.chunk_bytes)
+        self.screen.hspi.send(self.data[self.offset:end])
+        self.offset = end
+        if self.done():
+            self.screen.hspi.release()
+            return True
+        return False
+
+    def wait(self):
+        while not self.send_chunk():
+            pass
+
 
 class Screen():
     st7735 = const(1)
@@ -40,15 +74,47 @@ class Screen():
     _CASET = const(0x2A) # Column Address Set
     _RASET = const(0x2B) # Row Address set
     _RAMWR = const(0x2C) #write to screen memory
+    _TILE_WIDTH = const(40) # Tiles of the partial updates
+    _TILE_HEIGHT = const(16)
+    _WINDOW_COST = const(11) # Bytes of the commands to select a window (CASET, RASET and RAMWR)
 
     def send_spi(self,data, is_data):
+        self.wait_transfer()
         self.dc.value(is_data) #set data/command pin
         self.hspi.lock()
         self.hspi.write(data)
         self.hspi.release()
 
+    def send_commands(self, commands, keep_locked=False):
+        """ Sends the (command, data) pairs under a single lock, only the DC pin changes between them
+        (data can be None). keep_locked: the bus is left locked in data mode, to send the pixels
+        after a RAMWR and release it """
+        self.wait_transfer()
+        self.hspi.lock()
+        for command, data in commands:
+            self.dc.value(False)
+            self._command_buff[0] = command
+            self.hspi.write(self._command_buff)
+            self.dc.value(True)
+            if data is not None:
+                self.hspi.write(data)
+        if not keep_locked:
+            self.hspi.release()
+
+    def window_commands(self, x, y, width, height):
+        """ Commands to write the pixels of a window, the window is only set if it changed """
+        commands = []
+        if self.window != (x, y, width, height):
+            commands.append((_CASET, pack(">HH", x, x + width - 1)))
+            commands.append((_RASET, pack(">HH", y, y + height - 1)))
+            self.window = (x, y, width, height)
+        commands.append((_RAMWR, None))
+        return commands
+
     def __init__(self, spi, alloc_screen_buff, width, height, pin_dc, framebuffer_swap_endianness=False, fast_byteswap=False):
 
+        self.screen_buff = None
+        self.back_buff = None # Optional second frame buffer, see alloc_back_buff
         if alloc_screen_buff:
             self.screen_buff = sensor.alloc_extra_fb(width, height, sensor.RGB565)
         self.width = width
@@ -57,12 +123,55 @@ class Screen():
         self.hspi = spi
         self.dc = Pin(pin_dc, Pin.OUT_PP)
         self.dc.value(0)
+        self._command_buff = bytearray(1)
         self.framebuffer_swap_endianness = framebuffer_swap_endianness
         self.fast_byteswap = fast_byteswap
+        self.window = None
+
+        # Partial updates, only the tiles whose checksum changed are sent
+        self.tiles_columns = (width + _TILE_WIDTH - 1) // _TILE_WIDTH
+        self.tiles_rows = (height + _TILE_HEIGHT - 1) // _TILE_HEIGHT
+        self.tiles_checksums = None # Allocated with the first partial update
+        self.tiles_dirty = None
+        self.tiles_valid = False # The checksums are the ones of the screen content
+        self.partial_max_fraction = 0.5 # Above it a full write is cheaper
+
+        # Asynchronous writes
+        self.transfer = None
+        self.transfer_chunk_bytes = width * 2 * 20
+
+    def alloc_back_buff(self):
+        """ Second frame buffer to draw the next frame while the previous one is being sent.
+        It has to be allocated after the other frame buffers, there may be no memory left for it. """
+        try:
+            self.back_buff = sensor.alloc_extra_fb(self.width, self.height, sensor.RGB565)
+        except MemoryError:
+            print("No memory for the screen back buffer")
+            self.back_buff = None
+        return self.back_buff is not None
+
+    def swap_buffers(self):
+        if self.back_buff is not None:
+            self.screen_buff, self.back_buff = self.back_buff, self.screen_buff
+
+    def continue_transfer(self):
+        """ Sends the next chunk of the asynchronous write, returns True while it is not complete """
+        if self.transfer is None:
+            return False
+        if self.transfer.send_chunk():
+            self.transfer = None
+            return False
+        return True
+
+    def wait_transfer(self):
+        if self.transfer is not None:
+            transfer = self.transfer
+            self.transfer = None
+            transfer.wait()
 
     def initialize(self):
 
-        self.send_spi(bytearray([0x01]), False)  # Software Reset
+        self.send_commands(((_SWRESET, None),))
         utime.sleep_ms(10)
 
 
@@ -130,28 +239,126 @@ class Screen():
             (0xe1, b'\x00\x0e\x14\x03\x11\x07\x31\xc1\x48\x08\x0f\x0c\x31\x36\x0f')
         )  # Set Gamma
         # lcd_original lcd_tuned lcd_hsd lcd_tianma lcd_lg
-        for command, data in lcd_tianma:
-            self.send_spi(bytearray([command]), False)
-            if data is not None:
-                self.send_spi(data, True)
-        self.send_spi(bytearray([0x11]), False)  # Sleep out
+        self.send_commands(lcd_tianma + ((_SLPOUT, None),))
         utime.sleep_ms(120)
-        self.send_spi(bytearray([0x29]), False)  # Display ON
+        self.send_commands(((_DISPON, None),))
+        self.window = None
+        self.tiles_valid = False
 
 
     def set_window(self, x, y, width, height):
         x_end=x+width-1
         y_end=y+height-1
-        self.send_spi(bytearray([_CASET]),False)  # set Column addr command
-        self.send_spi(pack(">HH", x, x_end), True)  # x_end
-        self.send_spi(bytearray([_RASET]),False)  # set Row addr command
-        self.send_spi(pack(">HH", y, y_end), True)  # y_end
-
-    def write_to_screen(self, data):
-        self.send_spi(bytearray([_RAMWR]),False)  # set to write to RAM
-        self.dc.value(True) #set data/command pin
-        self.hspi.lock()
-        if self.framebuffer_swap_endianness:
+        self.send_commands((
+            (_CASET, pack(">HH", x, x_end)), # set Column addr command
+            (_RASET, pack(">HH", y, y_end)), # set Row addr command
+        ))
+        self.window = (x, y, width, height)
+
+    @staticmethod
+    def byteswap_color(color):
+        """ RGB565 value of an (r, g, b) color with the bytes in the screen order.
+        Used to draw on a frame buffer which is already byte swapped. """
+        r, g, b = color
+        pixel = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+        return ((pixel & 0xFF) << 8) | (pixel >> 8)
+
+    def dirty_windows(self):
+        """ Windows (x, y, width, height) covering the dirty tiles of the last checksum update.
+        One window per row of tiles (from the first to the last dirty tile), merged with the one
+        above when they have the same columns. """
+        windows = []
+        tile = 0
+        for tile_row in range(self.tiles_rows):
+            first = None
+            for tile_column in range(self.tiles_columns):
+                if self.tiles_dirty[tile + tile_column]:
+                    if first is None:
+                        first = tile_column
+                    last = tile_column
+            tile += self.tiles_columns
+            if first is None:
+                continue
+
+            x = first * _TILE_WIDTH
+            width = min(self.width, (last + 1) * _TILE_WIDTH) - x
+            y = tile_row * _TILE_HEIGHT
+            height = min(self.height, y + _TILE_HEIGHT) - y
+            if windows:
+                previous_x, previous_y, previous_width, previous_height = windows[-1]
+                if previous_x == x and previous_width == width and previous_y + previous_height == y:
+                    windows[-1] = (x, previous_y, width, previous_height + height)
+                    continue
+            windows.append((x, y, width, height))
+        return windows
+
+    def write_windows(self, data, windows):
+        """ Sends the windows of data (already in the byte order of the screen) """
+        m = memoryview(data.bytearray())
+        row_bytes = self.width * 2
+        for x, y, width, height in windows:
+            # Window, write to RAM and the pixels in a single lock
+            self.send_commands(self.window_commands(x, y, width, height), keep_locked=True)
+            if width == self.width:
+                self.hspi.send(m[y * row_bytes:(y + height) * row_bytes])
+            else:
+                for row in range(y, y + height):
+                    start = row * row_bytes + x * 2
+                    self.hspi.send(m[start:start + width * 2])
+            self.hspi.release()
+
+    def write_dirty_tiles(self, data):
+        """ Sends only the tiles changed since the previous call. Returns False when a full write is
+        needed instead (unknown screen content or too many changes), the checksums are updated anyway. """
+        if self.tiles_checksums is None:
+            tiles = self.tiles_columns * self.tiles_rows
+            self.tiles_checksums = bytearray(4 * tiles)
+            self.tiles_dirty = bytearray(tiles)
+        dirty_tiles = tile_checksums(data, self.tiles_checksums, self.tiles_dirty, self.width, self.height, _TILE_WIDTH, _TILE_HEIGHT)
+        if not self.tiles_valid:
+            self.tiles_valid = True
+            return False
+        if not dirty_tiles:
+            return True
+
+        windows = self.dirty_windows()
+        cost = sum(width * height * 2 + _WINDOW_COST for _, _, width, height in windows)
+        if cost > self.partial_max_fraction * self.width * self.height * 2:
+            return False
+        self.write_windows(data, windows)
+        return True
+
+    def write_to_screen_async(self, data, byteswapped=False):
+        """ Starts a full write and returns without sending the pixels. They are sent in chunks by
+        continue_transfer, the transfer is completed by wait_transfer or before any other command.
+        data must not be modified until then (see swap_buffers). """
+        self.wait_transfer()
+        self.tiles_valid = False
+        if self.framebuffer_swap_endianness and not byteswapped:
+            pixel2pixel(data)
+        self.send_commands(self.window_commands(0, 0, self.width, self.height), keep_locked=True)
+        self.transfer = ScreenTransfer(self, data, self.transfer_chunk_bytes)
+        # Another device of the main loop locking the bus completes it first
+        self.hspi.hold(self.wait_transfer)
+        return self.transfer
+
+    def write_to_screen(self, data, byteswapped=False, partial=False):
+        """ byteswapped: data is already in the byte order of the screen (e.g. qqgrey2qvga_palette)
+        partial: only send the tiles that changed since the previous partial write (menus, playback),
+        it falls back to a full write when the change is too big """
+        self.wait_transfer()
+        if partial and not self.fast_byteswap:
+            if self.framebuffer_swap_endianness and not byteswapped:
+                pixel2pixel(data)
+                byteswapped = True
+            if self.write_dirty_tiles(data):
+                return
+        else:
+            # The screen will not match the checksums anymore
+            self.tiles_valid = False
+
+        self.send_commands(self.window_commands(0, 0, self.width, self.height), keep_locked=True)
+        if self.framebuffer_swap_endianness and not byteswapped:
             if self.fast_byteswap:
                 # Sacrify one pixel and avoid needing a byte swap
                 # Make the count in the screen driver already increase by one
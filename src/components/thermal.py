@@ -24,6 +24,161 @@ import sensor
 import utime
 from pyb import LED
 import struct
+from ucollections import namedtuple
+
+from utils.image import grey_statistics, label_blobs, BLOB_STATS_SIZE
+
+class FrameStatistics():
+    """ Minimum, maximum, mean and histogram of a grayscale frame.
+    Computed once per frame with grey_statistics, the users read the cached values. """
+
+    def __init__(self, width=160, height=120):
+        self.width = width
+        self.height = height
+        self.histogram = bytearray(4 * 256)
+        self.result = bytearray(4 * 3)
+        self.minimum = 0
+        self.maximum = 0
+        self.mean = 0.0
+
+    def update(self, img):
+        size = self.width * self.height
+        grey_statistics(img, size, self.histogram, self.result)
+        self.minimum, self.maximum, total = struct.unpack("<III", self.result)
+        self.mean = total / size
+
+    def count(self, grey):
+        """ Pixels with that grey level """
+        return struct.unpack_from("<I", self.histogram, 4 * grey)[0]
+
+    def count_between(self, grey_low, grey_high):
+        """ Pixels from grey_low to grey_high (both included) """
+        counts = struct.unpack_from("<256I", self.histogram)
+        return sum(counts[grey_low:grey_high + 1])
+
+
+class BlobLabeler():
+    """ Blobs of a grayscale frame with their statistics, labelled in a single pass with label_blobs.
+    The buffers are allocated once, the number of blobs only changes the final python loop. """
+
+    Blob = namedtuple("Blob", ("x", "y", "w", "h", "cx", "cy", "pixels", "mean", "minimum", "maximum"))
+
+    def __init__(self, width=160, height=120, max_labels=128):
+        self.width = width
+        self.height = height
+        self.max_labels = max_labels
+        self.row_labels = bytearray(2 * 2 * width)
+        self.parents = bytearray(2 * (max_labels + 1))
+        self.stats = bytearray(4 * BLOB_STATS_SIZE * (max_labels + 1))
+        self.labels = 0
+
+    def find_blobs(self, img, threshold, pixels_threshold=0, area_threshold=0):
+        """ Blobs with the grey levels of threshold (min, max), filtered like img.find_blobs """
+        self.labels = label_blobs(img, self.width, self.height, threshold[0], threshold[1],
+                                  self.row_labels, self.parents, self.stats, self.max_labels)
+        blobs = []
+        for label in range(1, self.labels + 1):
+            if struct.unpack_from("<H", self.parents, 2 * label)[0] != label:
+                continue
+            pixels, sum_x, sum_y, sum_grey, x_min, y_min, x_max, y_max, grey_min, grey_max = struct.unpack_from(
+                "<10I", self.stats, 4 * BLOB_STATS_SIZE * label)
+            w = x_max - x_min + 1
+            h = y_max - y_min + 1
+            if pixels < pixels_threshold or w * h < area_threshold:
+                continue
+            blobs.append(self.Blob(x_min, y_min, w, h, sum_x // pixels, sum_y // pixels, pixels,
+                                   sum_grey / pixels, grey_min, grey_max))
+        return blobs
+
+
+class LeptonRegisters():
+    """ Cache of the Lepton CCI attributes in use, with their struct format
+
+    An attribute is read once and kept, a write goes to the Lepton only when the value is not the
+    cached one and updates the cache without reading it back. The volatile attributes (status and
+    measurements) are read every time. The GET command of an attribute is its address, SET is the
+    next one. reset() forgets the values, e.g. after sensor.reset() which restarts the Lepton.
+    """
+    AGC_ENABLE = const(0x0100)
+    AGC_CALCULATION_ENABLE = const(0x0148)
+    SYS_GAIN_MODE = const(0x0248)
+    RAD_ENABLE = const(0x4E10)
+    RAD_TSHUTTER_MODE = const(0x4E24)
+    RAD_TSHUTTER_TEMPERATURE = const(0x4E28)
+    RAD_RUN_STATUS = const(0x4E30)
+    RAD_FLUX_LINEAR_PARAMETERS = const(0x4EBC)
+    RAD_TLINEAR_ENABLE = const(0x4EC0)
+    RAD_TLINEAR_RESOLUTION = const(0x4EC4)
+    RAD_TLINEAR_AUTO_RESOLUTION = const(0x4EC8)
+    RAD_SPOTMETER_ROI = const(0x4ECC)
+    RAD_SPOTMETER_VALUE = const(0x4ED0)
+
+    # Attributes of a single field are ints, the others tuples
+    FORMATS = {
+        AGC_ENABLE: "<I",
+        AGC_CALCULATION_ENABLE: "<I",
+        SYS_GAIN_MODE: "<I",
+        RAD_ENABLE: "<I",
+        RAD_TSHUTTER_MODE: "<I",
+        RAD_TSHUTTER_TEMPERATURE: "<H",
+        RAD_RUN_STATUS: "<I",
+        RAD_FLUX_LINEAR_PARAMETERS: "<HHHHHHHH",
+        RAD_TLINEAR_ENABLE: "<I",
+        RAD_TLINEAR_RESOLUTION: "<I",
+        RAD_TLINEAR_AUTO_RESOLUTION: "<I",
+        RAD_SPOTMETER_ROI: "<HHHH",
+        RAD_SPOTMETER_VALUE: "<HHHH",
+    }
+    VOLATILE = (RAD_TSHUTTER_TEMPERATURE, RAD_RUN_STATUS, RAD_SPOTMETER_VALUE)
+
+    def __init__(self):
+        self.values = {}
+        self.reads = 0
+        self.writes = 0
+        self.hits = 0 # Reads and writes which did not need the CCI
+
+    def read(self, attribute):
+        if attribute in self.values:
+            self.hits += 1
+            return self.values[attribute]
+        attribute_format = self.FORMATS[attribute]
+        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, attribute, struct.calcsize(attribute_format) // 2)
+        self.reads += 1
+        value = struct.unpack(attribute_format, data)
+        if len(value) == 1:
+            value = value[0]
+        if attribute not in self.VOLATILE:
+            self.values[attribute] = value
+        return value
+
+    def read_all(self, *attributes):
+        """ Values of the attributes, only the ones which are not cached are read """
+        return tuple(self.read(attribute) for attribute in attributes)
+
+    def write(self, attribute, value):
+        """ True when it was sent to the Lepton """
+        if self.values.get(attribute) == value:
+            self.hits += 1
+            return False
+        attribute_format = self.FORMATS[attribute]
+        data = struct.pack(attribute_format, *value) if isinstance(value, tuple) else struct.pack(attribute_format, value)
+        sensor.ioctl(sensor.IOCTL_LEPTON_SET_ATTRIBUTE, attribute + 1, data)
+        self.writes += 1
+        self.values[attribute] = value
+        return True
+
+    def reset(self, *attributes):
+        """ Forgets the values of the attributes (all of them without arguments) """
+        if not attributes:
+            self.values = {}
+        for attribute in attributes:
+            self.values.pop(attribute, None)
+
+    def reset_counters(self):
+        self.reads = 0
+        self.writes = 0
+        self.hits = 0
+
 
 class Thermal():
 
@@ -47,8 +202,13 @@ class Thermal():
     reflWindow = 0
     TReflK = 0
 
+    _verbose = False # Logs the attributes which are only informative at configure (CCI round trips)
+
     def __init__(self, logger):
         self.logger = logger
+        self.registers = LeptonRegisters()
+        self.statistics = FrameStatistics()
+        self.blob_labeler = BlobLabeler()
 
     def initialize(self):
 
@@ -76,6 +236,8 @@ class Thermal():
         led_red.off()
         led_green.off()
         led_blue.off()
+        # The Lepton restarted with its default attributes
+        self.registers.reset()
         self.thermal_configure()
 
     def thermal_fcc(self):
@@ -90,34 +252,33 @@ class Thermal():
     def thermal_configure(self, static_range=None):
         self.logger.info("##############################################################")
         self.logger.info("SETTINGS")
+        registers = self.registers
         if static_range is not None:
             self.static_range = static_range
         if self.static_range:
             sensor.ioctl(sensor.IOCTL_LEPTON_SET_MEASUREMENT_MODE, True)
             sensor.ioctl(sensor.IOCTL_LEPTON_SET_MEASUREMENT_RANGE, self.static_minimum, self.static_maximum)
+            # The driver reconfigures the Lepton for the measurement mode, no cached value is known to hold
+            registers.reset()
 
         else:
             sensor.ioctl(sensor.IOCTL_LEPTON_SET_MEASUREMENT_MODE, False)
+            # Everything is written again, the measurement mode may have changed any of the attributes
+            registers.reset()
             self.logger.info("Setting: AGC Enable and Disable (Enable)")
-            sensor.ioctl(sensor.IOCTL_LEPTON_SET_ATTRIBUTE, 0x0101, struct.pack("<I", 1))
+            registers.write(LeptonRegisters.AGC_ENABLE, 1)
 
             self.logger.info("Setting: RAD Radiometry Control Enable")
-            sensor.ioctl(sensor.IOCTL_LEPTON_SET_ATTRIBUTE, 0x4E11, struct.pack("<I", 1))
+            registers.write(LeptonRegisters.RAD_ENABLE, 1)
 
-        self.logger.info("-------------------------------------------------------------")
-        self.logger.info("AGC:")
-        # TODO switch modes
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x0100, 2)
-        LEP_AGC_ENABLE_TAG = struct.unpack("<I", data)[0]
-        #LEP_AGC_DISABLE=0,
-        #LEP_AGC_ENABLE
-        self.logger.info("AGC Enable and Disable", LEP_AGC_ENABLE_TAG)
-
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x0148, 2)
-        LEP_AGC_ENABLE_TAG = struct.unpack("<I", data)[0]
-        #LEP_AGC_DISABLE=0,
-        #LEP_AGC_ENABLE
-        self.logger.info("AGC Calculation Enable State", LEP_AGC_ENABLE_TAG)
+        if self._verbose:
+            # Only logged, every attribute is a CCI round trip
+            self.logger.info("-------------------------------------------------------------")
+            self.logger.info("AGC:")
+            #LEP_AGC_DISABLE=0,
+            #LEP_AGC_ENABLE
+            self.logger.info("AGC Enable and Disable", registers.read(LeptonRegisters.AGC_ENABLE))
+            self.logger.info("AGC Calculation Enable State", registers.read(LeptonRegisters.AGC_CALCULATION_ENABLE))
 
         self.receive_gain_mode()
         self.send_gain_mode()
@@ -155,64 +316,47 @@ class Thermal():
 
         ###############################################################
         # RADIOMETRY
-        self.logger.info("-------------------------------------------------------------")
-        self.logger.info("RADIOMETRY:")
-
         self.thermal_fcc()
         sensor.snapshot()
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x4E24, 2)
-        FLR_RAD_TS_MODE_E_TAG = struct.unpack("<I", data)[0]
-        #FLR_RAD_TS_USER_MODE = 0
-        #FLR_RAD_TS_CAL_MODE = 1
-        #FLR_RAD_TS_FIXED_MODE = 2
-        #FLR_RAD_TS_END_TS_MODE = 3
-        self.logger.info("RAD TShutter Mode", FLR_RAD_TS_MODE_E_TAG)
-
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x4E10, 2)
-        LEP_RAD_ENABLE_E_TAG = struct.unpack("<I", data)[0]
-        #LEP_RAD_DISABLE = 0,
-        #LEP_RAD_ENABLE,
-        self.logger.info("RAD Radiometry Control Enable", LEP_RAD_ENABLE_E_TAG)
-
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x4E28, 1)
-        LEP_RAD_KELVIN_T = struct.unpack("<H", data)[0]
-        self.logger.info("RAD TShutter Temperature", LEP_RAD_KELVIN_T)
-
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x4E30, 2)
-        LEP_RAD_STATUS_E = struct.unpack("<I", data)[0]
-        #LEP_RAD_STATUS_ERROR = -1,
-        #LEP_RAD_STATUS_READY = 0,
-        #LEP_RAD_STATUS_BUSY,
-        #LEP_RAD_FRAME_AVERAGE_COLLECTING_FRAMES
-        self.logger.info("RAD Run Status", LEP_RAD_STATUS_E)
-
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x4EC0, 2)
-        LEP_RAD_ENABLE_E_TAG = struct.unpack("<I", data)[0]
-        #LEP_RAD_DISABLE = 0,
-        #LEP_RAD_ENABLE,
-        self.logger.info("RAD T-Linear Enable State", LEP_RAD_ENABLE_E_TAG)
-
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x4EC8, 2)
-        LEP_RAD_ENABLE_E_TAG = struct.unpack("<I", data)[0]
-        #LEP_RAD_DISABLE = 0,
-        #LEP_RAD_ENABLE,
-        self.logger.info("RAD T-Linear Auto Resolution", LEP_RAD_ENABLE_E_TAG)
+
+        if self._verbose:
+            self.logger.info("-------------------------------------------------------------")
+            self.logger.info("RADIOMETRY:")
+            values = registers.read_all(
+                LeptonRegisters.RAD_TSHUTTER_MODE, LeptonRegisters.RAD_ENABLE, LeptonRegisters.RAD_TSHUTTER_TEMPERATURE,
+                LeptonRegisters.RAD_RUN_STATUS, LeptonRegisters.RAD_TLINEAR_ENABLE, LeptonRegisters.RAD_TLINEAR_AUTO_RESOLUTION,
+            )
+            #FLR_RAD_TS_USER_MODE = 0
+            #FLR_RAD_TS_CAL_MODE = 1
+            #FLR_RAD_TS_FIXED_MODE = 2
+            #FLR_RAD_TS_END_TS_MODE = 3
+            self.logger.info("RAD TShutter Mode", values[0])
+            #LEP_RAD_DISABLE = 0,
+            #LEP_RAD_ENABLE,
+            self.logger.info("RAD Radiometry Control Enable", values[1])
+            self.logger.info("RAD TShutter Temperature", values[2])
+            #LEP_RAD_STATUS_ERROR = -1,
+            #LEP_RAD_STATUS_READY = 0,
+            #LEP_RAD_STATUS_BUSY,
+            #LEP_RAD_FRAME_AVERAGE_COLLECTING_FRAMES
+            self.logger.info("RAD Run Status", values[3])
+            self.logger.info("RAD T-Linear Enable State", values[4])
+            self.logger.info("RAD T-Linear Auto Resolution", values[5])
 
         startRow = 0
         startCol = 0
         endRow = sensor.height() - 1
         endCol = sensor.width() - 1
-        data = struct.pack("<HHHH", startRow, startCol, endRow, endCol)
-        sensor.ioctl(sensor.IOCTL_LEPTON_SET_ATTRIBUTE, 0x4ECD, data)
-
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x4ECC, 4)
-        startRow_rx, startCol_rx, endRow_rx, endCol_rx = struct.unpack("<HHHH", data)
-        self.logger.info("Spotmeter {} {} {} {}".format(startRow_rx, startCol_rx, endRow_rx, endCol_rx))
-        if startRow != startRow_rx or startCol != startCol_rx or endRow != endRow_rx or endCol != endCol_rx:
-            raise ValueError("Spotmeter wrong window")
-
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x4EC4, 2)
-        self.thermal_tlinear_resolution = 0.01 if struct.unpack("<I", data)[0] else 0.1
+        window = (startRow, startCol, endRow, endCol)
+        if registers.write(LeptonRegisters.RAD_SPOTMETER_ROI, window):
+            # The only write which is read back, the temperatures depend on it
+            registers.reset(LeptonRegisters.RAD_SPOTMETER_ROI)
+            window_rx = registers.read(LeptonRegisters.RAD_SPOTMETER_ROI)
+            self.logger.info("Spotmeter {} {} {} {}".format(*window_rx))
+            if window != window_rx:
+                raise ValueError("Spotmeter wrong window")
+
+        self.thermal_tlinear_resolution = 0.01 if registers.read(LeptonRegisters.RAD_TLINEAR_RESOLUTION) else 0.1
         self.logger.info("thermal_tlinear_resolution", self.thermal_tlinear_resolution)
 
         self.receive_flux_parameters()
@@ -220,8 +364,8 @@ class Thermal():
         self.logger.info("##############################################################")
 
     def receive_flux_parameters(self):
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x4EBC, 8)
-        self.sceneEmissivity, self.TBkgK, self.tauWindow, self.TWindowK, self.tauAtm, self.TAtmK, self.reflWindow, self.TReflK = struct.unpack("<HHHHHHHH", data)
+        (self.sceneEmissivity, self.TBkgK, self.tauWindow, self.TWindowK, self.tauAtm, self.TAtmK, self.reflWindow,
+         self.TReflK) = self.registers.read(LeptonRegisters.RAD_FLUX_LINEAR_PARAMETERS)
         self.logger.info(
             "RAD Flux Linear Parameters:",
             "\nsceneEmissivity", self.sceneEmissivity,
@@ -235,9 +379,9 @@ class Thermal():
         )
 
     def send_flux_parameters(self):
-        data = struct.pack("<HHHHHHHH", self.sceneEmissivity, self.TBkgK, self.tauWindow, self.TWindowK, self.tauAtm, self.TAtmK, self.reflWindow, self.TReflK)
-        sensor.ioctl(sensor.IOCTL_LEPTON_SET_ATTRIBUTE, 0x4EBD, data)
-        self.receive_flux_parameters()
+        self.registers.write(LeptonRegisters.RAD_FLUX_LINEAR_PARAMETERS, (
+            self.sceneEmissivity, self.TBkgK, self.tauWindow, self.TWindowK, self.tauAtm, self.TAtmK, self.reflWindow, self.TReflK
+        ))
 
     @property
     def emissivity(self):
@@ -261,17 +405,15 @@ class Thermal():
         self.gain_mode += 1
         if self.gain_mode > 2:
             self.gain_mode = 0
+        self.send_gain_mode()
 
     def send_gain_mode(self):
-        data = struct.pack("<I", self.gain_mode)
-        sensor.ioctl(sensor.IOCTL_LEPTON_SET_ATTRIBUTE, 0x0249, data)
-        self.logger.info("Setting: SYS Gain Mode to ", self.gain_mode)
-        self.receive_gain_mode()
+        if self.registers.write(LeptonRegisters.SYS_GAIN_MODE, self.gain_mode):
+            self.logger.info("Setting: SYS Gain Mode to ", self.gain_mode)
 
     def receive_gain_mode(self):
         # TODO switch modes
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x0248, 2)
-        self.gain_mode = struct.unpack("<I", data)[0]
+        self.gain_mode = self.registers.read(LeptonRegisters.SYS_GAIN_MODE)
         #LEP_SYS_GAIN_MODE_HIGH = 0,
         #LEP_SYS_GAIN_MODE_LOW,
         #LEP_SYS_GAIN_MODE_AUTO,
@@ -282,13 +424,46 @@ class Thermal():
         return (tlinear * self.thermal_tlinear_resolution) - 273.15
 
     def get_spotmeter_values(self):
-        data = sensor.ioctl(sensor.IOCTL_LEPTON_GET_ATTRIBUTE, 0x4ED0, 4)
-        radSpotmeterValue, radSpotmeterMaxValue, radSpotmeterMinValue, radSpotmeterPopulation = struct.unpack("<HHHH", data)
+        radSpotmeterValue, radSpotmeterMaxValue, radSpotmeterMinValue, radSpotmeterPopulation = self.registers.read(LeptonRegisters.RAD_SPOTMETER_VALUE)
 
         self.temperature_mean = self.tlinear2celcius(radSpotmeterValue)
         self.temperature_max = self.tlinear2celcius(radSpotmeterMaxValue)
         self.temperature_min = self.tlinear2celcius(radSpotmeterMinValue)
 
+    def update_statistics(self, img):
+        """ Statistics of the last frame (see FrameStatistics) and its temperatures, call it once after
+        the snapshot instead of get_spotmeter_values. With the static range the grey levels are linear
+        in it and the temperatures come from the statistics, with AGC they only come from the spotmeter. """
+        statistics = self.statistics
+        statistics.update(img)
+        if self.static_range:
+            static_grey = (self.static_maximum - self.static_minimum) / 255.0
+            self.temperature_min = statistics.minimum * static_grey + self.static_minimum
+            self.temperature_max = statistics.maximum * static_grey + self.static_minimum
+            self.temperature_mean = statistics.mean * static_grey + self.static_minimum
+        else:
+            self.get_spotmeter_values()
+        return statistics
+
+    def find_blobs(self, img, threshold, pixels_threshold=0, area_threshold=0):
+        """ Blobs of the last frame (see BlobLabeler) """
+        return self.blob_labeler.find_blobs(img, threshold, pixels_threshold, area_threshold)
+
+    def grey_range_temperatures(self):
+        """ Temperatures of grey 0 and grey 255: the static range, with AGC the minimum and maximum of the frame """
+        if self.static_range:
+            return self.static_minimum, self.static_maximum
+        return self.temperature_min, self.temperature_max
+
+    def grey2celcius(self, grey, static_range=None):
+        """ Temperature of a grey level (see grey_range_temperatures). The playback maps the range saved
+        with the frame, static_range=False. """
+        if static_range is None:
+            static_range = self.static_range
+        if static_range:
+            return ((grey * (self.static_maximum - self.static_minimum)) / 255.0) + self.static_minimum
+        return ((grey * (self.temperature_max - self.temperature_min)) / 255.0) + self.temperature_min
+
     def get_thermal_statistics(self):
 
         string = ""
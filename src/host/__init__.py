@@ -0,0 +1,85 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# Host (CPython) support to run the OPENMV python code on a PC.
+#
+# The folder "stubs" contains stand-ins for the MicroPython/OPENMV specific modules. They are only
+# meant to execute and measure the code of this repository, they are not a full emulation.
+
+import ast
+import importlib.machinery
+import sys
+import os
+
+stubs_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+src_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _constants(source):
+    """ Names assigned with const() anywhere in the source.
+
+    The MicroPython compiler replaces them in the whole module, so they can be used without the
+    class prefix (e.g. _CASET in components/screen.py).
+    """
+    constants = {}
+    for node in ast.walk(ast.parse(source)):
+        if (
+            isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name) and
+            isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name) and
+            node.value.func.id == "const" and len(node.value.args) == 1
+        ):
+            expression = ast.Expression(node.value.args[0])
+            constants[node.targets[0].id] = eval(compile(expression, "<const>", "eval"), {}, dict(constants))
+    return constants
+
+
+class _ConstLoader(importlib.machinery.SourceFileLoader):
+
+    def exec_module(self, module):
+        module.__dict__.update(_constants(self.get_source(module.__name__)))
+        super().exec_module(module)
+
+
+class _ConstFinder():
+    """ Loads the modules of the repository (not the host ones) with _ConstLoader """
+
+    @classmethod
+    def find_spec(cls, name, path=None, target=None):
+        spec = importlib.machinery.PathFinder.find_spec(name, path)
+        if spec is None or not spec.origin or not spec.origin.endswith(".py"):
+            return spec
+        origin = os.path.abspath(spec.origin)
+        host_path = os.path.dirname(os.path.abspath(__file__))
+        if origin.startswith(src_path + os.sep) and not origin.startswith(host_path + os.sep):
+            spec.loader = _ConstLoader(spec.name, spec.origin)
+        return spec
+
+
+def install_stubs():
+    """ Make the stand-in modules importable before any module of the repository is loaded """
+    for path in (src_path, stubs_path):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+    if _ConstFinder not in sys.meta_path:
+        sys.meta_path.insert(0, _ConstFinder)
+    import micropython  # Installs the viper builtins (ptr8, ptr16, const...)
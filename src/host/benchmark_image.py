@@ -0,0 +1,354 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# Host benchmark of the viper kernels in utils/image.py
+#
+# Usage (from the src folder):
+#   python -m host.benchmark_image [--kernel NAME] [--repeat N] [--compare COMMIT]
+#
+# Every kernel is executed under CPython with the stand-in viper decorator, its output is checked
+# against the NumPy reference and the throughput is reported. The results are saved as
+# host/results/benchmark_image/<commit>.json so two commits can be compared. The absolute numbers
+# are CPython numbers, only the ratio between commits is meaningful for the device.
+
+import argparse
+import functools
+import random
+import struct
+import sys
+import time
+
+from host import install_stubs
+
+install_stubs()
+
+import numpy as np
+
+from utils import image as kernels
+from host import reference_image as reference
+from host import results as storage
+
+QVGA_PIXELS = 320 * 240
+QQVGA_PIXELS = 160 * 120
+
+# Field of view used by the visual camera by default (openmv_visual/main.py)
+FOV = (10, 10, 22, 20, 22, 20)
+
+# Tiles of the partial screen updates (components/screen.py)
+TILE = (40, 16)
+TILES = (320 // TILE[0]) * (240 // TILE[1])
+
+# Glyph of the menu text (scale 2.1) drawn at x, y (utils/text.py)
+GLYPH = (10, 10, 17, 21)
+
+# Blob threshold and labels of the THERMAL_ANALYSIS preview (components/thermal.py)
+BLOB_THRESHOLD = (200, 255)
+BLOB_LABELS = 128
+
+# MIX preview: alpha, grey levels blended (all of them or only the hot ones) and byte swap for the screen
+MIX = (16, 0, 255, 1)
+MIX_ABOVE = (16, 128, 255, 1)
+
+# The kernels of the previous MIX preview (thermal upscale, interleave with the visual image and byte
+# swap of the screen), the blend must not be slower than all of them together
+BUDGETS = {
+    "qqgrey2qvga_blend": ("qqvga2qvga", "qvga2qvga_step2", "pixel2pixel"),
+    "qqgrey2qvga_blend_above": ("qqvga2qvga", "qvga2qvga_step2", "pixel2pixel"),
+}
+
+
+def random_buffer(size, seed):
+    generator = random.Random(seed)
+    return bytearray(generator.getrandbits(8) for _ in range(size))
+
+
+def qvga_rgb565():
+    return random_buffer(QVGA_PIXELS * 2, 1)
+
+
+def qqvga_rgb565():
+    return random_buffer(QQVGA_PIXELS * 2, 2)
+
+
+def qqvga_grey():
+    return random_buffer(QQVGA_PIXELS, 3)
+
+
+def qqvga_grey_blobs():
+    """ Hot and cold blocks of 8x8 pixels with noise, blobs of many shapes """
+    generator = random.Random(6)
+    blocks = [generator.randrange(256) for _ in range(20 * 15)]
+    return bytearray(
+        max(0, min(255, blocks[(index // 160 // 8) * 20 + (index % 160) // 8] + generator.randrange(-8, 8)))
+        for index in range(QQVGA_PIXELS)
+    )
+
+
+def label_blobs(src, row_labels, parents, stats, blobs):
+    """ Statistics of the blobs in label order, the labels which are not their own parent are dropped """
+    labels = kernels.label_blobs(src, 160, 120, BLOB_THRESHOLD[0], BLOB_THRESHOLD[1], row_labels, parents,
+                                 stats, BLOB_LABELS)
+    parents = memoryview(parents).cast("H")
+    size = 4 * kernels.BLOB_STATS_SIZE
+    offset = 0
+    for label in range(1, labels + 1):
+        if parents[label] == label:
+            blobs[offset:offset + size] = stats[label * size:(label + 1) * size]
+            offset += size
+
+
+def qvga_rgb565_scene():
+    """ Flat areas, gradients and noise, something between the colour bars and a camera frame """
+    generator = random.Random(7)
+    pixels = []
+    for row in range(240):
+        for column in range(320):
+            if column < 120:
+                pixel = 0x2104 # Flat
+            elif column < 220:
+                pixel = ((row // 8) << 11) | ((column // 4) << 5) # Gradient, steps of a few pixels
+            else:
+                pixel = generator.getrandbits(16) # Noise, not compressible
+            pixels.append(pixel)
+    return bytearray(np.array(pixels, dtype=np.uint16).tobytes())
+
+
+@functools.lru_cache(maxsize=None)
+def rle565_scene():
+    return reference.rle565_encode_reference(qvga_rgb565_scene(), QVGA_PIXELS, 320).tobytes()
+
+
+def palette():
+    return random_buffer(256 * 2, 4)
+
+
+@functools.lru_cache(maxsize=None)
+def fov_tables():
+    """ Built once like on the visual camera, only the gather is timed """
+    tables = kernels.create_fov_tables()
+    kernels.qvgafov2qvga_tables(*tables, *FOV)
+    return tables
+
+
+# name: (kernel, reference, inputs, index of the output argument, pixels written, bytes read + written)
+CASES = {
+    "qvga2qvga": (
+        lambda src, dst: kernels.qvga2qvga(src, dst, 0, 1),
+        lambda src, dst: reference.qvga2qvga_reference(src, dst, 0, 1),
+        lambda: (qvga_rgb565(), bytearray(QVGA_PIXELS * 2)),
+        1, QVGA_PIXELS, QVGA_PIXELS * 4,
+    ),
+    "qvga2qvga_step2": (
+        lambda src, dst: kernels.qvga2qvga(src, dst, 0, 2),
+        lambda src, dst: reference.qvga2qvga_reference(src, dst, 0, 2),
+        lambda: (qvga_rgb565(), bytearray(QVGA_PIXELS * 2)),
+        1, QVGA_PIXELS // 2, QVGA_PIXELS * 2,
+    ),
+    "qqvga2qvga": (
+        kernels.qqvga2qvga,
+        reference.qqvga2qvga_reference,
+        lambda: (qqvga_rgb565(), bytearray(QVGA_PIXELS * 2)),
+        1, QVGA_PIXELS, QQVGA_PIXELS * 2 + QVGA_PIXELS * 2,
+    ),
+    "qqgrey2qvga": (
+        kernels.qqgrey2qvga,
+        reference.qqgrey2qvga_reference,
+        lambda: (qqvga_grey(), bytearray(QVGA_PIXELS * 2)),
+        1, QVGA_PIXELS, QQVGA_PIXELS + QVGA_PIXELS * 2,
+    ),
+    "qqgrey2qvga_palette": (
+        kernels.qqgrey2qvga_palette,
+        reference.qqgrey2qvga_palette_reference,
+        lambda: (qqvga_grey(), bytearray(QVGA_PIXELS * 2), palette()),
+        1, QVGA_PIXELS, QQVGA_PIXELS * 3 + QVGA_PIXELS * 2,
+    ),
+    "qqgrey2qvga_blend": (
+        lambda src, visual, dst, palette: kernels.qqgrey2qvga_blend(src, visual, dst, palette, *MIX),
+        lambda src, visual, dst, palette: reference.qqgrey2qvga_blend_reference(src, visual, dst, palette, *MIX),
+        lambda: (qqvga_grey(), qvga_rgb565(), bytearray(QVGA_PIXELS * 2), palette()),
+        2, QVGA_PIXELS, QQVGA_PIXELS * 3 + QVGA_PIXELS * 4,
+    ),
+    "qqgrey2qvga_blend_above": (
+        lambda src, visual, dst, palette: kernels.qqgrey2qvga_blend(src, visual, dst, palette, *MIX_ABOVE),
+        lambda src, visual, dst, palette: reference.qqgrey2qvga_blend_reference(src, visual, dst, palette, *MIX_ABOVE),
+        lambda: (qqvga_grey(), qvga_rgb565(), bytearray(QVGA_PIXELS * 2), palette()),
+        2, QVGA_PIXELS, QQVGA_PIXELS * 3 + QVGA_PIXELS * 4,
+    ),
+    "qqgrey2qvga_blend_qqvga": (
+        lambda src, visual, dst, palette: kernels.qqgrey2qvga_blend_qqvga(src, visual, dst, palette, *MIX),
+        lambda src, visual, dst, palette: reference.qqgrey2qvga_blend_qqvga_reference(src, visual, dst, palette, *MIX),
+        lambda: (qqvga_grey(), qqvga_rgb565(), bytearray(QVGA_PIXELS * 2), palette()),
+        2, QVGA_PIXELS, QQVGA_PIXELS * 5 + QVGA_PIXELS * 2,
+    ),
+    "qvga2qqvga": (
+        kernels.qvga2qqvga,
+        reference.qvga2qqvga_reference,
+        lambda: (qvga_rgb565(), bytearray(QQVGA_PIXELS * 2)),
+        1, QQVGA_PIXELS, QQVGA_PIXELS * 4,
+    ),
+    "rle565_encode": (
+        lambda src, dst: kernels.rle565_encode(src, dst, QVGA_PIXELS, 320, QVGA_PIXELS),
+        lambda src, dst: reference.rle565_encode_reference(src, QVGA_PIXELS, 320),
+        lambda: (qvga_rgb565_scene(), bytearray(QVGA_PIXELS * 2)),
+        1, QVGA_PIXELS, QVGA_PIXELS * 2 + len(rle565_scene()),
+    ),
+    "rle565_decode": (
+        lambda src, dst: kernels.rle565_decode(src, len(src) // 2, dst, QVGA_PIXELS, 320),
+        lambda src, dst: np.frombuffer(qvga_rgb565_scene(), dtype=np.uint16),
+        lambda: (bytearray(rle565_scene()), bytearray(QVGA_PIXELS * 2)),
+        1, QVGA_PIXELS, QVGA_PIXELS * 2 + len(rle565_scene()),
+    ),
+    "crc16": (
+        lambda src, table, result: struct.pack_into("<H", result, 0, kernels.crc16(src, QVGA_PIXELS * 2, 0xFFFF, table)),
+        lambda src, table, result: reference.crc16_reference(src, QVGA_PIXELS * 2),
+        lambda: (qvga_rgb565(), kernels.create_crc16_table(), bytearray(2)),
+        2, QVGA_PIXELS, QVGA_PIXELS * 2,
+    ),
+    "increase_image_viper": (
+        lambda src, dst: kernels.increase_image_viper(src, dst, 2),
+        lambda src, dst: reference.increase_image_viper_reference(src, dst, 2),
+        lambda: (qqvga_rgb565(), bytearray(QVGA_PIXELS * 2)),
+        1, QVGA_PIXELS, QQVGA_PIXELS * 2 + QVGA_PIXELS * 2,
+    ),
+    "pixel2pixel": (
+        kernels.pixel2pixel,
+        reference.pixel2pixel_reference,
+        lambda: (qvga_rgb565(),),
+        0, QVGA_PIXELS, QVGA_PIXELS * 4,
+    ),
+    "qvgafov2qvga": (
+        lambda src, dst: kernels.qvgafov2qvga(src, dst, *FOV),
+        lambda src, dst: reference.qvgafov2qvga_reference(src, dst, *FOV),
+        lambda: (qvga_rgb565(), bytearray(QVGA_PIXELS * 2)),
+        1, QVGA_PIXELS, QVGA_PIXELS * 4,
+    ),
+    "tile_checksums": (
+        lambda src, checksums, dirty: kernels.tile_checksums(src, checksums, dirty, 320, 240, *TILE),
+        lambda src, checksums, dirty: reference.tile_checksums_reference(src, checksums, dirty, 320, 240, *TILE),
+        lambda: (qvga_rgb565(), bytearray(4 * TILES), bytearray(TILES)),
+        1, QVGA_PIXELS, QVGA_PIXELS * 2,
+    ),
+    "blit_mask": (
+        lambda dst, mask: kernels.blit_mask(dst, 320, 240, mask, *GLYPH, 0x07E0),
+        lambda dst, mask: reference.blit_mask_reference(dst, 320, 240, mask, *GLYPH, 0x07E0),
+        lambda: (qvga_rgb565(), random_buffer((GLYPH[2] * GLYPH[3] + 7) // 8, 5)),
+        0, GLYPH[2] * GLYPH[3], GLYPH[2] * GLYPH[3] * 2,
+    ),
+    "grey_statistics": (
+        lambda src, stats: kernels.grey_statistics(src, QQVGA_PIXELS, memoryview(stats)[:1024], memoryview(stats)[1024:]),
+        lambda src, stats: reference.grey_statistics_reference(src, QQVGA_PIXELS, None, None),
+        lambda: (qqvga_grey(), bytearray(1024 + 12)),
+        1, QQVGA_PIXELS, QQVGA_PIXELS,
+    ),
+    "label_blobs": (
+        label_blobs,
+        lambda src, *buffers: reference.label_blobs_reference(src, 160, 120, *BLOB_THRESHOLD),
+        lambda: (qqvga_grey_blobs(), bytearray(2 * 2 * 160), bytearray(2 * (BLOB_LABELS + 1)),
+                 bytearray(4 * kernels.BLOB_STATS_SIZE * (BLOB_LABELS + 1)),
+                 bytearray(4 * kernels.BLOB_STATS_SIZE * BLOB_LABELS)),
+        4, QQVGA_PIXELS, QQVGA_PIXELS,
+    ),
+    "qvgafov2qvga_gather": (
+        kernels.qvgafov2qvga_gather,
+        lambda src, dst, *tables: reference.qvgafov2qvga_reference(src, dst, *FOV),
+        lambda: (qvga_rgb565(), bytearray(QVGA_PIXELS * 2)) + fov_tables(),
+        1, QVGA_PIXELS, QVGA_PIXELS * 4,
+    ),
+}
+
+
+def run_case(name, repeat):
+    kernel, kernel_reference, inputs, output, pixels, size = CASES[name]
+
+    arguments = inputs()
+    expected = kernel_reference(*[bytearray(argument) for argument in arguments])
+    kernel(*arguments)
+    obtained = np.frombuffer(arguments[output], dtype=expected.dtype)
+    matches = bool(np.array_equal(obtained[:expected.size], expected))
+
+    seconds = None
+    for _ in range(repeat):
+        arguments = inputs()
+        start = time.perf_counter()
+        kernel(*arguments)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    return {
+        "seconds": seconds,
+        "pixels_per_second": pixels / seconds,
+        "bytes_per_second": size / seconds,
+        "matches_reference": matches,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the utils/image.py kernels")
+    parser.add_argument("--kernel", action="append", choices=sorted(CASES), help="Kernel to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per kernel, the fastest one is reported")
+    parser.add_argument("--compare", metavar="COMMIT", help="Compare against the saved results of a commit")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slow down before failing")
+    parser.add_argument("--no-save", action="store_true", help="Do not store the results")
+    arguments = parser.parse_args(argv)
+
+    results = {"commit": storage.git_commit(), "python": sys.version.split()[0], "kernels": {}}
+    failed = False
+    names = list(arguments.kernel or CASES)
+    for name in list(names):
+        names += [budget for budget in BUDGETS.get(name, ()) if budget not in names]
+
+    print("{:<24} {:>10} {:>14} {:>14} {}".format("kernel", "ms", "pixels/s", "bytes/s", "reference"))
+    for name in names:
+        result = run_case(name, arguments.repeat)
+        results["kernels"][name] = result
+        failed |= not result["matches_reference"]
+        print("{:<24} {:>10.2f} {:>14.0f} {:>14.0f} {}".format(
+            name, result["seconds"] * 1000, result["pixels_per_second"], result["bytes_per_second"],
+            "OK" if result["matches_reference"] else "MISMATCH",
+        ))
+
+    for name, budget in BUDGETS.items():
+        if name not in results["kernels"]:
+            continue
+        seconds = results["kernels"][name]["seconds"]
+        budget_seconds = sum(results["kernels"][kernel]["seconds"] for kernel in budget)
+        print("{} {:.2f} ms, budget {:.2f} ms ({})".format(name, seconds * 1000, budget_seconds * 1000, " + ".join(budget)))
+        if seconds > budget_seconds:
+            print("Over budget:", name)
+            failed = True
+
+    if not arguments.no_save:
+        print("Saved", storage.save("benchmark_image", results))
+
+    if arguments.compare:
+        regressions = storage.compare(
+            results, storage.load("benchmark_image", arguments.compare), "kernels", arguments.tolerance
+        )
+        if regressions:
+            print("Slower than", arguments.compare, ":", ", ".join(regressions))
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# Host benchmark of the visual camera link codec (utils/image.py rle565_encode/rle565_decode)
+#
+# Usage (from the src folder):
+#   python -m host.benchmark_link [--visual PATH] [--format QQVGA] [--baudrate 30000000]
+#
+# Every frame is encoded as the visual camera would do it and decoded as the master, the decoded
+# frame is checked against the original. The report has the encode and decode time (CPython time,
+# only useful to compare versions) and the bytes and transfer time of the frame with and without
+# compression at the link baudrate.
+
+import argparse
+import random
+import time
+
+from host import install_stubs
+
+install_stubs()
+
+import numpy as np
+
+from utils import image as kernels
+from host import benchmark_image
+
+HEADER_BYTES = 16 # CameraSlaveControl.HEADER_BYTES
+COMPRESSED_MAX_BYTES = 320 * 240
+
+
+def synthetic_frames():
+    """ Colour bars (as the simulator), flat/gradient/noise scene and noise only """
+    bars = np.zeros((240, 320), dtype=np.uint16)
+    for band, color in enumerate((0x0000, 0xF800, 0x07E0, 0xFFE0, 0x001F, 0xF81F, 0x07FF, 0xFFFF)):
+        bars[:, band * 40:(band + 1) * 40] = color
+    generator = random.Random(8)
+    noise = bytes(generator.getrandbits(8) for _ in range(320 * 240 * 2))
+    return [
+        ("bars", bars.tobytes()),
+        ("scene", bytes(benchmark_image.qvga_rgb565_scene())),
+        ("noise", noise),
+    ]
+
+
+def qqvga(frame):
+    return np.frombuffer(frame, dtype=np.uint16).reshape(240, 320)[::2, ::2].tobytes()
+
+
+def run_frame(frame, width, baudrate, repeat):
+    pixels = len(frame) // 2
+    compressed = bytearray(COMPRESSED_MAX_BYTES)
+    decoded = bytearray(len(frame))
+
+    encode_seconds = decode_seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        words = kernels.rle565_encode(frame, compressed, pixels, width, COMPRESSED_MAX_BYTES // 2)
+        elapsed = time.perf_counter() - start
+        encode_seconds = elapsed if encode_seconds is None else min(encode_seconds, elapsed)
+
+    matches = True
+    if words >= 0:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            decoded_pixels = kernels.rle565_decode(compressed, words, decoded, pixels, width)
+            elapsed = time.perf_counter() - start
+            decode_seconds = elapsed if decode_seconds is None else min(decode_seconds, elapsed)
+        matches = decoded_pixels == pixels and decoded == frame
+        link_bytes = HEADER_BYTES + words * 2
+    else:
+        # Sent raw
+        link_bytes = HEADER_BYTES + len(frame)
+
+    return {
+        "bytes": len(frame),
+        "link_bytes": link_bytes,
+        "ratio": link_bytes / len(frame),
+        "encode_seconds": encode_seconds,
+        "decode_seconds": decode_seconds or 0,
+        "raw_link_seconds": len(frame) * 8 / baudrate,
+        "link_seconds": link_bytes * 8 / baudrate,
+        "matches": matches,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the visual camera link codec")
+    parser.add_argument("--visual", help="ppm/bmp file or folder with recorded visual frames (320x240)")
+    parser.add_argument("--format", choices=("QVGA", "QQVGA"), default="QVGA", help="Frame format sent by the visual camera")
+    parser.add_argument("--baudrate", type=int, default=30000000, help="SPI baudrate of the link")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per frame, the fastest one is reported")
+    arguments = parser.parse_args(argv)
+
+    if arguments.visual:
+        from host import simulator
+        import image
+        frames = simulator.load_frames(arguments.visual, image.RGB565)
+        frames = [("frame_{:04d}".format(index), frame) for index, frame in enumerate(frames)]
+    else:
+        frames = synthetic_frames()
+    width = 320
+    if arguments.format == "QQVGA":
+        frames = [(name, qqvga(frame)) for name, frame in frames]
+        width = 160
+
+    print("{:<14} {:>8} {:>8} {:>7} {:>10} {:>10} {:>9} {:>9} {}".format(
+        "frame", "bytes", "link", "ratio", "encode ms", "decode ms", "raw ms", "link ms", "decoded"))
+    failed = False
+    totals = [0.0, 0.0]
+    for name, frame in frames:
+        result = run_frame(frame, width, arguments.baudrate, arguments.repeat)
+        failed |= not result["matches"]
+        totals[0] += result["raw_link_seconds"]
+        totals[1] += result["link_seconds"]
+        print("{:<14} {:>8} {:>8} {:>7.3f} {:>10.2f} {:>10.2f} {:>9.2f} {:>9.2f} {}".format(
+            name, result["bytes"], result["link_bytes"], result["ratio"],
+            result["encode_seconds"] * 1000, result["decode_seconds"] * 1000,
+            result["raw_link_seconds"] * 1000, result["link_seconds"] * 1000,
+            "OK" if result["matches"] else "MISMATCH",
+        ))
+    print("Link time {:.2f} ms raw, {:.2f} ms compressed ({} frames)".format(totals[0] * 1000, totals[1] * 1000, len(frames)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
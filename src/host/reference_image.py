@@ -0,0 +1,277 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# NumPy reference implementations of the kernels in utils/image.py
+#
+# They must produce exactly the same output as the viper kernels. The benchmark uses them to check
+# that an optimisation of a kernel did not change its result.
+
+import binascii
+
+import numpy as np
+
+QVGA_SHAPE = (240, 320)
+QQVGA_SHAPE = (120, 160)
+
+
+def as_array(buff, dtype, shape=None):
+    if hasattr(buff, "bytearray"):
+        buff = buff.bytearray()
+    array = np.frombuffer(buff, dtype=dtype)
+    if shape:
+        array = array[:shape[0] * shape[1]].reshape(shape)
+    return array
+
+
+def qvga2qvga_reference(src, dst, start_step, step_size):
+    src = as_array(src, np.uint16)
+    dst = as_array(dst, np.uint16).copy()
+    size = QVGA_SHAPE[0] * QVGA_SHAPE[1]
+    dst[start_step:size:step_size] = src[start_step:size:step_size]
+    return dst
+
+
+def qqvga2qvga_reference(src, dst):
+    src = as_array(src, np.uint16, QQVGA_SHAPE)
+    dst = as_array(dst, np.uint16).copy()
+    dst[:QVGA_SHAPE[0] * QVGA_SHAPE[1]] = src.repeat(2, axis=0).repeat(2, axis=1).ravel()
+    return dst
+
+
+def grey2rgb565(grey):
+    grey = grey.astype(np.uint16)
+    green = grey >> 2
+    red_blue = green >> 1
+    return (red_blue << 11) | (green << 5) | red_blue
+
+
+def qqgrey2qvga_reference(src, dst):
+    src = as_array(src, np.uint8, QQVGA_SHAPE)
+    dst = as_array(dst, np.uint16).copy()
+    dst[:QVGA_SHAPE[0] * QVGA_SHAPE[1]] = grey2rgb565(src).repeat(2, axis=0).repeat(2, axis=1).ravel()
+    return dst
+
+
+def qqgrey2qvga_palette_reference(src, dst, palette):
+    src = as_array(src, np.uint8, QQVGA_SHAPE)
+    dst = as_array(dst, np.uint16).copy()
+    palette = as_array(palette, np.uint16)
+    dst[:QVGA_SHAPE[0] * QVGA_SHAPE[1]] = palette[src].repeat(2, axis=0).repeat(2, axis=1).ravel()
+    return dst
+
+
+def qqgrey2qvga_blend_reference(src, visual, dst, palette, alpha, threshold_low, threshold_high, byteswap):
+    src = as_array(src, np.uint8, QQVGA_SHAPE).repeat(2, axis=0).repeat(2, axis=1).ravel()
+    visual = as_array(visual, np.uint16)[:src.size].astype(np.uint32)
+    dst = as_array(dst, np.uint16).copy()
+    thermal = as_array(palette, np.uint16)[src].astype(np.uint32)
+
+    blended = np.zeros_like(visual)
+    for mask in (0xF81F, 0x07E0):
+        blended |= (((visual & mask) * (32 - alpha) + (thermal & mask) * alpha) >> 5) & mask
+    pixels = np.where((src >= threshold_low) & (src <= threshold_high), blended, visual).astype(np.uint16)
+    dst[:src.size] = pixels.byteswap() if byteswap else pixels
+    return dst
+
+
+def qqgrey2qvga_blend_qqvga_reference(src, visual, dst, palette, alpha, threshold_low, threshold_high, byteswap):
+    visual = as_array(visual, np.uint16, QQVGA_SHAPE).repeat(2, axis=0).repeat(2, axis=1).ravel()
+    return qqgrey2qvga_blend_reference(src, visual.tobytes(), dst, palette, alpha, threshold_low, threshold_high, byteswap)
+
+
+def qvga2qqvga_reference(src, dst):
+    src = as_array(src, np.uint16, QVGA_SHAPE)
+    dst = as_array(dst, np.uint16).copy()
+    dst[:QQVGA_SHAPE[0] * QQVGA_SHAPE[1]] = src[::2, ::2].ravel()
+    return dst
+
+
+def rle565_encode_reference(src, pixels, width):
+    """ Words of the greedy encoding of rle565_encode (the longest run of 2 or more pixels, literals otherwise) """
+    src = as_array(src, np.uint16)[:pixels].tolist()
+    words = []
+    literal = None
+    index = 0
+    while index < pixels:
+        runs = []
+        for kind, offset in ((0x8000, width), (0x4000, None)):
+            if (offset is not None and index < offset) or (offset is None and index == 0):
+                runs.append((0, kind))
+                continue
+            end = index
+            while end < pixels and end - index < 0x3FFF and src[end] == src[end - offset if offset else index - 1]:
+                end += 1
+            runs.append((end - index, kind))
+        (run_above, _), (run_left, _) = runs
+        if max(run_above, run_left) >= 2:
+            count, kind = runs[0] if run_above >= run_left else runs[1]
+            words.append(kind | count)
+            index += count
+            literal = None
+            continue
+        if literal is None or words[literal] == 0x3FFF:
+            literal = len(words)
+            words.append(0)
+        words.append(src[index])
+        words[literal] += 1
+        index += 1
+    return np.array(words, dtype=np.uint16)
+
+
+def crc16_reference(src, length):
+    """ CRC-16/CCITT of crc16 started from 0xFFFF """
+    return np.array([binascii.crc_hqx(bytes(src[:length]), 0xFFFF)], dtype=np.uint16)
+
+
+def increase_image_viper_reference(src, dst, pixels):
+    """ Only valid for pixels <= 2, where the written blocks do not overlap """
+    src = as_array(src, np.uint16, QQVGA_SHAPE)
+    dst = as_array(dst, np.uint16).copy()
+    screen = dst[:QVGA_SHAPE[0] * QVGA_SHAPE[1]].reshape(QVGA_SHAPE)
+    for row in range(pixels):
+        for column in range(pixels):
+            screen[row::2, column::2] = src
+    return dst
+
+
+def pixel2pixel_reference(src):
+    return as_array(src, np.uint16).byteswap()
+
+
+def qvgafov2qvga_index(column_offset, row_offset, column_zoom_numerator, column_zoom_denominator,
+                       row_zoom_numerator, row_zoom_denominator):
+    """ Source index of every destination pixel (-1 if the kernel does not write it) """
+    columns, rows = QVGA_SHAPE[1], QVGA_SHAPE[0]
+    index = np.full(columns * rows, -1, dtype=np.int32)
+
+    column_fraction_copy = column_zoom_numerator - column_zoom_denominator
+    row_fraction_copy = row_zoom_numerator - row_zoom_denominator
+    copies_per_column_copy = column_zoom_numerator // column_zoom_denominator
+    copies_per_row_copy = 1  # The kernel divides row_zoom_numerator by itself
+
+    icolumn_src, irow_src, icolumn_dst, irow_dst = column_offset, row_offset, 0, 0
+    icolumn_action = irow_action = 0
+    columns_to_copy = columns_copied = column_copied = 0
+    rows_to_copy = rows_copied = row_copied = 0
+    while True:
+        index[icolumn_dst + irow_dst * columns] = icolumn_src + irow_src * columns
+        if columns_to_copy == 0 and column_copied != icolumn_src and columns_copied < column_fraction_copy:
+            columns_to_copy = copies_per_column_copy
+        if columns_to_copy > 0:
+            columns_to_copy -= 1
+            column_copied = icolumn_src
+            columns_copied += 1
+        else:
+            icolumn_src += 1
+        icolumn_action += 1
+        if icolumn_action >= column_zoom_numerator:
+            icolumn_action = 0
+            columns_copied = 0
+        icolumn_dst += 1
+        if icolumn_dst >= columns or icolumn_src >= columns:
+            icolumn_dst = 0
+            icolumn_src = column_offset
+            icolumn_action = 0
+            columns_copied = 0
+            if rows_to_copy == 0 and row_copied != irow_src and rows_copied < row_fraction_copy:
+                rows_to_copy = copies_per_row_copy
+            if rows_to_copy > 0:
+                rows_to_copy -= 1
+                row_copied = irow_src
+                rows_copied += 1
+            else:
+                irow_src += 1
+            irow_action += 1
+            if irow_action >= row_zoom_numerator:
+                irow_action = 0
+                rows_copied = 0
+            irow_dst += 1
+            if irow_dst >= rows or irow_src >= rows:
+                return index
+
+
+def tile_checksums_reference(src, checksums, dirty, width, height, tile_width, tile_height):
+    """ checksums after the call (checksum = checksum * 33 + word of every row of the tile, modulo 2**30) """
+    words = as_array(src, np.uint32)[:width * height // 2].reshape(height, width // 2).astype(np.uint64)
+    modulo = np.uint64(2 ** 30)
+    result = []
+    for row in range(0, height, tile_height):
+        for column in range(0, width // 2, tile_width // 2):
+            tile = words[row:row + tile_height, column:column + tile_width // 2].ravel() % modulo
+            powers = np.ones(tile.size, dtype=np.uint64)
+            for index in range(tile.size - 2, -1, -1):
+                powers[index] = powers[index + 1] * np.uint64(33) % modulo
+            result.append(int(np.sum(tile * powers % modulo) % modulo))
+    return np.array(result, dtype=np.uint32)
+
+
+def blit_mask_reference(dst, dst_width, dst_height, mask, x, y, width, height, color):
+    """ Only for masks fully inside dst """
+    dst = as_array(dst, np.uint16).copy()
+    bits = np.unpackbits(np.frombuffer(mask, dtype=np.uint8), bitorder="little")[:width * height]
+    screen = dst[:dst_width * dst_height].reshape(dst_height, dst_width)
+    screen[y:y + height, x:x + width][bits.reshape(height, width) == 1] = color
+    return dst
+
+
+def grey_statistics_reference(src, size, histogram, result):
+    """ histogram followed by result (minimum, maximum and sum) """
+    src = np.frombuffer(src, dtype=np.uint8)[:size]
+    counts = np.bincount(src, minlength=256)
+    values = [src.min(), src.max(), src.sum(dtype=np.uint64)]
+    return np.concatenate((counts, values)).astype(np.uint32)
+
+
+def label_blobs_reference(src, width, height, threshold_low, threshold_high):
+    """ Statistics of the 8-connected blobs (flood fill), in the order of their first pixel """
+    src = np.frombuffer(src, dtype=np.uint8)[:width * height].reshape(height, width)
+    inside = (src >= threshold_low) & (src <= threshold_high)
+    visited = np.zeros_like(inside)
+    result = []
+    for y, x in zip(*np.nonzero(inside)):
+        if visited[y, x]:
+            continue
+        visited[y, x] = True
+        pending = [(y, x)]
+        pixels = []
+        while pending:
+            row, column = pending.pop()
+            pixels.append((row, column))
+            for near_row in range(max(0, row - 1), min(height, row + 2)):
+                for near_column in range(max(0, column - 1), min(width, column + 2)):
+                    if inside[near_row, near_column] and not visited[near_row, near_column]:
+                        visited[near_row, near_column] = True
+                        pending.append((near_row, near_column))
+        rows, columns = np.array(pixels).T
+        grey = src[rows, columns].astype(np.uint32)
+        result.append((len(pixels), columns.sum(), rows.sum(), grey.sum(), columns.min(), rows.min(),
+                       columns.max(), rows.max(), grey.min(), grey.max()))
+    return np.array(result, dtype=np.uint32).ravel()
+
+
+def qvgafov2qvga_reference(src, dst, *fov):
+    src = as_array(src, np.uint16)
+    dst = as_array(dst, np.uint16).copy()
+    index = qvgafov2qvga_index(*fov)
+    written = index >= 0
+    dst[:index.size][written] = src[index[written]]
+    return dst
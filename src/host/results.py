@@ -0,0 +1,72 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# Storage of the host measurements per git commit, so a change can be compared with a previous
+# version of the code. Every entry of a section has a "seconds" value (lower is better).
+
+import json
+import os
+import subprocess
+
+from host import src_path
+
+results_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=src_path, stderr=subprocess.DEVNULL
+        ).decode().strip()
+        dirty = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no", "."], cwd=src_path, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + "-dirty" if dirty else commit
+
+
+def load(name, commit):
+    with open(os.path.join(results_path, name, commit + ".json"), "r") as f:
+        return json.load(f)
+
+
+def save(name, results):
+    path = os.path.join(results_path, name)
+    os.makedirs(path, exist_ok=True)
+    file_name = os.path.join(path, results["commit"] + ".json")
+    with open(file_name, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return file_name
+
+
+def compare(results, baseline, section, tolerance):
+    """ Return the entries which are slower than the baseline by more than the tolerance """
+    regressions = []
+    for name, result in results[section].items():
+        if name not in baseline.get(section, {}):
+            continue
+        ratio = result["seconds"] / baseline[section][name]["seconds"]
+        print("{:<22} {:>8.3f}x time vs {}".format(name, ratio, baseline["commit"]))
+        if ratio > 1.0 + tolerance:
+            regressions.append(name)
+    return regressions
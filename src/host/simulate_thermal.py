@@ -0,0 +1,205 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# End to end simulation of openmv_thermal/main.py on a PC
+#
+# Usage (from the src folder):
+#   python -m host.simulate_thermal [--preview MODE] [--frames N] [--thermal PATH] [--visual PATH]
+#                                   [--png FOLDER] [--compare COMMIT]
+#
+# main() runs unmodified against the simulator once per preview mode, in an empty temporary folder
+# used as the camera file system. The frames per second of the main loop are measured on the
+# virtual clock: host compute time plus the modelled SPI, CCI and sleep times.
+# The thermal frames can be recorded on the camera with sensor.snapshot().save("frame_0001.pgm").
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time as host_time
+
+from host import simulator
+
+simulator.install()
+
+from host import results as storage
+
+MODES = ("THERMAL", "THERMAL_ANALYSIS", "THERMAL_GREY", "VISIBLE", "MIX", "MIX_ON_VISUAL")
+# Modes which are a preview with other control settings
+MODE_SETTINGS = {"MIX_ON_VISUAL": {"preview": "MIX", "mix_on_visual": True}}
+APPLICATION_MODULES = ("main", "helpers", "utils", "components")
+
+
+class SimulationComplete(Exception):
+    pass
+
+
+def unload_application():
+    for name in list(sys.modules):
+        if name.split(".")[0] in APPLICATION_MODULES:
+            del sys.modules[name]
+
+
+def run_mode(mode, frames, thermal_frames=None, visual_frames=None, png_path=None, png_every=False,
+             lepton_frame_period_us=0, visual_frame_period_us=0, link_error_model=None, verbose=False):
+    import sensor
+    import utime
+
+    state = {"loop_frame": None}
+
+    def on_frame(panel):
+        if state["loop_frame"] is None:
+            return
+        frame = panel.frames - state["loop_frame"]
+        if png_path and png_every:
+            panel.save_png(os.path.join(png_path, "{}_{:04d}.png".format(mode, frame)))
+        # The first frame of the loop is not measured, it includes the menu initialisation
+        if frame > frames:
+            raise SimulationComplete()
+
+    hardware = simulator.Simulator(
+        thermal_frames=thermal_frames, visual_frames=visual_frames, on_frame=on_frame,
+        lepton_frame_period_us=lepton_frame_period_us, visual_frame_period_us=visual_frame_period_us,
+        link_error_model=link_error_model,
+    )
+
+    cwd = os.getcwd()
+    file_system = tempfile.mkdtemp(prefix="thermal_camera_")
+    with open(os.path.join(file_system, "camera.json"), "w") as f:
+        control_settings = {"always_pixel_pointer": False, "preview": mode}
+        control_settings.update(MODE_SETTINGS.get(mode, {}))
+        json.dump({"control": control_settings}, f)
+
+    unload_application()
+    output = io.StringIO()
+    try:
+        os.chdir(file_system)
+        with contextlib.redirect_stdout(sys.stdout if verbose else output):
+            import main as application
+
+            original_loop = application.loop
+
+            def loop(**components):
+                state["loop_frame"] = hardware.screen.frames
+                state["cci_transactions"] = sensor.cci_transactions
+                state["spi"] = hardware.spi_statistics()
+                state["camera_slave"] = components["camera_slave"]
+                state["visual_wait_us"] = components["camera_slave"].wait_us.total_us
+                original_loop(**components)
+
+            application.loop = loop
+            try:
+                application.main()
+            except SimulationComplete:
+                pass
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(file_system, ignore_errors=True)
+        unload_application()
+
+    if png_path:
+        hardware.screen.save_png(os.path.join(png_path, "{}.png".format(mode)))
+
+    times = hardware.screen.frame_times_us[state["loop_frame"] + 1:]
+    seconds = (times[-1] - times[0]) / 1000000 / (len(times) - 1)
+    spi = {}
+    for name, (size, spi_seconds) in hardware.spi_statistics().items():
+        size_start, seconds_start = state["spi"].get(name, (0, 0.0))
+        spi[name] = {
+            "bytes_per_frame": (size - size_start) / frames,
+            "ms_per_frame": (spi_seconds - seconds_start) * 1000 / frames,
+        }
+    return {
+        "seconds": seconds,
+        "fps": 1 / seconds,
+        "cci_per_frame": (sensor.cci_transactions - state["cci_transactions"]) / frames,
+        "visual_wait_ms_per_frame": (state["camera_slave"].wait_us.total_us - state["visual_wait_us"]) / 1000 / frames,
+        "spi": spi,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulation of openmv_thermal/main.py")
+    parser.add_argument("--preview", action="append", choices=MODES, help="Preview mode (default: all)")
+    parser.add_argument("--frames", type=int, default=10, help="Measured frames per mode")
+    parser.add_argument("--thermal", help="pgm/bmp file or folder with the Lepton frames to replay (160x120)")
+    parser.add_argument("--visual", help="ppm/bmp file or folder with the visual frames to replay (320x240)")
+    parser.add_argument("--lepton-fps", type=float, default=0, help="Limit the Lepton frame rate (0: no limit)")
+    parser.add_argument("--visual-fps", type=float, default=0, help="Limit the visual camera frame rate (0: no limit)")
+    parser.add_argument("--link-max-baudrate", type=int, default=30000000, help="Fastest visual link baudrate without errors")
+    parser.add_argument("--link-setup-us", type=int, default=500, help="Shortest visual link start delay without errors")
+    parser.add_argument("--link-error-rate", type=float, default=1.0, help="Frames corrupted over those limits (0: no errors)")
+    parser.add_argument("--png", metavar="FOLDER", help="Save the last screen frame of every mode as PNG")
+    parser.add_argument("--png-every", action="store_true", help="Save every measured screen frame as PNG")
+    parser.add_argument("--compare", metavar="COMMIT", help="Compare against the saved results of a commit")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slow down before failing")
+    parser.add_argument("--no-save", action="store_true", help="Do not store the results")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of main.py")
+    arguments = parser.parse_args(argv)
+
+    import image
+    thermal_frames = simulator.load_frames(arguments.thermal, image.GRAYSCALE) if arguments.thermal else None
+    visual_frames = simulator.load_frames(arguments.visual, image.RGB565) if arguments.visual else None
+    if arguments.png:
+        os.makedirs(arguments.png, exist_ok=True)
+
+    results = {"commit": storage.git_commit(), "frames": arguments.frames, "modes": {}}
+    print("{:<18} {:>8} {:>10} {:>6} {:>7}  {}".format("mode", "fps", "ms/frame", "cci", "wait ms", "spi ms/frame"))
+    for mode in arguments.preview or MODES:
+        start = host_time.perf_counter()
+        result = run_mode(
+            mode, arguments.frames, thermal_frames, visual_frames, arguments.png, arguments.png_every,
+            lepton_frame_period_us=1000000 / arguments.lepton_fps if arguments.lepton_fps else 0,
+            visual_frame_period_us=1000000 / arguments.visual_fps if arguments.visual_fps else 0,
+            link_error_model=simulator.LinkErrorModel(
+                arguments.link_max_baudrate, arguments.link_setup_us, arguments.link_error_rate,
+            ),
+            verbose=arguments.verbose,
+        )
+        results["modes"][mode] = result
+        print("{:<18} {:>8.2f} {:>10.1f} {:>6.1f} {:>7.1f}  {}  ({:.1f}s)".format(
+            mode, result["fps"], result["seconds"] * 1000, result["cci_per_frame"], result["visual_wait_ms_per_frame"],
+            " ".join("{} {:.1f}".format(name, spi["ms_per_frame"]) for name, spi in sorted(result["spi"].items())),
+            host_time.perf_counter() - start,
+        ))
+
+    failed = False
+    if not arguments.no_save:
+        print("Saved", storage.save("simulate_thermal", results))
+
+    if arguments.compare:
+        regressions = storage.compare(
+            results, storage.load("simulate_thermal", arguments.compare), "modes", arguments.tolerance
+        )
+        if regressions:
+            print("Slower than", arguments.compare, ":", ", ".join(regressions))
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,502 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# Hardware simulator to run openmv_thermal/main.py on a PC.
+#
+# install() loads the stand-in modules. Simulator() puts on the SPI bus a model of every device
+# connected to the master OPENMV (ILI9341 screen, visual camera slave, XPT2046 touch and the PIC
+# auxiliary controller) with the pins used in main.py.
+
+import gc
+import os
+import random
+import struct
+import sys
+import time as host_time
+import zlib
+
+from host import install_stubs, src_path
+
+thermal_path = os.path.join(src_path, "openmv_thermal")
+
+
+def install():
+    install_stubs()
+    if thermal_path not in sys.path:
+        sys.path.insert(1, thermal_path)
+    import utime
+    # The OPENMV "time" module is utime plus time.clock
+    sys.modules["time"] = utime
+    if not hasattr(gc, "mem_alloc"):
+        gc.mem_alloc = lambda: 0
+        gc.mem_free = lambda: 256 * 1024
+
+
+def load_frames(path, pixformat):
+    """ Frames stored as pgm/ppm/bmp files (a folder or a single file), converted to pixformat """
+    import image
+    if os.path.isdir(path):
+        names = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().rsplit(".", 1)[-1] in ("pgm", "ppm", "bmp")
+        )
+    else:
+        names = [path]
+    frames = []
+    for name in names:
+        img = image.Image(name)
+        if pixformat == image.GRAYSCALE:
+            img.to_grayscale()
+        else:
+            img.to_rgb565()
+        frames.append(bytes(img.bytearray()))
+    if not frames:
+        raise OSError("No frames found in {}".format(path))
+    return frames
+
+
+def cycle(frames):
+    """ frame_source replaying the frames in a loop """
+    state = {"index": 0}
+
+    def source():
+        frame = frames[state["index"] % len(frames)]
+        state["index"] += 1
+        return frame
+    return source
+
+
+def write_png(path, width, height, rgb):
+    """ rgb: RGB888 bytes, row by row """
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    stride = width * 3
+    raw = b"".join(b"\x00" + rgb[row * stride:(row + 1) * stride] for row in range(height))
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+class SpiDevice():
+    """ Device on the SPI bus. A session starts when the chip select goes low """
+
+    chip_select = None
+    baudrate = 0 # Of the current transfer, set by the SPI stand-in
+
+    def __init__(self, chip_select):
+        from pyb import Pin
+        self.chip_select = chip_select
+        self.position = 0
+        self.select_us = 0
+        Pin.listen(chip_select, self._chip_select_changed)
+
+    def _chip_select_changed(self, name, value):
+        if value == 0:
+            import utime
+            self.position = 0
+            self.select_us = utime.ticks_us()
+            self.start()
+        else:
+            self.end()
+
+    def start(self):
+        pass
+
+    def end(self):
+        pass
+
+    def transfer(self, send, length):
+        received = self.exchange(send, length)
+        self.position += length
+        return received
+
+    def exchange(self, send, length):
+        return None
+
+
+class Ili9341(SpiDevice):
+    """ Screen panel. Keeps the panel memory and counts the frames written with RAMWR """
+
+    CASET = 0x2A
+    RASET = 0x2B
+    RAMWR = 0x2C
+
+    def __init__(self, chip_select="P3", data_command="P9", width=320, height=240, on_frame=None):
+        super().__init__(chip_select)
+        from pyb import Pin
+        self.data_command = Pin(data_command)
+        self.width = width
+        self.height = height
+        self.memory = bytearray(width * height * 2)
+        self.window = (0, width - 1, 0, height - 1)
+        self.command = None
+        self.parameters = bytearray()
+        self.offset = 0
+        self.pixels_written = 0
+        self.frames = 0
+        self.frame_times_us = []
+        self.on_frame = on_frame
+
+    def end(self):
+        if self.command == self.RAMWR and self.pixels_written:
+            self.pixels_written = 0
+            self.frames += 1
+            import utime
+            self.frame_times_us.append(utime.ticks_us())
+            if self.on_frame:
+                self.on_frame(self)
+
+    def exchange(self, send, length):
+        if send is None:
+            return None
+        if self.data_command.value() == 0:
+            for byte in send:
+                self.command = byte
+                self.parameters = bytearray()
+                if byte == self.RAMWR:
+                    self.offset = 0
+        elif self.command == self.RAMWR:
+            self._write(send)
+        else:
+            self.parameters += send
+            if len(self.parameters) == 4 and self.command in (self.CASET, self.RASET):
+                start, end = struct.unpack(">HH", self.parameters)
+                x0, x1, y0, y1 = self.window
+                if self.command == self.CASET:
+                    self.window = (start, end, y0, y1)
+                else:
+                    self.window = (x0, x1, start, end)
+        return None
+
+    def _write(self, data):
+        x0, x1, y0, y1 = self.window
+        row_bytes = (x1 - x0 + 1) * 2
+        rows = y1 - y0 + 1
+        data = memoryview(data)
+        self.pixels_written += len(data) // 2
+        while len(data):
+            row = (self.offset // row_bytes) % rows
+            column_byte = self.offset % row_bytes
+            size = min(len(data), row_bytes - column_byte)
+            start = ((y0 + row) * self.width + x0) * 2 + column_byte
+            self.memory[start:start + size] = data[:size]
+            data = data[size:]
+            self.offset += size
+
+    def rgb(self):
+        """ RGB888 of the panel memory (the panel receives big endian RGB565) """
+        import image
+        table = image._table("rgb")
+        pixels = memoryview(self.memory).cast("H")
+        swap = [((pixel & 0xFF) << 8) | (pixel >> 8) for pixel in range(65536)]
+        return b"".join(table[swap[pixel]] for pixel in pixels)
+
+    def save_png(self, path):
+        write_png(path, self.width, self.height, self.rgb())
+
+
+class LinkErrorModel():
+    """ Errors of the camera slave link. A transfer sent faster than max_baudrate, or started less than
+    setup_us after the chip select, gets one byte corrupted with probability error_rate: anywhere in
+    the header, acknowledgement and payload of a frame, or in the control sent by the master. """
+
+    def __init__(self, max_baudrate=30000000, setup_us=500, error_rate=1.0, seed=1):
+        self.max_baudrate = max_baudrate
+        self.setup_us = setup_us
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.corrupted_transfers = 0
+
+    def corrupts(self, baudrate, setup_us):
+        if baudrate <= self.max_baudrate and setup_us >= self.setup_us:
+            return False
+        if self.random.random() >= self.error_rate:
+            return False
+        self.corrupted_transfers += 1
+        return True
+
+
+class CameraSlaveLink(SpiDevice):
+    """ Visual camera OPENMV (SPI slave) as seen by the master. The slave builds a frame every
+    frame_period_us and sends its last complete frame (again) until a newer one is complete, a
+    different control discards it and the slave is busy until it completes a frame with it. A
+    control which fails CameraSlaveControl.load is rejected like on the slave. """
+
+    def __init__(self, chip_select="P4", data_ready="P5", frame_source=None, frame_period_us=0, error_model=None):
+        super().__init__(chip_select)
+        from pyb import Pin
+        import utime
+        self.frame_source = frame_source or self._synthetic_frame
+        self.frame_period_us = frame_period_us
+        self.error_model = error_model
+        self.corrupt_index = None # Header or payload byte corrupted in the current transfer
+        self.corrupt_ack = False # Acknowledgement corrupted in the current transfer
+        self.payload_requested = False # Acknowledgement of the header in the current transfer
+        # The slave missed a payload request and reads the next control while the master receives
+        # the payload, it gets junk instead
+        self.control_lost = False
+        self.frame = bytes(320 * 240 * 2)
+        from components.camera_slave_control import CameraSlaveControl
+        from utils.image import create_crc16_table
+        self.frame_number = 0
+        self.slave_control = CameraSlaveControl()
+        self.crc_table = create_crc16_table()
+        self.control = bytes(self.slave_control.buff)
+        self.rejected_controls = 0
+        self.corrupted_controls_applied = 0 # Passed the checks corrupted, the slave would misbehave
+        self.thermal = bytearray(160 * 120) # Last thermal frame sent by the master (fused frames)
+        self.palette = None
+        self.frame_us = utime.ticks_us() - frame_period_us # Completion of the last frame
+        self.ready_us = self.frame_us # A frame with the current control is complete from then on
+        Pin.provide(data_ready, self._data_ready)
+
+    def _synthetic_frame(self):
+        """ Colour bars moving to the right """
+        import image
+        shift = (self.frame_number * 8) % 320
+        row = bytearray()
+        for x in range(320):
+            band = ((x + shift) % 320) // 40
+            row += struct.pack("<H", image.rgb_to_rgb565(
+                255 * (band & 1), 255 * ((band >> 1) & 1), 255 * ((band >> 2) & 1)
+            ))
+        return bytes(row) * 240
+
+    def _format(self, frame):
+        """ Header and frame in the format and compression of the last control (see CameraSlaveControl) """
+        import binascii
+        import utime
+        width = 320
+        frame_format = self.control[6]
+        if frame_format == 2:
+            # Fused: the thermal frame blended like on the visual camera
+            from host.reference_image import qqgrey2qvga_blend_reference
+            frame = qqgrey2qvga_blend_reference(
+                self.thermal, frame, bytearray(len(frame)), self._ironbow_palette(), *self.control[8:12]
+            ).tobytes()
+        if frame_format == 1:
+            # QQVGA: every second column and row
+            pixels = memoryview(frame).cast("H")
+            frame = b"".join(pixels[row * 320:(row + 1) * 320:2].tobytes() for row in range(0, 240, 2))
+            width = 160
+        codec = 0
+        if self.control[7] == 1:
+            from host.reference_image import rle565_encode_reference
+            payload = rle565_encode_reference(frame, len(frame) // 2, width).tobytes()
+            if len(payload) <= 320 * 240:
+                codec = 1
+                frame = payload
+        header = struct.pack("<IBBII", len(frame), codec, frame_format, self.frame_number + 1, utime.ticks_ms() & 0x3FFFFFFF)
+        header += struct.pack("<H", binascii.crc_hqx(header + frame, 0xFFFF))
+        return header + frame
+
+    def _ironbow_palette(self):
+        if self.palette is None:
+            import image
+            import sensor
+            from utils.image import create_palette
+            self.palette = bytearray(512)
+            create_palette(image.Image(width=16, height=16, pixformat=sensor.GRAYSCALE), self.palette,
+                           color_palette=sensor.PALETTE_IRONBOW, byteswap=False)
+        return self.palette
+
+    def _data_ready(self):
+        import utime
+        if utime.ticks_diff(utime.ticks_us(), self.ready_us) >= 0:
+            return 0
+        return 1
+
+    def exchange(self, send, length):
+        import utime
+        now = utime.ticks_us()
+        if length == len(self.control) and send is not None and self.position == 0:
+            received = bytearray(send)
+            corrupted = False
+            if self.control_lost:
+                self.control_lost = False
+                received = bytearray(len(received))
+                corrupted = True
+            elif self.error_model and self.error_model.corrupts(self.baudrate, utime.ticks_diff(now, self.select_us)):
+                received[self.error_model.random.randrange(len(received))] ^= 0x10
+                corrupted = True
+            if not self.slave_control.load(received, self.crc_table):
+                self.rejected_controls += 1
+                return None
+            if corrupted and bytes(received) != bytes(send):
+                self.corrupted_controls_applied += 1
+            control = bytes(self.slave_control.buff)
+            # Only the crop, format and compression discard the ready frame, not the fusion bytes
+            frame_bytes = self.slave_control.FRAME_CONTROL_BYTES
+            if control[:frame_bytes] != self.control[:frame_bytes]:
+                self.ready_us = now + self.frame_period_us
+                self.frame_us = now - self.frame_period_us
+            self.control = control
+            return None
+        if self.position == 0 and utime.ticks_diff(now, self.frame_us) >= self.frame_period_us:
+            # The slave builds the frame with its own processor, the host time of the model is not
+            # time of the master
+            self.frame = self._format(self.frame_source())
+            utime.advance_us(-utime.ticks_diff(utime.ticks_us(), now))
+            self.frame_number += 1
+            self.frame_us = now
+        if self.position == 0:
+            self.payload_requested = False
+            self.corrupt_index = None
+            self.corrupt_ack = False
+            if self.error_model and self.error_model.corrupts(self.baudrate, utime.ticks_diff(now, self.select_us)):
+                # Position on the link: header, acknowledgement (16) and payload
+                position = self.error_model.random.randrange(len(self.frame) + 1)
+                if position == 16:
+                    self.corrupt_ack = True
+                else:
+                    self.corrupt_index = position if position < 16 else position - 1
+        if self.position == 16:
+            # The master acknowledges the header, the payload follows only with PAYLOAD_SEND
+            ack = send[0] if send is not None else 0
+            if self.corrupt_ack:
+                ack ^= 0x10
+            self.payload_requested = ack == 0x5A
+            self.control_lost = self.corrupt_ack and send is not None and send[0] == 0x5A
+            return bytes(length)
+        if self.position > 16 and not self.payload_requested:
+            return bytes(length)
+        # Position in the header and payload, without the acknowledgement
+        index = self.position if self.position < 16 else self.position - 1
+        if self.control[6] == 2 and send is not None and index >= 16:
+            # The thermal frame comes with the payload
+            start = index
+            end = min(index + length, 16 + len(self.thermal))
+            if start < end:
+                self.thermal[start - 16:end - 16] = bytes(send[start - index:end - index])
+        received = self.frame[index:index + length]
+        received += bytes(length - len(received))
+        if self.corrupt_index is not None and index <= self.corrupt_index < index + length:
+            received = bytearray(received)
+            received[self.corrupt_index - index] ^= 0x10
+            received = bytes(received)
+        return received
+
+
+class Xpt2046(SpiDevice):
+    """ Touch controller. touch = (x_raw, y_raw) or None when the screen is not touched """
+
+    GET_X = 0b10010000
+    GET_Y = 0b11010000
+
+    def __init__(self, chip_select="P7"):
+        super().__init__(chip_select)
+        self.touch = None
+        self.command = 0
+
+    def exchange(self, send, length):
+        received = bytearray(length)
+        for index in range(length):
+            position = self.position + index
+            if position == 0 and send is not None:
+                self.command = send[index]
+                continue
+            value = 0
+            if self.touch is not None:
+                value = self.touch[0] if self.command == self.GET_X else self.touch[1]
+            value <<= 3
+            received[index] = (value >> 8) & 0xFF if position == 1 else value & 0xFF
+        return bytes(received)
+
+
+class AuxiliaryControllerModel(SpiDevice):
+    """ PIC16F886: buttons, battery voltage and the RTC counter """
+
+    SPI_BUFFER_SIZE = 20
+
+    def __init__(self, chip_select="P6", battery_millivolts=3900, ticks=10000):
+        super().__init__(chip_select)
+        import utime
+        self.battery_millivolts = battery_millivolts
+        self.ticks_base = ticks
+        self.start_us = utime.ticks_us()
+        self.buttons = [0, 0, 0, 0]
+
+    def status(self):
+        import utime
+        ticks = self.ticks_base + utime.ticks_diff(utime.ticks_us(), self.start_us) // 2000000
+        buffer = bytearray(self.SPI_BUFFER_SIZE)
+        buffer[0:4] = bytes(self.buttons)
+        buffer[4] = (self.battery_millivolts >> 8) & 0xFF
+        buffer[5] = self.battery_millivolts & 0xFF
+        buffer[7:11] = struct.pack("<I", ticks)
+        buffer[self.SPI_BUFFER_SIZE - 1] = 1  # SPI_ERROR_NONE
+        return buffer
+
+    def exchange(self, send, length):
+        received = bytearray(length)
+        status = None
+        for index in range(length):
+            position = self.position + index
+            if position == 0:
+                # Package number, the model always agrees with the master
+                received[index] = send[index] if send is not None else 0
+            else:
+                if status is None:
+                    status = self.status()
+                if position <= self.SPI_BUFFER_SIZE:
+                    received[index] = status[position - 1]
+        return bytes(received)
+
+
+class Simulator():
+    """ Resets the stand-in modules and connects the device models to the SPI bus """
+
+    def __init__(self, thermal_frames=None, visual_frames=None, lepton_frame_period_us=0,
+                 visual_frame_period_us=0, link_error_model=None, on_frame=None):
+        from pyb import Pin, SPI, LED, ExtInt, USB_VCP
+        import sensor
+        import utime
+
+        Pin.reset_all()
+        ExtInt._interrupts.clear()
+        utime.clock_listeners.clear()
+        LED._state.clear()
+        USB_VCP.connected = False
+        SPI.statistics.clear()
+        utime.reset()
+        sensor.reset()
+        sensor.frame_source = cycle(thermal_frames) if thermal_frames else None
+        sensor.frame_period_us = lepton_frame_period_us
+
+        self.screen = Ili9341(on_frame=on_frame)
+        self.camera_slave = CameraSlaveLink(
+            frame_source=cycle(visual_frames) if visual_frames else None,
+            frame_period_us=visual_frame_period_us,
+            error_model=link_error_model,
+        )
+        self.touch = Xpt2046()
+        self.auxiliary_controller = AuxiliaryControllerModel()
+        SPI.devices = [self.screen, self.camera_slave, self.touch, self.auxiliary_controller]
+
+    def spi_statistics(self):
+        """ Bytes and seconds transferred per device """
+        from pyb import SPI
+        names = {device.chip_select: type(device).__name__ for device in SPI.devices}
+        return {names.get(name, name): tuple(values) for name, values in SPI.statistics.items()}
@@ -0,0 +1,603 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# CPython stand-in for the OPENMV image module.
+#
+# Only GRAYSCALE and RGB565 images are supported. RGB565 pixels are stored as little endian 16 bit
+# values, as in the OPENMV frame buffers. The drawing functions use a 5x7 font, the result is close
+# enough to check the layout in the PNG files written by the simulator.
+
+import struct
+
+GRAYSCALE = 1
+RGB565 = 2
+
+PALETTE_RAINBOW = 0
+PALETTE_IRONBOW = 1
+
+_FONT = bytes.fromhex(
+    "0000000000" "00005f0000" "0007000700" "147f147f14" "242a7f2a12" "2313086462" "3649562050" "0008070300"
+    "001c224100" "0041221c00" "2a1c7f1c2a" "08083e0808" "0080703000" "0808080808" "0000606000" "2010080402"
+    "3e5149453e" "00427f4000" "7249494946" "2141494d33" "1814127f10" "2745454539" "3c4a494931" "4121110907"
+    "3649494936" "464949291e" "0000140000" "0040340000" "0008142241" "1414141414" "0041221408" "0201590906"
+    "3e415d594e" "7c1211127c" "7f49494936" "3e41414122" "7f4141413e" "7f49494941" "7f09090901" "3e41415173"
+    "7f0808087f" "00417f4100" "2040413f01" "7f08142241" "7f40404040" "7f021c027f" "7f0408107f" "3e4141413e"
+    "7f09090906" "3e4151215e" "7f09192946" "2649494932" "03017f0103" "3f4040403f" "1f2040201f" "3f4038403f"
+    "6314081463" "0304780403" "6159494d43" "007f414141" "0204081020" "004141417f" "0402010204" "4040404040"
+    "0003070800" "2054547840" "7f28444438" "3844444428" "384444287f" "3854545418" "00087e0902" "18a4a49c78"
+    "7f08040478" "00447d4000" "2040403d00" "7f10284400" "00417f4000" "7c0478047c" "7c08040478" "3844444438"
+    "fc18242418" "18242418fc" "7c08040408" "4854545424" "04043f4424" "3c4040207c" "1c2040201c" "3c4030403c"
+    "4428102844" "4c9090907c" "4464544c44" "0008364100" "0000770000" "0041360800" "0201020402"
+)
+_FONT_WIDTH = 8
+_FONT_HEIGHT = 10
+
+
+def _palette_stops(stops):
+    table = []
+    for value in range(256):
+        for (start, color_start), (end, color_end) in zip(stops, stops[1:]):
+            if start <= value <= end:
+                fraction = (value - start) / (end - start)
+                table.append(tuple(round(a + (b - a) * fraction) for a, b in zip(color_start, color_end)))
+                break
+    return table
+
+
+_PALETTES_RGB = {
+    PALETTE_RAINBOW: _palette_stops((
+        (0, (0, 0, 255)), (64, (0, 255, 255)), (128, (0, 255, 0)), (192, (255, 255, 0)), (255, (255, 0, 0)),
+    )),
+    PALETTE_IRONBOW: _palette_stops((
+        (0, (0, 0, 0)), (40, (30, 0, 120)), (100, (170, 0, 150)), (150, (230, 60, 40)),
+        (200, (250, 150, 0)), (235, (255, 225, 60)), (255, (255, 255, 255)),
+    )),
+}
+
+
+def rgb_to_rgb565(r, g, b):
+    return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+
+
+def rgb565_to_rgb(pixel):
+    r = (pixel >> 11) & 0x1F
+    g = (pixel >> 5) & 0x3F
+    b = pixel & 0x1F
+    return ((r * 255) // 31, (g * 255) // 63, (b * 255) // 31)
+
+
+def rgb_to_grayscale(r, g, b):
+    return (r * 38 + g * 75 + b * 15) >> 7
+
+
+_tables = {}
+
+
+def _table(name):
+    """ Lookup tables indexed by a RGB565 value, built on first use """
+    if name not in _tables:
+        if name == "grayscale":
+            _tables[name] = bytes(rgb_to_grayscale(*rgb565_to_rgb(pixel)) for pixel in range(65536))
+        elif name == "rgb":
+            _tables[name] = [bytes(rgb565_to_rgb(pixel)) for pixel in range(65536)]
+    return _tables[name]
+
+
+def palette_rgb565(palette):
+    """ Host only: the 256 RGB565 values of a palette """
+    return [rgb_to_rgb565(*color) for color in _PALETTES_RGB[palette]]
+
+
+class Statistics():
+
+    def __init__(self, values):
+        values = sorted(values)
+        self._values = values
+        count = len(values)
+        self._mean = round(sum(values) / count) if count else 0
+
+    def mean(self):
+        return self._mean
+
+    def median(self):
+        return self._values[len(self._values) // 2] if self._values else 0
+
+    def mode(self):
+        return max(set(self._values), key=self._values.count) if self._values else 0
+
+    def stdev(self):
+        if not self._values:
+            return 0
+        mean = sum(self._values) / len(self._values)
+        return round((sum((v - mean) ** 2 for v in self._values) / len(self._values)) ** 0.5)
+
+    def min(self):
+        return self._values[0] if self._values else 0
+
+    def max(self):
+        return self._values[-1] if self._values else 0
+
+    def lq(self):
+        return self._values[len(self._values) // 4] if self._values else 0
+
+    def uq(self):
+        return self._values[(3 * len(self._values)) // 4] if self._values else 0
+
+
+class Blob():
+
+    def __init__(self, x, y, w, h, pixels, cx, cy):
+        self._rect = (x, y, w, h)
+        self._pixels = pixels
+        self._cx = cx
+        self._cy = cy
+
+    def rect(self):
+        return self._rect
+
+    def x(self):
+        return self._rect[0]
+
+    def y(self):
+        return self._rect[1]
+
+    def w(self):
+        return self._rect[2]
+
+    def h(self):
+        return self._rect[3]
+
+    def pixels(self):
+        return self._pixels
+
+    def area(self):
+        return self._rect[2] * self._rect[3]
+
+    def cx(self):
+        return self._cx
+
+    def cy(self):
+        return self._cy
+
+    def merge(self, other):
+        x = min(self._rect[0], other._rect[0])
+        y = min(self._rect[1], other._rect[1])
+        x_end = max(self._rect[0] + self._rect[2], other._rect[0] + other._rect[2])
+        y_end = max(self._rect[1] + self._rect[3], other._rect[1] + other._rect[3])
+        pixels = self._pixels + other._pixels
+        cx = round((self._cx * self._pixels + other._cx * other._pixels) / pixels)
+        cy = round((self._cy * self._pixels + other._cy * other._pixels) / pixels)
+        return Blob(x, y, x_end - x, y_end - y, pixels, cx, cy)
+
+    def overlaps(self, other):
+        return not (
+            self._rect[0] + self._rect[2] < other._rect[0] or other._rect[0] + other._rect[2] < self._rect[0] or
+            self._rect[1] + self._rect[3] < other._rect[1] or other._rect[1] + other._rect[3] < self._rect[1]
+        )
+
+
+class Image():
+    """ Image(path, copy_to_fb=False) loads a bmp/pgm/ppm file.
+
+    copy_to_fb=True loads the file in the sensor frame buffer, copy_to_fb=<Image> loads it in that image.
+    In both cases the returned object is the frame buffer itself.
+    """
+
+    def __new__(cls, path=None, copy_to_fb=False, width=None, height=None, pixformat=None):
+        if path is None:
+            return cls._blank(width, height, pixformat)
+        width, height, pixformat, data = _load(path)
+        if copy_to_fb is True:
+            import sensor
+            target = sensor.get_fb()
+        elif copy_to_fb:
+            target = copy_to_fb
+        else:
+            return cls._blank(width, height, pixformat, data)
+        target._set(width, height, pixformat, data)
+        return target
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @classmethod
+    def _blank(cls, width, height, pixformat, data=None):
+        image = object.__new__(cls)
+        image._data = bytearray()
+        image._set(width, height, pixformat, data)
+        return image
+
+    def _set(self, width, height, pixformat, data=None):
+        self._width = width
+        self._height = height
+        self._format = pixformat
+        size = width * height * pixformat
+        if data is None:
+            data = bytes(size)
+        self._data[:] = data[:size]
+
+    # ---------------------------------------------------------------------------------------------
+    # Properties
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def format(self):
+        return self._format
+
+    def size(self):
+        return len(self._data)
+
+    def bytearray(self):
+        return self._data
+
+    def _pixels16(self):
+        return memoryview(self._data).cast("H")
+
+    def get_pixel(self, x, y, rgb_tuple=True):
+        x = int(x)
+        y = int(y)
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            return None
+        index = x + y * self._width
+        if self._format == GRAYSCALE:
+            return self._data[index]
+        pixel = self._pixels16()[index]
+        return rgb565_to_rgb(pixel) if rgb_tuple else pixel
+
+    def set_pixel(self, x, y, color):
+        x = int(x)
+        y = int(y)
+        if 0 <= x < self._width and 0 <= y < self._height:
+            self._put(x + y * self._width, self._color(color))
+
+    def _color(self, color):
+        if color is None:
+            color = (255, 255, 255)
+        if self._format == GRAYSCALE:
+            if isinstance(color, tuple):
+                return rgb_to_grayscale(*color)
+            return int(color) & 0xFF
+        if isinstance(color, tuple):
+            return rgb_to_rgb565(*color)
+        return int(color) & 0xFFFF
+
+    def _color_bytes(self, value):
+        if self._format == GRAYSCALE:
+            return bytes((value,))
+        return struct.pack("<H", value)
+
+    def _put(self, index, value):
+        if self._format == GRAYSCALE:
+            self._data[index] = value
+        else:
+            self._pixels16()[index] = value
+
+    # ---------------------------------------------------------------------------------------------
+    # Conversions
+
+    def _grayscale_data(self):
+        if self._format == GRAYSCALE:
+            return bytes(self._data)
+        table = _table("grayscale")
+        return bytes(table[pixel] for pixel in self._pixels16())
+
+    def to_grayscale(self):
+        self._set(self._width, self._height, GRAYSCALE, self._grayscale_data())
+        return self
+
+    def to_rgb565(self):
+        if self._format == RGB565:
+            return self
+        table = [rgb_to_rgb565(value, value, value) for value in range(256)]
+        return self._apply_palette(table)
+
+    def to_rainbow(self, color_palette=PALETTE_RAINBOW):
+        return self._apply_palette(palette_rgb565(color_palette))
+
+    def to_ironbow(self):
+        return self.to_rainbow(color_palette=PALETTE_IRONBOW)
+
+    def _apply_palette(self, table):
+        grey = self._grayscale_data()
+        data = bytearray(len(grey) * 2)
+        data[0::2] = grey.translate(bytes(value & 0xFF for value in table))
+        data[1::2] = grey.translate(bytes(value >> 8 for value in table))
+        self._set(self._width, self._height, RGB565, data)
+        return self
+
+    def copy(self):
+        return Image._blank(self._width, self._height, self._format, bytes(self._data))
+
+    def compressed_for_ide(self, quality=90):
+        return bytes(self._data)
+
+    # ---------------------------------------------------------------------------------------------
+    # Drawing
+
+    def _fill_rows(self, x, y, width, height, value):
+        x_end = min(self._width, x + width)
+        y_end = min(self._height, y + height)
+        x = max(0, x)
+        y = max(0, y)
+        if x >= x_end or y >= y_end:
+            return
+        bpp = self._format
+        row = self._color_bytes(value) * (x_end - x)
+        for row_index in range(y, y_end):
+            start = (x + row_index * self._width) * bpp
+            self._data[start:start + len(row)] = row
+
+    def clear(self):
+        self._data[:] = bytes(len(self._data))
+        return self
+
+    def fill(self, color=None, c=None):
+        value = self._color(color if color is not None else c)
+        self._fill_rows(0, 0, self._width, self._height, value)
+        return self
+
+    def draw_rectangle(self, x, y=None, w=None, h=None, color=None, thickness=1, fill=False, c=None):
+        if isinstance(x, tuple):
+            x, y, w, h = x
+        x, y, w, h = int(x), int(y), int(w), int(h)
+        value = self._color(color if color is not None else c)
+        if fill:
+            self._fill_rows(x, y, w, h, value)
+        else:
+            self._fill_rows(x, y, w, thickness, value)
+            self._fill_rows(x, y + h - thickness, w, thickness, value)
+            self._fill_rows(x, y, thickness, h, value)
+            self._fill_rows(x + w - thickness, y, thickness, h, value)
+        return self
+
+    def draw_line(self, x0, y0, x1=None, y1=None, color=None, thickness=1, c=None):
+        if isinstance(x0, tuple):
+            x0, y0, x1, y1 = x0
+        value = self._color(color if color is not None else c)
+        steps = max(abs(x1 - x0), abs(y1 - y0), 1)
+        for step in range(steps + 1):
+            x = round(x0 + (x1 - x0) * step / steps)
+            y = round(y0 + (y1 - y0) * step / steps)
+            self._fill_rows(x, y, thickness, thickness, value)
+        return self
+
+    def draw_cross(self, x, y=None, color=None, size=5, thickness=1, c=None):
+        if isinstance(x, tuple):
+            x, y = x
+        value = self._color(color if color is not None else c)
+        self._fill_rows(x - size, y, 2 * size + 1, thickness, value)
+        self._fill_rows(x, y - size, thickness, 2 * size + 1, value)
+        return self
+
+    def draw_string(self, x, y, text, color=None, scale=1.0, x_spacing=0, y_spacing=0, mono_space=True, c=None, **kwargs):
+        value = self._color(color if color is not None else c)
+        x = int(x)
+        y = int(y)
+        x_start = x
+        for char in str(text):
+            if char == "\n":
+                x = x_start
+                y += round(_FONT_HEIGHT * scale) + y_spacing
+                continue
+            code = ord(char)
+            if not 0x20 <= code <= 0x7E:
+                code = ord("?")
+            glyph = _FONT[(code - 0x20) * 5:(code - 0x20) * 5 + 5]
+            for column, bits in enumerate(glyph):
+                for row in range(8):
+                    if bits & (1 << row):
+                        x_pixel = x + round((column + 1) * scale)
+                        y_pixel = y + round((row + 1) * scale)
+                        size = max(1, round(scale))
+                        self._fill_rows(x_pixel, y_pixel, size, size, value)
+            if mono_space:
+                advance = _FONT_WIDTH
+            else:
+                used = [column for column, bits in enumerate(glyph) if bits]
+                advance = (used[-1] + 3) if used else 4
+            x += round(advance * scale) + x_spacing
+        return self
+
+    # ---------------------------------------------------------------------------------------------
+    # Analysis
+
+    def _roi(self, roi):
+        if roi is None:
+            return 0, 0, self._width, self._height
+        x, y, w, h = roi
+        x_end = min(self._width, x + w)
+        y_end = min(self._height, y + h)
+        return max(0, x), max(0, y), x_end - max(0, x), y_end - max(0, y)
+
+    def _grey_values(self, roi):
+        x, y, w, h = self._roi(roi)
+        grey = self._grayscale_data()
+        for row in range(y, y + h):
+            yield from grey[x + row * self._width:x + w + row * self._width]
+
+    def get_statistics(self, thresholds=None, invert=False, roi=None, bins=None, **kwargs):
+        values = self._grey_values(roi)
+        if thresholds:
+            values = [
+                value for value in values
+                if any(low <= value <= high for low, high in thresholds) != invert
+            ]
+        return Statistics(list(values))
+
+    get_stats = get_statistics
+    statistics = get_statistics
+
+    def find_blobs(self, thresholds, invert=False, roi=None, x_stride=2, y_stride=1, area_threshold=10,
+                   pixels_threshold=10, merge=False, margin=0, **kwargs):
+        x0, y0, w, h = self._roi(roi)
+        grey = self._grayscale_data()
+        width = self._width
+
+        def inside(index):
+            return any(low <= grey[index] <= high for low, high in thresholds) != invert
+
+        visited = bytearray(len(grey))
+        blobs = []
+        for row in range(y0, y0 + h):
+            for column in range(x0, x0 + w):
+                index = column + row * width
+                if visited[index] or not inside(index):
+                    continue
+                visited[index] = 1
+                stack = [index]
+                pixels = 0
+                x_min = x_max = column
+                y_min = y_max = row
+                x_sum = y_sum = 0
+                while stack:
+                    current = stack.pop()
+                    cx, cy = current % width, current // width
+                    pixels += 1
+                    x_sum += cx
+                    y_sum += cy
+                    x_min, x_max = min(x_min, cx), max(x_max, cx)
+                    y_min, y_max = min(y_min, cy), max(y_max, cy)
+                    for nx, ny in ((cx - 1, cy), (cx + 1, cy), (cx, cy - 1), (cx, cy + 1)):
+                        if x0 <= nx < x0 + w and y0 <= ny < y0 + h:
+                            neighbour = nx + ny * width
+                            if not visited[neighbour] and inside(neighbour):
+                                visited[neighbour] = 1
+                                stack.append(neighbour)
+                blob = Blob(
+                    x_min, y_min, x_max - x_min + 1, y_max - y_min + 1,
+                    pixels, round(x_sum / pixels), round(y_sum / pixels),
+                )
+                if blob.pixels() >= pixels_threshold and blob.area() >= area_threshold:
+                    blobs.append(blob)
+
+        if merge:
+            merged = True
+            while merged:
+                merged = False
+                for i in range(len(blobs)):
+                    for j in range(i + 1, len(blobs)):
+                        if blobs[i].overlaps(blobs[j]):
+                            blobs[i] = blobs[i].merge(blobs.pop(j))
+                            merged = True
+                            break
+                    if merged:
+                        break
+        return blobs
+
+    # ---------------------------------------------------------------------------------------------
+    # Files
+
+    def save(self, path, roi=None, quality=50):
+        _save(self, path)
+        return self
+
+
+# -------------------------------------------------------------------------------------------------
+# File formats
+
+
+def _rgb_rows(image):
+    """ Rows of RGB888 bytes """
+    if image._format == GRAYSCALE:
+        for row in range(image._height):
+            grey = image._data[row * image._width:(row + 1) * image._width]
+            yield bytes(value for value in grey for _ in range(3))
+    else:
+        table = _table("rgb")
+        pixels = image._pixels16()
+        for row in range(image._height):
+            yield b"".join(table[pixel] for pixel in pixels[row * image._width:(row + 1) * image._width])
+
+
+def _save(image, path):
+    extension = path.lower().rsplit(".", 1)[-1]
+    with open(path, "wb") as f:
+        if extension == "pgm":
+            f.write(b"P5\n%d %d\n255\n" % (image._width, image._height))
+            f.write(bytes(image.copy().to_grayscale()._data))
+        elif extension == "ppm":
+            f.write(b"P6\n%d %d\n255\n" % (image._width, image._height))
+            for row in _rgb_rows(image):
+                f.write(row)
+        else:
+            padding = (-image._width * 3) % 4
+            data_size = (image._width * 3 + padding) * image._height
+            f.write(b"BM" + struct.pack("<IHHI", 54 + data_size, 0, 0, 54))
+            f.write(struct.pack("<IiiHHIIiiII", 40, image._width, image._height, 1, 24, 0, data_size, 2835, 2835, 0, 0))
+            for row in reversed(list(_rgb_rows(image))):
+                f.write(bytes(row[i + 2 - 2 * (i % 3)] for i in range(len(row))) + bytes(padding))
+
+
+def _netpbm_header(data):
+    fields = []
+    index = 0
+    while len(fields) < 4:
+        while data[index:index + 1].isspace():
+            index += 1
+        if data[index:index + 1] == b"#":
+            while data[index:index + 1] not in (b"\n", b""):
+                index += 1
+            continue
+        start = index
+        while not data[index:index + 1].isspace():
+            index += 1
+        fields.append(data[start:index])
+    return fields, index + 1
+
+
+def _rgb888_to_rgb565(data):
+    pixels = bytearray(len(data) // 3 * 2)
+    view = memoryview(pixels).cast("H")
+    for index in range(len(data) // 3):
+        view[index] = rgb_to_rgb565(data[3 * index], data[3 * index + 1], data[3 * index + 2])
+    return pixels
+
+
+def _load(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:2] in (b"P5", b"P6"):
+        (magic, width, height, _), offset = _netpbm_header(data)
+        width = int(width)
+        height = int(height)
+        if magic == b"P5":
+            return width, height, GRAYSCALE, data[offset:offset + width * height]
+        return width, height, RGB565, _rgb888_to_rgb565(data[offset:offset + width * height * 3])
+    if data[:2] == b"BM":
+        offset, = struct.unpack_from("<I", data, 10)
+        width, height, _, bits = struct.unpack_from("<iiHH", data, 18)
+        if bits != 24:
+            raise OSError("Only 24 bit bmp files are supported")
+        bottom_up = height > 0
+        height = abs(height)
+        stride = (width * 3 + 3) & ~3
+        rgb = bytearray()
+        for row in range(height):
+            source_row = height - 1 - row if bottom_up else row
+            bgr = data[offset + source_row * stride:offset + source_row * stride + width * 3]
+            rgb += bytes(bgr[i + 2 - 2 * (i % 3)] for i in range(len(bgr)))
+        return width, height, RGB565, _rgb888_to_rgb565(rgb)
+    raise OSError("Unsupported image file {}".format(path))
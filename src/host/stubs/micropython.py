@@ -0,0 +1,119 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# CPython stand-in for the micropython module.
+#
+# Viper functions are executed as plain python. The arguments annotated as ptr8/ptr16/ptr32 are
+# wrapped so indexing them reads/writes elements of that size (with the truncation that viper
+# would do on store), which is the behaviour the kernels in utils/image.py rely on.
+
+import builtins
+import functools
+
+
+def _buffer(obj):
+    if isinstance(obj, _Pointer):
+        return obj._mv
+    if hasattr(obj, "bytearray"):
+        obj = obj.bytearray()
+    return memoryview(obj).cast("B")
+
+
+class _Pointer():
+    _format = "B"
+    _mask = 0xFF
+
+    def __init__(self, obj):
+        mv = _buffer(obj)
+        self._mv = mv if self._format == "B" else mv.cast(self._format)
+
+    def __getitem__(self, index):
+        return self._mv[index]
+
+    def __setitem__(self, index, value):
+        self._mv[index] = int(value) & self._mask
+
+    def __len__(self):
+        return len(self._mv)
+
+
+class ptr8(_Pointer):
+    _format = "B"
+    _mask = 0xFF
+
+
+class ptr16(_Pointer):
+    _format = "H"
+    _mask = 0xFFFF
+
+
+class ptr32(_Pointer):
+    _format = "I"
+    _mask = 0xFFFFFFFF
+
+
+def const(value):
+    return value
+
+
+def viper(function):
+    pointers = {
+        name: annotation for name, annotation in function.__annotations__.items()
+        if isinstance(annotation, type) and issubclass(annotation, _Pointer)
+    }
+    names = function.__code__.co_varnames[:function.__code__.co_argcount]
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        args = [
+            pointers[name](arg) if name in pointers else arg
+            for name, arg in zip(names, args)
+        ]
+        for name in kwargs:
+            if name in pointers:
+                kwargs[name] = pointers[name](kwargs[name])
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def native(function):
+    return function
+
+
+def schedule(function, argument):
+    function(argument)
+    return True
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def mem_info(*args):
+    pass
+
+
+# Names which MicroPython provides as builtins
+builtins.ptr8 = ptr8
+builtins.ptr16 = ptr16
+builtins.ptr32 = ptr32
+builtins.const = const
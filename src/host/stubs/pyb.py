@@ -0,0 +1,316 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# CPython stand-in for the pyb module.
+#
+# Pins keep their value and notify the devices listening to them (chip select, data/command...).
+# SPI transfers are routed to the device whose chip select pin is low, and the transfer time at the
+# configured baudrate is added to the virtual clock of utime.
+
+import utime
+
+
+def _buffer(obj):
+    if hasattr(obj, "bytearray"):
+        obj = obj.bytearray()
+    return memoryview(obj).cast("B")
+
+
+class _Board():
+    pass
+
+
+class Pin():
+    IN = 0
+    OUT_PP = 1
+    OUT_OD = 2
+    AF_PP = 3
+    AF_OD = 4
+    ANALOG = 5
+    PULL_NONE = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+    AF5_SPI2 = 5
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+
+    _values = {}
+    _listeners = {}
+    _providers = {}
+
+    board = _Board()
+
+    def __init__(self, pin, mode=IN, pull=PULL_NONE, af=None, value=None):
+        self._name = pin._name if isinstance(pin, Pin) else str(pin)
+        self.mode = mode
+        Pin._values.setdefault(self._name, 1)
+        if value is not None:
+            self.value(value)
+
+    def name(self):
+        return self._name
+
+    def value(self, value=None):
+        if value is None:
+            if self._name in Pin._providers:
+                return Pin._providers[self._name]()
+            return Pin._values.get(self._name, 1)
+        value = 1 if value else 0
+        previous = Pin._values.get(self._name, 1)
+        Pin._values[self._name] = value
+        if value != previous:
+            for listener in Pin._listeners.get(self._name, ()):
+                listener(self._name, value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def __repr__(self):
+        return "Pin({})".format(self._name)
+
+    @staticmethod
+    def listen(pin, listener):
+        """ Host only: call listener(name, value) whenever the pin changes """
+        name = pin._name if isinstance(pin, Pin) else str(pin)
+        Pin._listeners.setdefault(name, []).append(listener)
+
+    @staticmethod
+    def provide(pin, provider):
+        """ Host only: the value of an input pin is given by provider() """
+        name = pin._name if isinstance(pin, Pin) else str(pin)
+        Pin._providers[name] = provider
+
+    @staticmethod
+    def reset_all():
+        """ Host only: forget all the pin values, listeners and providers """
+        Pin._values.clear()
+        Pin._listeners.clear()
+        Pin._providers.clear()
+
+
+for _index in range(10):
+    setattr(Pin.board, "P{}".format(_index), Pin("P{}".format(_index)))
+
+
+class ExtInt():
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+    IRQ_RISING_FALLING = 3
+
+    _interrupts = {}
+
+    def __init__(self, pin, mode, pull, callback):
+        self.pin = pin if isinstance(pin, Pin) else Pin(pin)
+        self.mode = mode
+        self.callback = callback
+        self.enabled = True
+        ExtInt._interrupts[self.pin.name()] = self
+        Pin.listen(self.pin, self._edge)
+        self._provided_value = None
+        utime.clock_listeners.append(self._poll_provider)
+
+    def _poll_provider(self):
+        """ Host only: edges of a pin whose value is given by a provider (see Pin.provide) """
+        provider = Pin._providers.get(self.pin.name())
+        if provider is None:
+            return
+        value = provider()
+        previous = self._provided_value
+        self._provided_value = value
+        if previous is not None and value != previous:
+            self._edge(self.pin.name(), value)
+
+    def _edge(self, name, value):
+        if not self.enabled:
+            return
+        if (value == 0 and self.mode & ExtInt.IRQ_FALLING) or (value == 1 and self.mode & ExtInt.IRQ_RISING):
+            self.callback(name)
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def line(self):
+        return 0
+
+    def swint(self):
+        self.callback(self.pin.name())
+
+
+class SPI():
+    MASTER = 0
+    SLAVE = 1
+    MSB = 0
+    LSB = 1
+
+    # Host only: devices on the bus, each one with a chip_select pin name and
+    # a transfer(tx_buffer_or_None, rx_length) method returning the received bytes (or None)
+    devices = []
+    # Host only: total bytes and seconds transferred per chip select pin
+    statistics = {}
+
+    def __init__(self, bus, mode=MASTER, baudrate=328125, polarity=1, phase=0, **kwargs):
+        self.bus = bus
+        self.init(mode, baudrate=baudrate, polarity=polarity, phase=phase, **kwargs)
+
+    def init(self, mode=MASTER, baudrate=328125, polarity=1, phase=0, **kwargs):
+        self.mode = mode
+        self.baudrate = baudrate
+        self.polarity = polarity
+        self.phase = phase
+
+    def deinit(self):
+        pass
+
+    def _device(self):
+        for device in SPI.devices:
+            if Pin._values.get(device.chip_select, 1) == 0:
+                return device
+        return None
+
+    def _transfer(self, send, length):
+        utime.advance_us(length * 8 * 1000000 / self.baudrate)
+        device = self._device()
+        if device is None:
+            return None
+        statistics = SPI.statistics.setdefault(device.chip_select, [0, 0.0])
+        statistics[0] += length
+        statistics[1] += length * 8 / self.baudrate
+        device.baudrate = self.baudrate
+        return device.transfer(send, length)
+
+    def send(self, send, timeout=5000):
+        if isinstance(send, int):
+            send = bytes([send])
+        send = _buffer(send)
+        self._transfer(send, len(send))
+
+    def recv(self, recv, timeout=5000):
+        if isinstance(recv, int):
+            buffer = bytearray(recv)
+        else:
+            buffer = _buffer(recv)
+        received = self._transfer(None, len(buffer))
+        if received is not None:
+            buffer[:] = received
+        else:
+            buffer[:] = bytes(len(buffer))
+        return recv if not isinstance(recv, int) else buffer
+
+    def send_recv(self, send, recv=None, timeout=5000):
+        send = _buffer(send)
+        buffer = bytearray(len(send)) if recv is None else _buffer(recv)
+        received = self._transfer(send, len(buffer))
+        if received is not None:
+            buffer[:] = received
+        else:
+            buffer[:] = bytes(len(buffer))
+        return recv if recv is not None else buffer
+
+
+class LED():
+    _state = {}
+
+    def __init__(self, number):
+        self.number = number
+
+    def on(self):
+        LED._state[self.number] = True
+
+    def off(self):
+        LED._state[self.number] = False
+
+    def toggle(self):
+        LED._state[self.number] = not LED._state.get(self.number, False)
+
+    def intensity(self, value=None):
+        return 255 if LED._state.get(self.number, False) else 0
+
+
+class USB_VCP():
+    connected = False
+
+    def isconnected(self):
+        return USB_VCP.connected
+
+    def any(self):
+        return False
+
+
+class RTC():
+
+    def datetime(self, datetime_tuple=None):
+        if datetime_tuple is None:
+            year, month, mday, hour, minute, second, weekday, yearday = utime.localtime()
+            return (year, month, mday, weekday + 1, hour, minute, second, 0)
+        year, month, day, weekday, hours, minutes, seconds, subseconds = datetime_tuple
+        utime.set_time(utime.mktime((year, month, day, hours, minutes, seconds, 0, 0)))
+
+
+def disable_irq():
+    return True
+
+
+def enable_irq(state=True):
+    pass
+
+
+def delay(ms):
+    utime.sleep_ms(ms)
+
+
+def udelay(us):
+    utime.sleep_us(us)
+
+
+def millis():
+    return utime.ticks_ms()
+
+
+def micros():
+    return utime.ticks_us()
+
+
+def elapsed_millis(start):
+    return utime.ticks_diff(utime.ticks_ms(), start)
+
+
+def elapsed_micros(start):
+    return utime.ticks_diff(utime.ticks_us(), start)
+
+
+def freq():
+    return (480000000, 240000000, 120000000, 120000000)
@@ -0,0 +1,284 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# CPython stand-in for the OPENMV sensor module.
+#
+# snapshot() replays the frames returned by frame_source (set by the simulator), by default a
+# synthetic scene. The Lepton CCI attributes are kept in a register map so the values written by
+# the application can be read back, and every CCI transaction advances the virtual clock.
+
+import struct
+
+import utime
+import image
+from image import GRAYSCALE, RGB565, PALETTE_RAINBOW, PALETTE_IRONBOW
+
+BINARY = 3
+BAYER = 4
+JPEG = 5
+
+QQVGA = (160, 120)
+QVGA = (320, 240)
+VGA = (640, 480)
+
+LEPTON = 0x54
+
+IOCTL_LEPTON_GET_WIDTH = 0x0A
+IOCTL_LEPTON_GET_HEIGHT = 0x0B
+IOCTL_LEPTON_GET_RADIOMETRY = 0x0C
+IOCTL_LEPTON_GET_REFRESH = 0x0D
+IOCTL_LEPTON_GET_RESOLUTION = 0x0E
+IOCTL_LEPTON_RUN_COMMAND = 0x0F
+IOCTL_LEPTON_SET_ATTRIBUTE = 0x10
+IOCTL_LEPTON_GET_ATTRIBUTE = 0x11
+IOCTL_LEPTON_GET_FPA_TEMPERATURE = 0x12
+IOCTL_LEPTON_GET_AUX_TEMPERATURE = 0x13
+IOCTL_LEPTON_SET_MEASUREMENT_MODE = 0x14
+IOCTL_LEPTON_GET_MEASUREMENT_MODE = 0x15
+IOCTL_LEPTON_SET_MEASUREMENT_RANGE = 0x16
+IOCTL_LEPTON_GET_MEASUREMENT_RANGE = 0x17
+
+# Host only ---------------------------------------------------------------------------------------
+
+# Callable returning the bytes of the next frame (pixformat and framesize of the sensor)
+frame_source = None
+# Minimum and maximum temperature of the scene, used for the spotmeter and the static range
+temperature_range = (20.0, 35.0)
+# Time between frames of the sensor, snapshot() waits for the next one (0 to not wait)
+frame_period_us = 0
+# Time of one CCI transaction (I2C command, data and status polling)
+cci_transaction_us = 1000
+# Number of CCI transactions (ioctl calls) since the last reset
+cci_transactions = 0
+
+_REGISTERS_DEFAULT = {
+    0x0100: (1, 0),  # AGC enable
+    0x0148: (1, 0),  # AGC calculation enable
+    0x0248: (1, 0),  # SYS gain mode (LOW)
+    0x4E10: (1, 0),  # RAD enable
+    0x4E24: (1, 0),  # RAD TShutter mode
+    0x4E28: (30000,),  # RAD TShutter temperature
+    0x4E30: (0, 0),  # RAD run status
+    0x4EBC: (8192, 29515, 8192, 29515, 8192, 29515, 0, 29515),  # RAD flux linear parameters
+    0x4EC0: (1, 0),  # RAD T-Linear enable
+    0x4EC4: (1, 0),  # RAD T-Linear resolution (0.01)
+    0x4EC8: (1, 0),  # RAD T-Linear auto resolution
+    0x4ECC: (0, 0, 119, 159),  # RAD spotmeter ROI
+}
+registers = {}
+
+_pixformat = GRAYSCALE
+_framesize = QQVGA
+_fb = None
+_frame = None
+_frame_number = 0
+_last_frame_us = 0
+_measurement_mode = False
+_measurement_range = (-10.0, 40.0)
+
+
+_synthetic_frames = {}
+
+
+def _synthetic_frame(width, height, number):
+    """ Gradient with a warm spot moving around the frame """
+    cx = width // 2 + (width // 3) * ((number // 10) % 3 - 1)
+    cy = height // 2 + (height // 4) * ((number // 15) % 3 - 1)
+    key = (width, height, cx, cy)
+    if key in _synthetic_frames:
+        return _synthetic_frames[key]
+    frame = bytearray(width * height)
+    _synthetic_frames[key] = frame
+    for y in range(height):
+        for x in range(width):
+            distance = (x - cx) * (x - cx) + (y - cy) * (y - cy)
+            frame[x + y * width] = min(255, (x + y) * 100 // (width + height) + max(0, 255 - distance // 4))
+    return frame
+
+
+def reset():
+    global _pixformat, _framesize, _fb, _frame, _frame_number, _last_frame_us, cci_transactions
+    global _measurement_mode, _measurement_range
+    _pixformat = GRAYSCALE
+    _framesize = QQVGA
+    _fb = None
+    _frame = None
+    _frame_number = 0
+    _last_frame_us = 0
+    cci_transactions = 0
+    _measurement_mode = False
+    _measurement_range = (-10.0, 40.0)
+    registers.clear()
+    registers.update(_REGISTERS_DEFAULT)
+
+
+def set_pixformat(pixformat):
+    global _pixformat
+    _pixformat = pixformat
+
+
+def get_pixformat():
+    return _pixformat
+
+
+def set_framesize(framesize):
+    global _framesize
+    _framesize = framesize
+
+
+def get_framesize():
+    return _framesize
+
+
+def width():
+    return _framesize[0]
+
+
+def height():
+    return _framesize[1]
+
+
+def get_id():
+    return LEPTON
+
+
+def skip_frames(n=None, time=None):
+    if time is not None:
+        utime.sleep_ms(time)
+    for _ in range(n or 0):
+        snapshot()
+
+
+def get_fb():
+    global _fb
+    if _fb is None:
+        _fb = image.Image(width=width(), height=height(), pixformat=_pixformat)
+    return _fb
+
+
+def snapshot():
+    global _frame, _frame_number, _last_frame_us
+    if frame_period_us:
+        wait_us = _last_frame_us + frame_period_us - utime.ticks_us()
+        if wait_us > 0:
+            utime.advance_us(wait_us)
+        _last_frame_us = utime.ticks_us()
+    if frame_source:
+        data = frame_source()
+    else:
+        data = _synthetic_frame(width(), height(), _frame_number)
+    _frame = data
+    _frame_number += 1
+    fb = get_fb()
+    fb._set(width(), height(), _pixformat, data)
+    return fb
+
+
+def alloc_extra_fb(width, height, pixformat):
+    return image.Image(width=width, height=height, pixformat=pixformat)
+
+
+def dealloc_extra_fb():
+    pass
+
+
+def set_auto_gain(*args, **kwargs):
+    pass
+
+
+def set_auto_whitebal(*args, **kwargs):
+    pass
+
+
+def set_auto_exposure(*args, **kwargs):
+    pass
+
+
+def grayscale_to_temperature(value):
+    """ Host only: temperature of a grayscale value of the replayed frames """
+    minimum, maximum = _measurement_range if _measurement_mode else temperature_range
+    return minimum + value * (maximum - minimum) / 255.0
+
+
+def _spotmeter():
+    resolution = 0.01 if registers[0x4EC4][0] else 0.1
+    start_row, start_column, end_row, end_column = registers[0x4ECC]
+    values = []
+    if _frame is not None and _pixformat == GRAYSCALE:
+        # The spotmeter reads the last frame of the sensor, not the (maybe converted) frame buffer
+        for row in range(start_row, min(end_row + 1, height())):
+            values.extend(_frame[start_column + row * width():min(end_column + 1, width()) + row * width()])
+    if not values:
+        values = [0]
+
+    def tlinear(value):
+        return round((grayscale_to_temperature(value) + 273.15) / resolution)
+
+    return (tlinear(sum(values) / len(values)), tlinear(max(values)), tlinear(min(values)), len(values))
+
+
+def ioctl(request, *args):
+    global cci_transactions, _measurement_mode, _measurement_range
+    cci_transactions += 1
+    utime.advance_us(cci_transaction_us)
+    if request == IOCTL_LEPTON_GET_ATTRIBUTE:
+        attribute, words = args
+        if attribute == 0x4ED0:
+            values = _spotmeter()
+        else:
+            values = registers.get(attribute, ())
+        values = (tuple(values) + (0,) * words)[:words]
+        return struct.pack("<{}H".format(words), *values)
+    if request == IOCTL_LEPTON_SET_ATTRIBUTE:
+        attribute, data = args
+        registers[attribute - 1] = struct.unpack("<{}H".format(len(data) // 2), data)
+        return None
+    if request == IOCTL_LEPTON_RUN_COMMAND:
+        return None
+    if request == IOCTL_LEPTON_GET_FPA_TEMPERATURE:
+        return 30.0
+    if request == IOCTL_LEPTON_GET_AUX_TEMPERATURE:
+        return 28.0
+    if request == IOCTL_LEPTON_SET_MEASUREMENT_MODE:
+        _measurement_mode = bool(args[0])
+        return None
+    if request == IOCTL_LEPTON_GET_MEASUREMENT_MODE:
+        return _measurement_mode
+    if request == IOCTL_LEPTON_SET_MEASUREMENT_RANGE:
+        _measurement_range = (float(args[0]), float(args[1]))
+        return None
+    if request == IOCTL_LEPTON_GET_MEASUREMENT_RANGE:
+        return _measurement_range
+    if request == IOCTL_LEPTON_GET_WIDTH:
+        return 160
+    if request == IOCTL_LEPTON_GET_HEIGHT:
+        return 120
+    if request == IOCTL_LEPTON_GET_RADIOMETRY:
+        return True
+    if request == IOCTL_LEPTON_GET_REFRESH:
+        return 9
+    if request == IOCTL_LEPTON_GET_RESOLUTION:
+        return 14
+    raise OSError("Unsupported ioctl {}".format(request))
+
+
+reset()
@@ -0,0 +1,56 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# CPython stand-in for the uos module. Paths are relative to the working directory of the
+# process, which the simulator sets to a temporary folder as the file system of the camera.
+
+import os
+from collections import namedtuple
+
+_uname = namedtuple("uname_result", ("sysname", "nodename", "release", "version", "machine"))
+
+mkdir = os.mkdir
+remove = os.remove
+rmdir = os.rmdir
+rename = os.rename
+getcwd = os.getcwd
+chdir = os.chdir
+listdir = os.listdir
+stat = os.stat
+sep = "/"
+
+
+def uname():
+    return _uname("host", "host", "0.0.0", "CPython stand-in", "host with stand-in modules")
+
+
+def sync():
+    pass
+
+
+def ilistdir(path="."):
+    for entry in os.scandir(path):
+        yield (entry.name, 0x4000 if entry.is_dir() else 0x8000, 0, entry.stat().st_size)
+
+
+def urandom(size):
+    return os.urandom(size)
@@ -0,0 +1,154 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# CPython stand-in for the utime module (also used as "time" by the simulator).
+#
+# The clock is the host clock plus a virtual offset. Sleeps and the modelled bus transfers advance
+# the virtual offset instead of blocking, so the measured time is the host compute time plus the
+# time the hardware would have spent waiting.
+
+import time as _time
+import calendar as _calendar
+
+_start = _time.perf_counter()
+_virtual_us = 0
+# Seconds since epoch of the RTC when the clock started
+_rtc_base = _calendar.timegm((2021, 1, 14, 14, 1, 0, 3, 14, 0))
+# Host only: functions called whenever the clock is read, e.g. to raise the interrupts of the pins
+# whose value depends on the time (see pyb.ExtInt)
+clock_listeners = []
+_notifying = False
+
+
+def advance_us(us):
+    """ Advance the virtual clock without blocking """
+    global _virtual_us
+    _virtual_us += us
+
+
+def reset():
+    global _start, _virtual_us
+    _start = _time.perf_counter()
+    _virtual_us = 0
+
+
+def ticks_us():
+    global _notifying
+    if clock_listeners and not _notifying:
+        _notifying = True
+        try:
+            for listener in clock_listeners:
+                listener()
+        finally:
+            _notifying = False
+    return int((_time.perf_counter() - _start) * 1000000 + _virtual_us)
+
+
+def ticks_ms():
+    return ticks_us() // 1000
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_diff(end, start):
+    return end - start
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def sleep_us(us):
+    advance_us(us)
+
+
+def sleep_ms(ms):
+    advance_us(ms * 1000)
+
+
+def sleep(seconds):
+    advance_us(seconds * 1000000)
+
+
+def time():
+    return _rtc_base + ticks_ms() // 1000
+
+
+def set_time(seconds):
+    global _rtc_base
+    _rtc_base = seconds - ticks_ms() // 1000
+
+
+def localtime(seconds=None):
+    if seconds is None:
+        seconds = time()
+    t = _time.gmtime(seconds)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday)
+
+
+def mktime(time_tuple):
+    year, month, mday, hour, minute, second = time_tuple[:6]
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    # Normalise out of range values as MicroPython does (e.g. second=75)
+    return _calendar.timegm((year, month, 1, 0, 0, 0, 0, 0, 0)) + (
+        ((mday - 1) * 24 + hour) * 60 + minute
+    ) * 60 + second
+
+
+gmtime = localtime
+
+
+class clock():
+    """ OPENMV time.clock """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._ticks = ticks_us()
+        self._frames = 0
+        self._elapsed_us = 0
+
+    def tick(self):
+        self._ticks = ticks_us()
+
+    def fps(self):
+        now = ticks_us()
+        self._frames += 1
+        self._elapsed_us += now - self._ticks
+        self._ticks = now
+        if self._elapsed_us <= 0:
+            return 0.0
+        return self._frames * 1000000.0 / self._elapsed_us
+
+    def avg(self):
+        if not self._frames:
+            return 0.0
+        return self._elapsed_us / 1000.0 / self._frames
+
+
+def __getattr__(name):
+    # Used as the "time" module by the simulator: the rest of the attributes come from CPython
+    return getattr(_time, name)
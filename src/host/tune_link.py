@@ -0,0 +1,142 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+# Host check of the camera slave link tuner (components/camera_slave.py LinkTuner)
+#
+# Usage (from the src folder):
+#   python -m host.tune_link [--max-baudrate 30000000] [--setup-us 500] [--error-rate 1.0]
+#
+# The tuner calibrates against the simulated visual camera with a LinkErrorModel, it must pick the
+# fastest candidate inside the limits of the model. Then the limits drop (--degraded-baudrate) and
+# the frames of a main loop go through LinkTuner.update, which must back off to a candidate inside
+# the new limits. The errors hit the controls sent to the slave too, the slave must reject every
+# corrupted one and end with the control of the master. Without arguments a set of error models is checked.
+
+import argparse
+
+from host import simulator
+
+simulator.install()
+
+SCENARIOS = (
+    # max_baudrate, setup_us, error_rate, degraded_baudrate
+    (30000000, 500, 1.0, 20000000),
+    (54000000, 100, 1.0, 36000000),
+    (40000000, 300, 1.0, 27000000),
+    (36000000, 1000, 0.5, 30000000),
+)
+
+
+def expected_candidate(tuner, max_baudrate, setup_us):
+    for index, (baudrate, start_delay) in enumerate(tuner.candidates):
+        if baudrate <= max_baudrate and start_delay >= setup_us:
+            return index
+    return len(tuner.candidates) - 1
+
+
+def run_scenario(max_baudrate, setup_us, error_rate, degraded_baudrate, loop_frames):
+    model = simulator.LinkErrorModel(max_baudrate, setup_us, error_rate)
+    link = simulator.Simulator(link_error_model=model).camera_slave
+
+    from pyb import Pin
+    from utils.dynamic_spi import DynamicSPI
+    from components.camera_slave import CameraSlave, LinkTuner
+
+    DynamicSPI.devices = []
+    camera_slave = CameraSlave(
+        spi=DynamicSPI(
+            baudrate=30000000, pin_cs=Pin.board.P4, polarity=0, phase=0, start_delay=500, priority=2, name="visual",
+        ),
+        pin_data_ready=Pin.board.P5,
+        width=320,
+        height=240,
+        alloc_rx_buff=True,
+        compression=True,
+    )
+    tuner = LinkTuner(camera_slave)
+    # A frame fails with error_rate probability, a few test frames have to pass in a row
+    tuner.test_frames = max(tuner.test_frames, 16)
+
+    found = tuner.calibrate()
+    calibrated = tuner.candidates[tuner.index]
+    calibrated_ok = found and tuner.index == expected_candidate(tuner, max_baudrate, setup_us)
+
+    # The link gets worse while the main loop runs (MIX frames)
+    model.max_baudrate = degraded_baudrate
+    camera_slave.control.frame_format = camera_slave.control.FORMAT_QQVGA
+    frames = 0
+    while frames < loop_frames:
+        camera_slave.sync()
+        tuner.update()
+        frames += 1
+    degraded = tuner.candidates[tuner.index]
+    degraded_ok = degraded[0] <= degraded_baudrate and degraded[1] >= setup_us
+    controls_ok = link.corrupted_controls_applied == 0 and link.control == bytes(camera_slave.control.buff)
+
+    return {
+        "calibrated": calibrated,
+        "calibrated_ok": calibrated_ok,
+        "degraded": degraded,
+        "degraded_ok": degraded_ok,
+        "controls_ok": controls_ok,
+        "rejected_controls": link.rejected_controls,
+        "backoffs": tuner.backoffs,
+        "invalid_frames": camera_slave.invalid_frames,
+        "received_frames": camera_slave.received_frames,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check of the camera slave link tuner")
+    parser.add_argument("--max-baudrate", type=int, help="Fastest baudrate without errors")
+    parser.add_argument("--setup-us", type=int, default=500, help="Shortest start delay without errors")
+    parser.add_argument("--error-rate", type=float, default=1.0, help="Frames corrupted over those limits")
+    parser.add_argument("--degraded-baudrate", type=int, help="Fastest baudrate without errors once the loop runs")
+    parser.add_argument("--loop-frames", type=int, default=400, help="Frames of the main loop after the calibration")
+    arguments = parser.parse_args(argv)
+
+    if arguments.max_baudrate:
+        scenarios = [(
+            arguments.max_baudrate, arguments.setup_us, arguments.error_rate,
+            arguments.degraded_baudrate or arguments.max_baudrate,
+        )]
+    else:
+        scenarios = SCENARIOS
+
+    print("{:>10} {:>6} {:>5} {:>10}  {:<16} {:<16} {:>8} {:>8} {:>9}".format(
+        "baudrate", "setup", "rate", "degraded", "calibrated", "after loop", "backoffs", "invalid", "rejected"))
+    failed = False
+    for max_baudrate, setup_us, error_rate, degraded_baudrate in scenarios:
+        result = run_scenario(max_baudrate, setup_us, error_rate, degraded_baudrate, arguments.loop_frames)
+        failed |= not (result["calibrated_ok"] and result["degraded_ok"] and result["controls_ok"])
+        print("{:>10} {:>6} {:>5.2f} {:>10}  {:<16} {:<16} {:>8} {:>8} {:>9}".format(
+            max_baudrate, setup_us, error_rate, degraded_baudrate,
+            "{}/{}{}".format(*result["calibrated"], "" if result["calibrated_ok"] else " FAIL"),
+            "{}/{}{}".format(*result["degraded"], "" if result["degraded_ok"] else " FAIL"),
+            result["backoffs"], "{}/{}".format(result["invalid_frames"], result["received_frames"]),
+            "{}{}".format(result["rejected_controls"], "" if result["controls_ok"] else " FAIL"),
+        ))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
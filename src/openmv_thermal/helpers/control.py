@@ -21,6 +21,7 @@
 #SOFTWARE.
 
 from utils.rtc_time import time_datetime2string
+from utils.image import MIX_ALPHA_MAX
 import uos
 import time
 import sensor
@@ -37,6 +38,11 @@ class CameraPreview():
     VISIBLE = "VISIBLE"
     MIX = "MIX"
 
+class MixThreshold():
+    ALL = "ALL"
+    ABOVE = "ABOVE"
+    BELOW = "BELOW"
+
 class Control():
 
     preview = CameraPreview.THERMAL
@@ -61,6 +67,11 @@ class Control():
 
     always_pixel_pointer = False
 
+    mix_alpha = MIX_ALPHA_MAX // 2
+    mix_threshold = MixThreshold.ALL
+    mix_threshold_temperature = 30.0
+    mix_on_visual = False # The visual camera blends the MIX preview (CameraSlaveControl.FORMAT_FUSED)
+
     def __init__(self, logger):
         self.logger = logger
         self.media_path = "DCIM"
@@ -111,6 +122,31 @@ class Control():
             self.preview = CameraPreview.THERMAL
         self.logger.info("Change preview from ", previous, "to", self.preview)
 
+    def next_mix_threshold(self):
+        if self.mix_threshold is MixThreshold.ALL:
+            self.mix_threshold = MixThreshold.ABOVE
+        elif self.mix_threshold is MixThreshold.ABOVE:
+            self.mix_threshold = MixThreshold.BELOW
+        else:
+            self.mix_threshold = MixThreshold.ALL
+
+    def increase_mix_alpha(self):
+        self.mix_alpha = min(MIX_ALPHA_MAX, self.mix_alpha + 2)
+
+    def decrease_mix_alpha(self):
+        self.mix_alpha = max(0, self.mix_alpha - 2)
+
+    def mix_grey_levels(self, temperature_min, temperature_max):
+        """ First and last grey level of the thermal image blended in the MIX preview """
+        if self.mix_threshold is MixThreshold.ALL or temperature_max <= temperature_min:
+            return 0, 255
+        level = round(255 * (self.mix_threshold_temperature - temperature_min) / (temperature_max - temperature_min))
+        # -1 and 256 are out of the grey range, nothing is blended
+        level = max(-1, min(256, level))
+        if self.mix_threshold is MixThreshold.ABOVE:
+            return level, 255
+        return 0, level
+
     def get_last_saved_img(self):
         self.logger.info("Listing...")
         img_number = 0
@@ -22,6 +22,8 @@
 
 import uos
 from utils.menu import Menu
+from utils.dynamic_spi import DynamicSPI
+from utils.image import MIX_ALPHA_MAX
 
 from utils.rtc_time import time_datetime2string, time_modify_rtc, time_rtc2dictionary
 from .control import CameraState
@@ -112,7 +114,7 @@ def create_menu_playback(time_settings, settings, menu, touch, control, camera_s
         "bottom" : Menu.Entity(text=None, action=control.increase_playback_index),
     }
 
-def create_menu_preview(logger, time_settings, settings, menu, touch, control, thermal, camera_slave, screen, auxiliary_controller, **_):
+def create_menu_preview(logger, time_settings, settings, menu, touch, control, thermal, camera_slave, link_tuner, screen, auxiliary_controller, glyph_cache, **_):
 
     def get_time_calibration_factor():
         return time_settings.dict.get("calibration_factor", 1.0)
@@ -382,10 +384,106 @@ def create_menu_preview(logger, time_settings, settings, menu, touch, control, t
         ],
     }
 
+    def mix_alpha_text():
+        return "Mix thermal: {}%".format(100 * control.mix_alpha // MIX_ALPHA_MAX)
+
+    def mix_threshold_temperature_text():
+        return "Mix threshold Temp: {:.1f}".format(control.mix_threshold_temperature)
+
+    def mix_threshold_temperature_down():
+        control.mix_threshold_temperature -= 1.0
+
+    def mix_threshold_temperature_up():
+        control.mix_threshold_temperature += 1.0
+
+    def toggle_mix_on_visual():
+        control.mix_on_visual = not control.mix_on_visual
+
+    menu_mix_options = {
+        "title": "MIX OPTIONS",
+        "shutter": menu.entity_back_no_text,
+        "top": menu.entity_scroll_up,
+        "bottom": menu.entity_scroll_down,
+        "middle": menu.entity_scroll_selection,
+        "items": [
+            Menu.Entity(text=mix_alpha_text, action=
+            {
+                "title": mix_alpha_text,
+                "shutter":  menu.entity_back_no_text,
+                "top": Menu.Entity(text="Up", action=control.increase_mix_alpha),
+                "middle": menu.entity_back_action,
+                "bottom": Menu.Entity(text="Down", action=control.decrease_mix_alpha),
+            }),
+            Menu.Entity(text=(lambda: "Mix threshold: {}".format(control.mix_threshold)), action=control.next_mix_threshold),
+            Menu.Entity(text=mix_threshold_temperature_text, action=
+            {
+                "title": mix_threshold_temperature_text,
+                "shutter":  menu.entity_back_no_text,
+                "top": Menu.Entity(text="Up", action=mix_threshold_temperature_up),
+                "middle": menu.entity_back_action,
+                "bottom": Menu.Entity(text="Down", action=mix_threshold_temperature_down),
+            }),
+            Menu.Entity(text=(lambda: "Mix on: {}".format("visual camera" if control.mix_on_visual else "thermal camera")), action=toggle_mix_on_visual),
+            Menu.Entity(text="Save", action=[
+                (save_control_settings, {"settings": settings, "control": control}),
+                menu.back,
+            ]),
+        ],
+    }
+
     def toggle_pixle_pointer():
         control.always_pixel_pointer = not control.always_pixel_pointer
         save_control_settings(settings=settings, control=control)
 
+    def spi_statistics_save():
+        DynamicSPI.save_statistics()
+        uos.sync()
+        logger.info("SPI statistics saved")
+
+    menu_spi_statistics = {
+        "title": "SPI BUS (mean/max)",
+        "shutter": menu.entity_back_no_text,
+        "top": menu.entity_scroll_up,
+        "bottom": menu.entity_scroll_down,
+        "middle": menu.entity_scroll_selection,
+        "items": [
+            Menu.Entity(text=(lambda statistics=device.statistics, line=line: statistics.text(line)), action=None)
+            for device in DynamicSPI.devices for line in range(device.statistics.TEXT_LINES)
+        ] + [
+            Menu.Entity(text="Save to SD", action=spi_statistics_save),
+            Menu.Entity(text="Reset", action=DynamicSPI.reset_statistics),
+        ],
+    }
+
+    menu_visual_statistics = {
+        "title": "VISUAL LINK",
+        "shutter": menu.entity_back_no_text,
+        "top": menu.entity_scroll_up,
+        "bottom": menu.entity_scroll_down,
+        "middle": menu.entity_scroll_selection,
+        "items": [
+            Menu.Entity(text=(lambda: "Invalid {}".format(camera_slave.invalid_frames)), action=None),
+            Menu.Entity(text=(lambda: "Zip {} repeat {}".format(camera_slave.compressed_frames, camera_slave.repeated_frames)), action=None),
+            Menu.Entity(text=(lambda: "Wait {:.1f}/{:.1f}ms".format(camera_slave.wait_us.mean_us() / 1000, camera_slave.wait_us.maximum_us / 1000)), action=None),
+            Menu.Entity(text=(lambda: "Link {}MHz {}us".format(link_tuner.baudrate // 1000000, link_tuner.start_delay)), action=link_tuner.request_calibration),
+            Menu.Entity(text="Reset", action=camera_slave.reset_counters),
+        ],
+    }
+
+    menu_statistics = {
+        "title": "STATISTICS",
+        "shutter": menu.entity_back_no_text,
+        "top": menu.entity_scroll_up,
+        "bottom": menu.entity_scroll_down,
+        "middle": menu.entity_scroll_selection,
+        "items": [
+            Menu.Entity(text=(lambda: "SPI cfg {} avoided {}".format(DynamicSPI.frame_reconfigurations, DynamicSPI.frame_reconfigurations_avoided)), action=menu_spi_statistics),
+            Menu.Entity(text=(lambda: "Visual {}MHz {}us".format(link_tuner.baudrate // 1000000, link_tuner.start_delay)), action=menu_visual_statistics),
+            Menu.Entity(text=(lambda: "Glyphs {} miss {}".format(glyph_cache.hits, glyph_cache.misses)), action=glyph_cache.reset_counters),
+            Menu.Entity(text=(lambda: "CCI r{} w{} h{}".format(thermal.registers.reads, thermal.registers.writes, thermal.registers.hits)), action=thermal.registers.reset_counters),
+        ],
+    }
+
     menu_preview = {
         "title": "MAIN MENU",
         "shutter": menu.entity_reset_no_text,
@@ -394,12 +492,14 @@ def create_menu_preview(logger, time_settings, settings, menu, touch, control, t
         "middle": menu.entity_scroll_selection,
         "items": [
             Menu.Entity(text="Thermal options", action=menu_thermal_options),
+            Menu.Entity(text="Mix options", action=menu_mix_options),
             Menu.Entity(text=(lambda: "Always pointer: {}".format(control.always_pixel_pointer)), action=toggle_pixle_pointer),
             Menu.Entity(text="Calibrate Field Of View", action=menu_camera_slave_calibration),
             Menu.Entity(text="Calibrate Touch", action=menu_touch_calibration),
             Menu.Entity(text="Manage settings", action=menu_manage_settings),
             Menu.Entity(text="Set Time", action=menu_time_change),
             Menu.Entity(text=(lambda: "1 FPS {}".format(control.fps)), action=control.fps_reset),
+            Menu.Entity(text="Statistics", action=menu_statistics),
         ],
     }
     return menu_preview
@@ -20,7 +20,8 @@
 #OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #SOFTWARE.
 
-from .control import CameraPreview
+from .control import CameraPreview, MixThreshold
+from utils.image import MIX_ALPHA_MAX
 
 def save_control_settings(settings, control):
     if "control" not in settings.dict:
@@ -29,6 +30,10 @@ def save_control_settings(settings, control):
 
     control_settings["always_pixel_pointer"] = control.always_pixel_pointer
     control_settings["preview"] = control.preview
+    control_settings["mix_alpha"] = control.mix_alpha
+    control_settings["mix_threshold"] = control.mix_threshold
+    control_settings["mix_threshold_temperature"] = control.mix_threshold_temperature
+    control_settings["mix_on_visual"] = control.mix_on_visual
 
     settings.write()
     print("control settings saved")
@@ -40,6 +45,10 @@ def load_control_settings(settings, control):
 
     control.always_pixel_pointer = control_settings["always_pixel_pointer"]
     control.preview = control_settings.get("preview", CameraPreview.THERMAL)
+    control.mix_alpha = control_settings.get("mix_alpha", MIX_ALPHA_MAX // 2)
+    control.mix_threshold = control_settings.get("mix_threshold", MixThreshold.ALL)
+    control.mix_threshold_temperature = control_settings.get("mix_threshold_temperature", 30.0)
+    control.mix_on_visual = control_settings.get("mix_on_visual", False)
 
     print("control settings loaded")
 
@@ -98,6 +107,29 @@ def load_camera_slave_calibration_settings(settings, camera_slave):
     print("Camera slave screen settings loaded")
 
 
+def save_camera_slave_link_settings(settings, link_tuner):
+    if "camera_slave_link" not in settings.dict:
+        settings.dict["camera_slave_link"] = {}
+    link_settings = settings.dict["camera_slave_link"]
+
+    link_settings["baudrate"] = link_tuner.baudrate
+    link_settings["start_delay"] = link_tuner.start_delay
+    settings.write()
+    print("Camera slave link settings saved")
+
+
+def load_camera_slave_link_settings(settings, link_tuner):
+    """ False when there are no settings (or they are not a candidate of the tuner) """
+    if "camera_slave_link" not in settings.dict:
+        return False
+    link_settings = settings.dict["camera_slave_link"]
+
+    if not link_tuner.select(link_settings.get("baudrate"), link_settings.get("start_delay")):
+        return False
+    print("Camera slave link settings loaded")
+    return True
+
+
 def save_touch_calibration_settings(settings, touch):
     if "touch" not in settings.dict:
         settings.dict["touch"] = {}
@@ -27,19 +27,22 @@ from utils.interrupt_handler import InterruptHandler
 from utils.menu import Menu
 from utils.settings import Settings
 from utils.dynamic_spi import DynamicSPI
-from utils.image import qvga2qvga, qqvga2qvga, qqgrey2qvga
+from utils.image import qvga2qvga, qqvga2qvga, qqgrey2qvga, qqgrey2qvga_palette, qqgrey2qvga_blend, qqgrey2qvga_blend_qqvga, create_palette, pixel2pixel
 from utils.rtc_time import time_datetime2string
+from utils.text import GlyphCache
 
 from components.thermal import Thermal
 from components.touch import Touch
 from components.screen import Screen
 from components.auxiliary_controller import AuxiliaryController
-from components.camera_slave import CameraSlave
+from components.camera_slave import CameraSlave, CameraSlaveControl, LinkTuner
 
 from helpers.user_settings import (
     load_control_settings,
     load_thermal_settings,
     load_camera_slave_calibration_settings,
+    load_camera_slave_link_settings,
+    save_camera_slave_link_settings,
     load_touch_calibration_settings,
 )
 
@@ -94,9 +97,10 @@ def main():
     led_red.off()
 
 
+    # Devices waiting for the shared SPI bus are served by priority (higher first)
     screen = Screen(
         spi=DynamicSPI(
-            baudrate=54000000, pin_cs=Pin.board.P3, polarity=0, phase=0,
+            baudrate=54000000, pin_cs=Pin.board.P3, polarity=0, phase=0, priority=3, name="screen",
         ),
         alloc_screen_buff=True,
         width=320,
@@ -106,29 +110,37 @@ def main():
         fast_byteswap=False,
     )
 
+    # Menu and pointer texts are drawn every frame
+    glyph_cache = GlyphCache()
+
     control = Control(logger=logger)
     thermal = Thermal(logger=logger)
 
-    # SPI at 40000000 or start_delay=100 would lead to data corruption
+    # Initial link settings, the link tuner replaces them with the fastest ones without errors.
+    # SPI at 40000000 or start_delay=100 led to data corruption on the first units.
     camera_slave = CameraSlave(
         spi=DynamicSPI(
-            baudrate=30000000, pin_cs=Pin.board.P4, polarity=0, phase=0, start_delay=500,
+            baudrate=30000000, pin_cs=Pin.board.P4, polarity=0, phase=0, start_delay=500, priority=2, name="visual",
         ),
         pin_data_ready=Pin.board.P5,
         width=screen.width,
         height=screen.height,
-        alloc_rx_buff=True
+        # No frame buffer of its own, the QVGA frames are received in the screen frame buffer
+        receiver=True,
+        compression=True, # Falls back to raw frames when they do not compress
     )
+    link_tuner = LinkTuner(camera_slave)
 
     touch = Touch(
         spi=DynamicSPI(
-            baudrate=2000000, pin_cs=Pin.board.P7, polarity=0, phase=0, start_delay=10, byte_delay=10,
+            baudrate=2000000, pin_cs=Pin.board.P7, polarity=0, phase=0, start_delay=10, byte_delay=10, priority=1, name="touch",
         )
     )
 
+    # Buttons, read in the queued transaction of the touch (input_interrupt)
     auxiliary_controller = AuxiliaryController(
         spi=DynamicSPI(
-            baudrate=2500000, pin_cs=Pin.board.P6, polarity=1, phase=0, start_delay=10, byte_delay=100,
+            baudrate=2500000, pin_cs=Pin.board.P6, polarity=1, phase=0, start_delay=10, byte_delay=100, priority=1, name="aux",
         )
     )
 
@@ -153,6 +165,8 @@ def main():
         "time_settings": time_settings,
         "input_handler": input_handler,
         "camera_slave": camera_slave,
+        "link_tuner": link_tuner,
+        "glyph_cache": glyph_cache,
     }
 
     #testing_bug3(**components)
@@ -216,6 +230,14 @@ def main():
     load_control_settings(settings=settings, control=control)
     load_thermal_settings(settings=settings, thermal=thermal)
 
+    logger.info("Checking the visual camera link...")
+    # The test frames are received in the screen frame buffer too, the next frame redraws it
+    if not load_camera_slave_link_settings(settings=settings, link_tuner=link_tuner) or not link_tuner.check(target_buff=screen.screen_buff):
+        logger.info("Calibrating the visual camera link...")
+        if link_tuner.calibrate(target_buff=screen.screen_buff):
+            save_camera_slave_link_settings(settings=settings, link_tuner=link_tuner)
+    logger.info("Visual camera link:", link_tuner.baudrate, "baud", link_tuner.start_delay, "us")
+
     logger.info("Initializing thermal camera...")
     thermal.initialize()
 
@@ -272,7 +294,7 @@ def input_interrupt(auxiliary_controller, touch, control, menu, screen, input_ha
         auxiliary_controller.print_data()
         logger.info(" END -------------")
 
-def loop(control, thermal, screen, menu, input_handler, camera_slave, **kwargs):
+def loop(control, thermal, screen, menu, input_handler, camera_slave, link_tuner, settings, glyph_cache, **kwargs):
 
     led_green = LED(2) # red led
     led_green.off()
@@ -281,20 +303,35 @@ def loop(control, thermal, screen, menu, input_handler, camera_slave, **kwargs):
     running_from_ide = usb.isconnected()
 
 
+    # Called on every poll of a pending sync while the slave is not ready, "Failed sync" is logged
+    # once when it cancels. Only when the loop does not need a visual frame anymore.
     def camera_slave_sync_cancel_condition():
-        if control.preview is not CameraPreview.VISIBLE or menu.state is not CameraState.PREVIEW:
-            logger.info("Cancel camera slave sync")
-            return True
-        return False
+        return (control.preview is not CameraPreview.VISIBLE and control.preview is not CameraPreview.MIX) or menu.state is not CameraState.PREVIEW
 
     camera_slave.sync_cancel_condition = camera_slave_sync_cancel_condition
 
+    # Screen ready colors of every grey level for THERMAL and THERMAL_GREY (single pass kernel)
+    palette_ironbow = bytearray(512)
+    palette_grey = bytearray(512)
+    create_palette(sensor.snapshot(), palette_ironbow, color_palette=sensor.PALETTE_IRONBOW, byteswap=screen.framebuffer_swap_endianness)
+    create_palette(sensor.snapshot(), palette_grey, byteswap=screen.framebuffer_swap_endianness)
+    # MIX blends in the frame buffer order, the kernel swaps the result
+    palette_mix = bytearray(512)
+    create_palette(sensor.snapshot(), palette_mix, color_palette=sensor.PALETTE_IRONBOW, byteswap=False)
+    screen_buff_byteswapped = False
+
+    def overlay_color(color):
+        if screen_buff_byteswapped:
+            return screen.byteswap_color(color)
+        return color
+
     state = None
     camera_preview = None
     camera_playback_img_name = ""
     previous_text = ""
     screen_refresh_needed = True
     state_ticks_ms = utime.ticks_ms()
+    visual_preview_used = False
 
     menu.process_action("middle")
     while True:
@@ -303,6 +340,7 @@ def loop(control, thermal, screen, menu, input_handler, camera_slave, **kwargs):
 
         changed_preview = camera_preview is not control.preview
         camera_preview = control.preview
+        screen_buff_byteswapped = False
 
         # -----------------------------------------------------------------------------------------
         # INITIALIZATIONS
@@ -324,68 +362,138 @@ def loop(control, thermal, screen, menu, input_handler, camera_slave, **kwargs):
         # RUN TIME
 
         if state is CameraState.PREVIEW:
-            control.fps_tick()
+            DynamicSPI.next_frame()
             screen_refresh_needed = True
             text = "\n" + menu.generate_text()
 
-            if camera_preview is CameraPreview.THERMAL or camera_preview is CameraPreview.THERMAL_ANALYSIS or camera_preview is CameraPreview.THERMAL_GREY or camera_preview is CameraPreview.MIX:
+            visual_preview = camera_preview is CameraPreview.VISIBLE or camera_preview is CameraPreview.MIX
+            if visual_preview:
+                if not visual_preview_used:
+                    # The buffers of the compressed and QQVGA visual frames. Only the visual previews have a
+                    # wait to send the previous frame in (the visual camera), the next one is drawn in a
+                    # second frame buffer meanwhile (if it fits).
+                    visual_preview_used = True
+                    camera_slave.alloc_receive_buffs()
+                    screen.alloc_back_buff()
+                # The ready edge of the visual camera is latched while the thermal frame is processed.
+                # A frame which the slave sends again is skipped while the screen still shows it.
+                visual_accept_repeat = not changed_state and not changed_preview and not control.to_save_img
+                camera_slave.sync_start(target_buff=screen.screen_buff, accept_repeat=visual_accept_repeat)
 
-                thermal.get_spotmeter_values()
-                def map_g_to_temp(g):
-                    return ((g * (thermal.temperature_max - thermal.temperature_min)) / 255.0) + thermal.temperature_min
+            if camera_preview is CameraPreview.THERMAL or camera_preview is CameraPreview.THERMAL_ANALYSIS or camera_preview is CameraPreview.THERMAL_GREY or camera_preview is CameraPreview.MIX:
 
                 img = sensor.snapshot()
+                if camera_preview is CameraPreview.THERMAL_ANALYSIS:
+                    # The analysis reads the statistics, they give the temperatures too
+                    statistics = thermal.update_statistics(img)
+                else:
+                    thermal.get_spotmeter_values()
+                map_g_to_temp = thermal.grey2celcius
                 img_touch_x = max(0,min(sensor.width() - 1, round(control.x * sensor.width()/screen.width) ))
                 img_touch_y = max(0,min(sensor.height() - 1, round(control.y * sensor.height()/screen.height) ))
                 pixel = "{:.2f}".format(map_g_to_temp(img.get_pixel(img_touch_x, img_touch_y)))
 
-                if camera_preview is CameraPreview.THERMAL_GREY:
-                    img.to_rgb565()
-                elif camera_preview is CameraPreview.THERMAL or camera_preview is CameraPreview.MIX:
-                    img.to_rainbow(color_palette=sensor.PALETTE_IRONBOW) # color it
+                if screen.back_buff is None and not visual_preview:
+                    # Single frame buffer, the last frame of a visual preview must be sent before drawing the next one
+                    screen.wait_transfer()
+
+                if camera_preview is CameraPreview.THERMAL_GREY or camera_preview is CameraPreview.THERMAL:
+                    # Colored, scaled and byte swapped for the screen in a single pass
+                    palette = palette_grey if camera_preview is CameraPreview.THERMAL_GREY else palette_ironbow
+                    qqgrey2qvga_palette(img, screen.screen_buff, palette)
+                    screen_buff_byteswapped = screen.framebuffer_swap_endianness
                 elif camera_preview is CameraPreview.THERMAL_ANALYSIS:
                     # Color tracking concept from lepton_object_temp_color_1.py in the OpenMV examples
                     # Color Tracking Thresholds (Grayscale Min, Grayscale Max)
                     threshold_list = [(200, 255)]
 
-                    blob_stats = []
-                    blobs = img.find_blobs(threshold_list, pixels_threshold=200, area_threshold=200, merge=True)
-                    # Collect stats into a list of tuples
-                    for blob in blobs:
-                        blob_stats.append((blob.x(), blob.y(), map_g_to_temp(img.get_statistics(thresholds=threshold_list,
-                                                                                                roi=blob.rect()).mean())))
+                    blobs = []
+                    # The histogram tells if there are enough pixels in the threshold to form a blob
+                    if statistics.count_between(threshold_list[0][0], threshold_list[0][1]) >= 200:
+                        # Blobs and their mean grey level in a single pass
+                        blobs = thermal.find_blobs(img, threshold_list[0], pixels_threshold=200, area_threshold=200)
                     img.to_rainbow(color_palette=sensor.PALETTE_IRONBOW) # color it
                     # Draw stuff on the colored image
                     for blob in blobs:
-                        img.draw_rectangle(blob.rect())
-                        img.draw_cross(blob.cx(), blob.cy())
-                    for blob_stat in blob_stats:
-                        img.draw_string(blob_stat[0], blob_stat[1] - 10, "%.2f C" % blob_stat[2], mono_space=False)
-
-                qqvga2qvga(sensor.get_fb(), screen.screen_buff)
-
-            if camera_preview is CameraPreview.VISIBLE or camera_preview is CameraPreview.MIX:
+                        img.draw_rectangle(blob.x, blob.y, blob.w, blob.h)
+                        img.draw_cross(blob.cx, blob.cy)
+                        img.draw_string(blob.x, blob.y - 10, "%.2f C" % map_g_to_temp(blob.mean), mono_space=False)
+                    qqvga2qvga(sensor.get_fb(), screen.screen_buff)
+
+            if visual_preview:
+                # Feed the screen with the previous frame while the visual camera prepares the next one
+                while not camera_slave.sync_ready() and screen.continue_transfer():
+                    pass
+                screen.wait_transfer()
+                # MIX blends the visual image at the resolution of the thermal one, a quarter of the bytes,
+                # or leaves the blend to the visual camera, which receives the thermal frame during the
+                # visual one and blends it in the next frame. The slave sends the requested format from
+                # the next frame on.
+                if camera_preview is CameraPreview.MIX and control.mix_on_visual:
+                    camera_slave.control.frame_format = CameraSlaveControl.FORMAT_FUSED
+                    threshold_low, threshold_high = control.mix_grey_levels(*thermal.grey_range_temperatures())
+                    camera_slave.control.set_fusion(control.mix_alpha, threshold_low, threshold_high, screen.framebuffer_swap_endianness)
+                    camera_slave.thermal_buff = img
+                elif camera_preview is CameraPreview.MIX:
+                    camera_slave.control.frame_format = CameraSlaveControl.FORMAT_QQVGA
+                else:
+                    camera_slave.control.frame_format = CameraSlaveControl.FORMAT_QVGA
                 input_handler.disable()
-                sync_success = camera_slave.sync()
+                if link_tuner.calibration_requested:
+                    logger.info("Calibrating the visual camera link...")
+                    # Into the frame buffer which is not being sent
+                    if link_tuner.calibrate(target_buff=screen.screen_buff):
+                        save_camera_slave_link_settings(settings=settings, link_tuner=link_tuner)
+                    camera_slave.sync_start(target_buff=screen.screen_buff, accept_repeat=visual_accept_repeat)
+                sync_success = camera_slave.sync_poll()
+                while sync_success is None:
+                    sync_success = camera_slave.sync_poll()
                 input_handler.enable()
                 if not sync_success:
                     logger.info("Failed sync")
-                    screen.screen_buff.fill(c=(10,10,10))
-                    screen.screen_buff.draw_string(screen.width//2, screen.height//2, "ERROR", c=(255,0,0))
-
-                if camera_preview is CameraPreview.VISIBLE:
-                    qvga2qvga(camera_slave.rx_buff, screen.screen_buff, 0, 1)
+                if link_tuner.update():
+                    logger.info("Visual camera link errors, slowing down to", link_tuner.baudrate, "baud", link_tuner.start_delay, "us")
+                    save_camera_slave_link_settings(settings=settings, link_tuner=link_tuner)
+                # QVGA frames are already in the screen frame buffer, QQVGA ones are scaled or blended into it.
+                # A frame which failed the checks is dropped, the previous QQVGA one is used while it is
+                # intact. A previous QVGA one was drawn over, the screen keeps showing it instead, as with a
+                # repeated frame (only MIX blends a repeated QQVGA frame with the new thermal one).
+                visual_buff = camera_slave.frame_buff
+                visual_qqvga = visual_buff is camera_slave.qqvga_buff
+                visual_fused = camera_slave.frame_format == CameraSlaveControl.FORMAT_FUSED
+                if not camera_slave.frame_valid:
+                    screen.screen_buff.fill(c=overlay_color((10,10,10)))
+                    screen.screen_buff.draw_string(screen.width//2, screen.height//2, "ERROR", c=overlay_color((255,0,0)))
+                elif not sync_success and not visual_qqvga:
+                    screen_refresh_needed = False
+                elif sync_success and not camera_slave.frame_fresh and (not visual_qqvga or camera_preview is CameraPreview.VISIBLE):
+                    screen_refresh_needed = False
+                elif visual_fused:
+                    # Blended by the visual camera in the byte order of the screen
+                    screen_buff_byteswapped = screen.framebuffer_swap_endianness
+                elif camera_preview is CameraPreview.VISIBLE:
+                    if visual_qqvga:
+                        qqvga2qvga(visual_buff, screen.screen_buff)
                     pixel = screen.screen_buff.get_pixel(control.x, control.y)
                 elif camera_preview is CameraPreview.MIX:
-                    qvga2qvga(camera_slave.rx_buff, screen.screen_buff, 0, 2)
+                    # The grey thermal image is still in the sensor frame buffer. The QVGA visual frame
+                    # is blended in place, each pixel is read before it is written.
+                    threshold_low, threshold_high = control.mix_grey_levels(*thermal.grey_range_temperatures())
+                    blend = qqgrey2qvga_blend_qqvga if visual_qqvga else qqgrey2qvga_blend
+                    blend(
+                        img, visual_buff, screen.screen_buff, palette_mix,
+                        control.mix_alpha, threshold_low, threshold_high, screen.framebuffer_swap_endianness
+                    )
+                    screen_buff_byteswapped = screen.framebuffer_swap_endianness
 
             if menu.page != "ROOT" or control.always_pixel_pointer:
-                screen.screen_buff.draw_rectangle(control.x-5, control.y-5, 10, 10, color=(255,0,255), thickness=1, fill=True)
+                screen.screen_buff.draw_rectangle(control.x-5, control.y-5, 10, 10, color=overlay_color((255,0,255)), thickness=1, fill=True)
                 if menu.state is CameraState.PREVIEW:
                     text_y_offset = 50 if control.y < screen.height//2 else -50
-                    screen.screen_buff.draw_string(control.x - 20, control.y + text_y_offset, "{}".format(pixel))
+                    glyph_cache.draw_string(screen.screen_buff, control.x - 20, control.y + text_y_offset, "{}".format(pixel))
 
         if state is CameraState.PLAYBACK or state is CameraState.POSTVIEW:
+            screen.wait_transfer()
             screen_refresh_needed = False
 
             if menu.page == "ANALYSIS":
@@ -425,8 +533,8 @@ def loop(control, thermal, screen, menu, input_handler, camera_slave, **kwargs):
 
                 if menu.page == "ANALYSIS":
 
-                    def map_g_to_temp(g):
-                        return ((g * (thermal.temperature_max - thermal.temperature_min)) / 255.0) + thermal.temperature_min
+                    # The frame keeps the grey levels of the range in its name
+                    map_g_to_temp = lambda grey: thermal.grey2celcius(grey, static_range=False)
 
                     img_touch_x = max(0,min(sensor.width() - 1, round(control.x * sensor.width()/screen.width) ))
                     img_touch_y = max(0,min(sensor.height() - 1, round(control.y * sensor.height()/screen.height) ))
@@ -434,7 +542,7 @@ def loop(control, thermal, screen, menu, input_handler, camera_slave, **kwargs):
 
                     screen.screen_buff.draw_rectangle(control.x-5, control.y-5, 10, 10, color=(255,0,255), thickness=1, fill=True)
                     text_y_offset = 50 if control.y < screen.height//2 else -50
-                    screen.screen_buff.draw_string(control.x - 20, control.y + text_y_offset, "{}".format(pixel))
+                    glyph_cache.draw_string(screen.screen_buff, control.x - 20, control.y + text_y_offset, "{}".format(pixel))
 
                 screen_refresh_needed = True
 
@@ -445,12 +553,25 @@ def loop(control, thermal, screen, menu, input_handler, camera_slave, **kwargs):
         ########################################################################
         # INPUT TASKS which are BIG
         if control.to_save_img:
-            control.save_img(screen.screen_buff, thermal.temperature_min, thermal.temperature_max)
+            if screen_buff_byteswapped:
+                pixel2pixel(screen.screen_buff)
+                screen_buff_byteswapped = False
+            # The range of the grey levels, the playback maps them back with it
+            control.save_img(screen.screen_buff, *thermal.grey_range_temperatures())
             menu.process_action("postview")
             led_green.on()
             utime.sleep_ms(100)
             led_green.off()
 
+        ########################################################################
+        # USB DEBUGGING, drawn over the frame before it is sent (in its byte order)
+        if not running_from_ide and usb.isconnected():
+            screen.screen_buff.draw_rectangle(0, screen.height//3, screen.width, screen.height//3, color=overlay_color((10,10,10)), fill=True)
+            screen.screen_buff.draw_string(round(screen.width/5), round(screen.height/2.3), "USB DEBUGGING", color=overlay_color((255,0,0)), scale=2.0)
+            screen.write_to_screen(screen.screen_buff, byteswapped=screen_buff_byteswapped)
+            utime.sleep_ms(500)
+            input_handler.disable()
+            exit(0)
 
         ########################################################################
         # DISPLAY IN SCREEN
@@ -459,22 +580,27 @@ def loop(control, thermal, screen, menu, input_handler, camera_slave, **kwargs):
 
         if screen_refresh_needed:
             previous_text = text
-            screen.screen_buff.draw_string(10, 10, text, color=(57, 255, 20), scale=2.1, mono_space=False)
+            glyph_cache.draw_string(screen.screen_buff, 10, 10, text, color=overlay_color((57, 255, 20)), scale=2.1, mono_space=False)
             if state is CameraState.PLAYBACK:
                 logger.info("Refresh needed")
-            screen.write_to_screen(screen.screen_buff)
+            if state is CameraState.PREVIEW:
+                # Frames shown, the loop skips the visual frames which the screen shows already
+                control.fps_tick()
+            if state is CameraState.PREVIEW and visual_preview:
+                # Sent while waiting for the next visual frame, which is drawn in the other buffer
+                screen.write_to_screen_async(screen.screen_buff, byteswapped=screen_buff_byteswapped)
+                screen.swap_buffers()
+            elif state is CameraState.PREVIEW:
+                # The thermal previews have nothing to do during the transfer (snapshot waits for the Lepton)
+                screen.write_to_screen(screen.screen_buff, byteswapped=screen_buff_byteswapped)
+            else:
+                # Menus and playback only change a few tiles between refreshes
+                screen.write_to_screen(screen.screen_buff, byteswapped=screen_buff_byteswapped, partial=True)
             screen_refresh_needed = False
 
         ########################################################################
         # OTHER FUNCTIONALITY
 
-        if not running_from_ide and usb.isconnected():
-            screen.screen_buff.draw_rectangle(0, screen.height//3, screen.width, screen.height//3, color=(10,10,10), fill=True)
-            screen.screen_buff.draw_string(round(screen.width/5), round(screen.height/2.3), "USB DEBUGGING", color=(255,0,0), scale=2.0)
-            screen.write_to_screen(screen.screen_buff)
-            utime.sleep_ms(500)
-            input_handler.disable()
-            exit(0)
         if input_handler.pin.value() == 0 and input_handler.time_since_interrupt() > 100:
             input_handler.interrupt_callback(line="LOOP")
 
@@ -31,10 +31,11 @@ from pyb import LED, USB_VCP, Pin, SPI
 import sensor
 import image
 import utime, time
+from ustruct import pack_into
 
-from utils.image import qvgafov2qvga
+from utils.image import create_fov_tables, qvgafov2qvga_tables, qvgafov2qvga_gather, qvga2qqvga, rle565_encode, crc16, create_crc16_table, create_palette, qqgrey2qvga_blend
 
-from components.camera_slave import CameraSlaveControl
+from components.camera_slave_control import CameraSlaveControl
 
 pin_busy = Pin.board.P7
 pin_spi_ss = Pin.board.P3
@@ -79,10 +80,10 @@ class DataTX():
     sent = False
     buff = None
 
-dataTX = DataTX()
-dataRX = DataTX()
-dataTX.buff = sensor.alloc_extra_fb(DataTX.img_width, DataTX.img_height, sensor.RGB565)
-dataRX.buff = sensor.alloc_extra_fb(DataTX.img_width, DataTX.img_height, sensor.RGB565)
+# The next frame is built in one buffer while the previous one waits for the master in the other
+frames = [DataTX(), DataTX()]
+for frame in frames:
+    frame.buff = sensor.alloc_extra_fb(DataTX.img_width, DataTX.img_height, sensor.RGB565)
 
 usb = USB_VCP()
 
@@ -99,45 +100,66 @@ control.column_zoom_denominator = 20
 control.row_zoom_numerator = 22
 control.row_zoom_denominator = 20
 
-while(True):
-    clock.tick()                    # Update the FPS clock.
-    img = sensor.snapshot()         # Take a picture and return the image.
-    if debug_image:
-        utime.sleep_ms(3000)
-    qvgafov2qvga(
-        img,
-        dataTX.buff,
-        control.column_offset, # column_offset
-        control.row_offset, # row_offset
-        control.column_zoom_numerator,  # column_zoom_numerator
-        control.column_zoom_denominator,  # column_zoom_denominator
-        control.row_zoom_numerator,  # row_zoom_numerator
-        control.row_zoom_denominator,  # row_zoom_denominator
-    )
-    if debug_image:
-        dataTX.buff.draw_string(0,0,"cropped", color=127)
-        if (usb.isconnected()):
-            print(dataTX.buff.compressed_for_ide(), end="")
-        utime.sleep_ms(3000)
-        continue
+# Source index tables of the crop, rebuilt only when the master sends a different crop
+fov_tables = create_fov_tables()
+fov_control = bytearray(control.FOV_CONTROL_BYTES)
+
+# Frames of every format, the frame is at the start of the buffers. A compressed frame is encoded
+# in the other buffer, the raw frame is not needed once it is encoded.
+tx_frames = [[memoryview(frame.buff.bytearray())[:frame_bytes] for frame_bytes in control.FRAME_BYTES] for frame in frames]
+tx_compressed = [memoryview(frame.buff.bytearray()) for frame in frames]
 
-    if (input_spi_ss.value() == 1):
-        output_busy.value(0)
-    start_time = utime.ticks_ms()
-    refresh_image = False
-    while (input_spi_ss.value() == 1):
-        if utime.ticks_diff(utime.ticks_ms(), start_time) > 500:
-            green_led.off()
-            blue_led.off()
-            if utime.ticks_diff(utime.ticks_ms(), start_time) > 1000:
-                refresh_image = True
-                break
+building = 0 # Buffer of the frame being built
+build_control = bytearray(control.FRAME_CONTROL_BYTES) # Crop, format and compression of the frame being built
+ready = None # Data of the last complete frame, None until there is one with the current control
+ready_header = bytearray(control.HEADER_BYTES)
+payload_ack = bytearray(1)
+frame_counter = 0
+crc_table = create_crc16_table()
+# Control received from the master, it replaces the one in use only when it passes the checks
+received_control = bytearray(control.CONTROL_BYTES)
+rejected_controls = 0
 
+# Fused frames: the last thermal frame of the master blended with the colors of its MIX preview
+thermal = bytearray(control.THERMAL_BYTES)
+palette = bytearray(512)
+create_palette(sensor.snapshot().to_grayscale(), palette, color_palette=sensor.PALETTE_IRONBOW, byteswap=False)
 
+# The master selects the slave as soon as it sees the busy pin low and the slave has start_delay
+# (500us) from then to start sending. The busy pin is low only while the slave checks the chip
+# select, after raising it the slave keeps checking SELECT_GUARD_US for a master which saw it low.
+SELECT_GUARD_US = const(500)
+# Time the slave waits for the master after a frame is complete before building the next one
+FRAME_REFRESH_US = const(20000)
+IDLE_MS = const(500)
+PAYLOAD_TIMEOUT_MS = const(200)
+last_select_ms = utime.ticks_ms()
+
+def wait_select(timeout_us):
+    """ Ready (busy low) until the master selects the slave or timeout_us, True when selected """
+    output_busy.value(0)
+    start_time = utime.ticks_us()
+    while input_spi_ss.value() == 1:
+        if utime.ticks_diff(utime.ticks_us(), start_time) >= timeout_us:
+            output_busy.value(1)
+            start_time = utime.ticks_us()
+            while input_spi_ss.value() == 1:
+                if utime.ticks_diff(utime.ticks_us(), start_time) > SELECT_GUARD_US:
+                    if utime.ticks_diff(utime.ticks_ms(), last_select_ms) > IDLE_MS:
+                        green_led.off()
+                        blue_led.off()
+                    return False
+            break
     output_busy.value(1)
-    if refresh_image:
-        print("Refresh cached image during idle mode")
-        continue
+    return True
+
+def serve(timeout_us):
+    """ Sends the complete frame if the master selects the slave within timeout_us.
+    True when the control received changes the frame being built. """
+    global spi, spi_error, ready, last_select_ms, rejected_controls
+    if ready is None or not wait_select(timeout_us):
+        return False
+    last_select_ms = utime.ticks_ms()
 
     set_pins_to_spi_af(pins_spi_bus)
     if not spi_error:
@@ -147,8 +169,26 @@ while(True):
         spi = setup_spi()
 
     try:
-        spi.send_recv(dataTX.buff.bytearray(), dataRX.buff.bytearray(), timeout=5000)
-        spi.recv(control.buff, timeout=1000)
+        spi.send(ready_header, timeout=5000)
+        # The master skips the payload when the header does not make sense or it has the frame already
+        spi.recv(payload_ack, timeout=PAYLOAD_TIMEOUT_MS)
+        if payload_ack[0] == control.PAYLOAD_SEND:
+            if control.frame_format == control.FORMAT_FUSED:
+                # The master sends its thermal frame while it receives the payload
+                both = min(len(ready), control.THERMAL_BYTES)
+                spi.send_recv(ready[:both], memoryview(thermal)[:both], timeout=PAYLOAD_TIMEOUT_MS)
+                if len(ready) > both:
+                    spi.send(ready[both:], timeout=PAYLOAD_TIMEOUT_MS)
+                elif control.THERMAL_BYTES > both:
+                    spi.recv(memoryview(thermal)[both:], timeout=PAYLOAD_TIMEOUT_MS)
+            else:
+                spi.send(ready, timeout=PAYLOAD_TIMEOUT_MS)
+        spi.recv(received_control, timeout=1000)
+        if not control.load(received_control, crc_table):
+            # Corrupted on the link (or received while the master was in another part of the exchange),
+            # the frames are built with the previous control
+            rejected_controls += 1
+            print("rejected control {}".format(rejected_controls))
         red_led.off()
     except OSError as err:
         spi_error = True
@@ -161,7 +201,76 @@ while(True):
     while (input_spi_ss.value() == 0):
         pass
 
-    print(clock.fps())              # Note: OpenMV Cam runs about half as fast when connected
-                                    # to the IDE. The FPS should increase once disconnected.
+    # The frame is sent again until a newer one is complete. The master expects the crop, format and
+    # compression of its last control from the next frame on, a change of them discards it. The fusion
+    # alpha and thresholds (updated by the master almost every MIX frame) only apply to the next build.
+    if control.buff[:control.FRAME_CONTROL_BYTES] != build_control:
+        ready = None
+        return True
+    return False
 
+while(True):
+    clock.tick()                    # Update the FPS clock.
+    build_control[:] = control.buff[:control.FRAME_CONTROL_BYTES]
+    img = sensor.snapshot()         # Take a picture and return the image.
+    capture_ms = utime.ticks_ms()
+    if debug_image:
+        utime.sleep_ms(3000)
+    if serve(SELECT_GUARD_US):
+        continue
+    if control.buff[:control.FOV_CONTROL_BYTES] != fov_control:
+        qvgafov2qvga_tables(
+            *fov_tables,
+            control.column_offset, # column_offset
+            control.row_offset, # row_offset
+            control.column_zoom_numerator,  # column_zoom_numerator
+            control.column_zoom_denominator,  # column_zoom_denominator
+            control.row_zoom_numerator,  # row_zoom_numerator
+            control.row_zoom_denominator,  # row_zoom_denominator
+        )
+        fov_control[:] = control.buff[:control.FOV_CONTROL_BYTES]
+    buff = frames[building].buff
+    qvgafov2qvga_gather(img, buff, *fov_tables)
+    if serve(SELECT_GUARD_US):
+        continue
+    frame_format = control.frame_format
+    if frame_format == control.FORMAT_QQVGA:
+        qvga2qqvga(buff, buff)
+    elif frame_format == control.FORMAT_FUSED:
+        # In place, ready for the screen of the master
+        qqgrey2qvga_blend(thermal, buff, buff, palette, control.fusion_alpha, control.fusion_threshold_low,
+                          control.fusion_threshold_high, control.fusion_byteswap)
+    tx_frame = tx_frames[building][frame_format]
+    if debug_image:
+        buff.draw_string(0,0,"cropped", color=127)
+        if (usb.isconnected()):
+            print(buff.compressed_for_ide(), end="")
+        utime.sleep_ms(3000)
+        continue
+
+    # The frame is complete, the previous one is replaced
+    codec = control.CODEC_NONE
+    if control.compression:
+        # Sent raw when it does not compress enough
+        other = 1 - building
+        words = rle565_encode(buff, frames[other].buff, len(tx_frame) // 2, control.FRAME_WIDTHS[frame_format],
+                              control.COMPRESSED_MAX_BYTES // 2)
+        if words >= 0:
+            codec = control.CODEC_RLE565
+            ready = tx_compressed[other][:words * 2]
+        else:
+            ready = tx_frame
+            building = other
+    else:
+        ready = tx_frame
+        building = 1 - building
+    frame_counter = (frame_counter + 1) & 0x3FFFFFFF
+    pack_into(control.HEADER_FORMAT, ready_header, 0, len(ready), codec, frame_format, frame_counter, capture_ms, 0)
+    crc = crc16(ready_header, control.HEADER_CRC_BYTES, 0xFFFF, crc_table)
+    pack_into(control.HEADER_FORMAT, ready_header, 0, len(ready), codec, frame_format, frame_counter, capture_ms,
+              crc16(ready, len(ready), crc, crc_table))
 
+    serve(FRAME_REFRESH_US)
+
+    print(clock.fps())              # Note: OpenMV Cam runs about half as fast when connected
+                                    # to the IDE. The FPS should increase once disconnected.
@@ -21,29 +21,168 @@
 #SOFTWARE.
 
 import utime
+import ujson
 from pyb import SPI, Pin, LED
 
+def _length(data):
+    """ Bytes of a buffer, an image (size() are the bytes, len() the pixels) or a single int """
+    if isinstance(data, int):
+        return 1
+    size = getattr(data, "size", None)
+    return size() if size else len(data)
+
+
+class MicrosecondHistogram():
+    """ Counts of durations below each bound (the last bin is for the longer ones), total and maximum """
+
+    BOUNDS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total_us = 0
+        self.maximum_us = 0
+
+    def add(self, us):
+        index = 0
+        for bound in self.BOUNDS:
+            if us < bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.total_us += us
+        if us > self.maximum_us:
+            self.maximum_us = us
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def mean_us(self):
+        count = self.count
+        return self.total_us / count if count else 0
+
+    def to_dict(self):
+        return {"bounds_us": self.BOUNDS, "counts": self.counts, "total_us": self.total_us, "maximum_us": self.maximum_us}
+
+
+class SPIStatistics():
+    """ Usage of the bus by one device """
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.bytes = 0
+        self.locks = 0
+        self.relocks = 0
+        self.reconfigurations = 0
+        self.deferred = 0
+        self.hold_us = MicrosecondHistogram()
+        self.wait_us = MicrosecondHistogram()
+
+    TEXT_LINES = 4
+
+    def text(self, line):
+        """ Line (up to TEXT_LINES) of the statistics, short enough for a menu row """
+        if line == 0:
+            return "{} {}kB".format(self.name, self.bytes // 1024)
+        if line == 1:
+            return " hold {:.1f}/{:.1f}ms".format(self.hold_us.mean_us() / 1000, self.hold_us.maximum_us / 1000)
+        if line == 2:
+            return " wait {:.1f}/{:.1f}ms".format(self.wait_us.mean_us() / 1000, self.wait_us.maximum_us / 1000)
+        return " cfg {} relock {}".format(self.reconfigurations, self.relocks)
+
+    def to_dict(self):
+        return {
+            "name": self.name, "bytes": self.bytes, "locks": self.locks, "relocks": self.relocks,
+            "reconfigurations": self.reconfigurations, "deferred": self.deferred,
+            "hold_us": self.hold_us.to_dict(), "wait_us": self.wait_us.to_dict(),
+        }
+
+
 class DynamicSPI():
+    """ SPI2 shared by several devices, each one with its own chip select and configuration.
+
+    A device locking the bus while another one holds it can give a release_callback: it is queued
+    and called when the bus is released. The queue has one slot per device, allocated with it (a
+    device has at most one pending transaction), so it is bounded and queuing does not allocate.
+    The queued devices are served by priority (higher first), a device waiting more than
+    max_wait_us is served before any other one so the wait is bounded. Between waiters of the same
+    priority the ones with the configuration already in the peripheral go first, so it is not
+    changed back and forth.
+
+    The interrupt callbacks (touch and the auxiliary controller in the same transaction) queue
+    with a release_callback, they run from the main loop and cannot wait for it. The devices of the
+    main loop (screen and visual camera) only find the bus locked while a transfer of the main loop
+    is left in progress (see hold), they wait for it to complete instead.
+    """
 
     _spi = None
     _locked = None
+    _finish = None # Completes the transaction in progress, see hold
     _hash_arguments = None
-    _release_callback = None
-    _release_callback_arguments = None
+    devices = []
+    _waiting = [] # Slots (device, queued_us, release_callback, arguments), free without callback
+    _waiting_count = 0
+    _serving = False
     _verbose = False
 
+    max_wait_us = 50000
+    wait_us_last = 0
+    wait_us_max = 0
+    served = 0
+
+    # Locks which changed the configuration of the peripheral and the ones which found it ready,
+    # in total and in the last frame (see next_frame)
+    reconfigurations = 0
+    reconfigurations_avoided = 0
+    frame_reconfigurations = 0
+    frame_reconfigurations_avoided = 0
+    _frame_start = (0, 0)
+
     def create(*args, **kwargs):
         if DynamicSPI._spi:
-            DynamicSPI._spi.deinit()
-            del DynamicSPI._spi
-        DynamicSPI._spi = SPI(2, mode=SPI.MASTER, **kwargs)
+            # SPI.init re-initialises the whole peripheral on pyb, this only saves the deinit and a
+            # new SPI object. The locks which find the configuration in place skip it altogether.
+            DynamicSPI._spi.init(SPI.MASTER, **kwargs)
+        else:
+            DynamicSPI._spi = SPI(2, mode=SPI.MASTER, **kwargs)
         DynamicSPI._hash_arguments = hash(frozenset(kwargs.items()))
         return DynamicSPI._hash_arguments
 
-    def __init__(self, pin_cs, start_delay=0, byte_delay=0, **arguments):
+    def next_frame():
+        """ Updates the counters of the last frame, call it once per frame """
+        DynamicSPI.frame_reconfigurations = DynamicSPI.reconfigurations - DynamicSPI._frame_start[0]
+        DynamicSPI.frame_reconfigurations_avoided = DynamicSPI.reconfigurations_avoided - DynamicSPI._frame_start[1]
+        DynamicSPI._frame_start = (DynamicSPI.reconfigurations, DynamicSPI.reconfigurations_avoided)
+
+    def reset_statistics():
+        for device in DynamicSPI.devices:
+            device.statistics.reset()
+
+    def save_statistics(file_name="spi_statistics.json"):
+        """ Statistics of every device (see SPIStatistics) as json """
+        with open(file_name, "w") as f:
+            ujson.dump({
+                "reconfigurations": DynamicSPI.reconfigurations,
+                "reconfigurations_avoided": DynamicSPI.reconfigurations_avoided,
+                "devices": [device.statistics.to_dict() for device in DynamicSPI.devices],
+            }, f)
+
+    def __init__(self, pin_cs, start_delay=0, byte_delay=0, priority=0, name="", **arguments):
         self._hash_arguments = self.create(**arguments)
         self.pin_cs = Pin(pin_cs, Pin.OUT_PP)
         self.arguments = arguments
+        self.priority = priority
+        self.statistics = SPIStatistics(name or str(pin_cs))
+        self._lock_us = 0
+        DynamicSPI.devices.append(self)
+        self._waiting_slot = [self, 0, None, None]
+        DynamicSPI._waiting.append(self._waiting_slot)
+        # Transfer plan of the byte delayed devices: one byte buffers reused for every byte
+        self._byte_send = bytearray(1)
+        self._byte_receive = bytearray(1)
         self._allow_relock = False
         self.start_delay = start_delay
         self.byte_delay = byte_delay
@@ -60,16 +199,19 @@ class DynamicSPI():
         if self.locked and self._allow_relock and DynamicSPI._hash_arguments == self._hash_arguments:
             if self._verbose:
                 print("Re-using")
+            self.statistics.relocks += 1
         else:
             if self.locked:
                 if release_callback:
                     if self._verbose:
                         print("SPI schedulled callback")
 
-                    DynamicSPI._release_callback = release_callback
-                    DynamicSPI._release_callback_arguments = arguments
+                    self._enqueue(release_callback, arguments)
+                    self.statistics.deferred += 1
                     return False
-                else:
+                if DynamicSPI._finish is not None:
+                    self._wait_finish()
+                if self.locked:
                     LED(1).on()
                     LED(2).on()
                     LED(3).on()
@@ -81,7 +223,14 @@ class DynamicSPI():
             if DynamicSPI._hash_arguments != self._hash_arguments:
                 if self._verbose:
                     print("Change to", self.arguments)
-                self._hash_arguments = DynamicSPI.create(**self.arguments)
+                DynamicSPI._spi.init(SPI.MASTER, **self.arguments)
+                DynamicSPI._hash_arguments = self._hash_arguments
+                DynamicSPI.reconfigurations += 1
+                self.statistics.reconfigurations += 1
+            else:
+                DynamicSPI.reconfigurations_avoided += 1
+            self.statistics.locks += 1
+            self._lock_us = utime.ticks_us()
 
         self._allow_relock = allow_relock
 
@@ -98,16 +247,128 @@ class DynamicSPI():
             raise NotImplementedError
         self._allow_relock = False
         self.pin_cs.value(1)
-        release_callback = DynamicSPI._release_callback
-        release_arguments = DynamicSPI._release_callback_arguments
-        DynamicSPI._release_callback = None
-        DynamicSPI._release_callback_arguments = None
         DynamicSPI._locked = None
+        DynamicSPI._finish = None
+        self.statistics.hold_us.add(utime.ticks_diff(utime.ticks_us(), self._lock_us))
 
         if self._verbose:
             print("Released", self.arguments)
-        if release_callback:
-            release_callback(**release_arguments)
+        if DynamicSPI._waiting_count:
+            self._serve_waiting()
+
+    def hold(self, finish):
+        """ The bus stays locked after returning to the main loop (an asynchronous transfer), finish
+        completes the transaction and releases it. A device locking the bus without release_callback
+        meanwhile calls it instead of failing. """
+        DynamicSPI._finish = finish
+
+    def _wait_finish(self):
+        start_us = utime.ticks_us()
+        DynamicSPI._finish()
+        self.statistics.deferred += 1
+        self.statistics.wait_us.add(utime.ticks_diff(utime.ticks_us(), start_us))
+
+    def set_baudrate(self, baudrate):
+        """ The peripheral gets the new baudrate on the next lock """
+        self.arguments["baudrate"] = baudrate
+        self._hash_arguments = hash(frozenset(self.arguments.items()))
+
+    @property
+    def baudrate(self):
+        return self.arguments["baudrate"]
+
+    @property
+    def waiting(self):
+        return DynamicSPI._waiting_count
+
+    @property
+    def configured(self):
+        """ The peripheral has the configuration of this device, locking it is cheaper """
+        return DynamicSPI._hash_arguments == self._hash_arguments
+
+    def _enqueue(self, release_callback, arguments):
+        """ A second request of the same device replaces the callback but keeps its place """
+        slot = self._waiting_slot
+        if slot[2] is None:
+            slot[1] = utime.ticks_us()
+            DynamicSPI._waiting_count += 1
+        slot[2] = release_callback
+        slot[3] = arguments
+
+    def _next_waiting(self):
+        """ Slot of the oldest waiter over max_wait_us, otherwise of the highest priority one
+        (between equal priorities the already configured one, then the oldest one) """
+        now = utime.ticks_us()
+        selected = None
+        selected_us = 0
+        for slot in DynamicSPI._waiting:
+            if slot[2] is None:
+                continue
+            waited_us = utime.ticks_diff(now, slot[1])
+            if selected is not None:
+                device = slot[0]
+                selected_device = selected[0]
+                if selected_us > DynamicSPI.max_wait_us or waited_us > DynamicSPI.max_wait_us:
+                    if waited_us <= selected_us:
+                        continue
+                elif device.priority != selected_device.priority:
+                    if device.priority < selected_device.priority:
+                        continue
+                elif device.configured != selected_device.configured:
+                    if not device.configured:
+                        continue
+                elif waited_us <= selected_us:
+                    continue
+            selected = slot
+            selected_us = waited_us
+        return selected
+
+    def _serve_waiting(self):
+        # The callbacks lock and release the bus, the nested releases leave the serving to this loop
+        if DynamicSPI._serving:
+            return
+        DynamicSPI._serving = True
+        try:
+            while DynamicSPI._waiting_count and not self.locked:
+                slot = self._next_waiting()
+                device, queued_us, release_callback, arguments = slot
+                slot[2] = None
+                slot[3] = None
+                DynamicSPI._waiting_count -= 1
+                DynamicSPI.wait_us_last = utime.ticks_diff(utime.ticks_us(), queued_us)
+                DynamicSPI.wait_us_max = max(DynamicSPI.wait_us_max, DynamicSPI.wait_us_last)
+                DynamicSPI.served += 1
+                device.statistics.wait_us.add(DynamicSPI.wait_us_last)
+                if self._verbose:
+                    print("Serving", device.arguments, "after", DynamicSPI.wait_us_last, "us")
+                release_callback(**arguments)
+        finally:
+            DynamicSPI._serving = False
+
+    def _byte_transfer(self, send, receive, length):
+        """ Bytes sent one by one with at least byte_delay us from the end of a byte to the start of
+        the next one. The loop work is done while waiting, the buffers are not allocated per byte. """
+        spi = DynamicSPI._spi
+        byte_send = self._byte_send
+        byte_receive = self._byte_receive
+        byte_delay = self.byte_delay
+        ticks_us = utime.ticks_us
+        ticks_diff = utime.ticks_diff
+        start = ticks_us()
+        for i in range(length):
+            if send is not None:
+                byte_send[0] = send[i]
+            while ticks_diff(ticks_us(), start) < byte_delay:
+                pass
+            if send is None:
+                spi.recv(byte_receive)
+            elif receive is None:
+                spi.send(byte_send)
+            else:
+                spi.send_recv(byte_send, byte_receive)
+            start = ticks_us()
+            if receive is not None:
+                receive[i] = byte_receive[0]
 
     def send(self, send, **kwargs):
         auto_lock = not self.locked or self._allow_relock
@@ -119,11 +380,8 @@ class DynamicSPI():
         if self.byte_delay == 0:
             result=DynamicSPI._spi.send(send, **kwargs)
         else:
-            end = len(send)
-            send_mv = memoryview(send)
-            for i in range(0, end):
-                utime.sleep_us(self.byte_delay)
-                DynamicSPI._spi.send(send_mv[i:(i+1)])
+            self._byte_transfer(send, None, len(send))
+        self.statistics.bytes += _length(send)
         if auto_lock:
             if self._verbose:
                 print("Autorelease")
@@ -139,11 +397,8 @@ class DynamicSPI():
         if self.byte_delay == 0:
             result=DynamicSPI._spi.recv(receive, **kwargs)
         else:
-            end = len(receive)
-            receive_mv = memoryview(receive)
-            for i in range(0, end):
-                utime.sleep_us(self.byte_delay)
-                DynamicSPI._spi.recv(receive_mv[i:(i+1)])
+            self._byte_transfer(None, receive, len(receive))
+        self.statistics.bytes += _length(receive)
         if auto_lock:
             if self._verbose:
                 print("Autorelease")
@@ -159,12 +414,8 @@ class DynamicSPI():
         if self.byte_delay == 0:
             result=DynamicSPI._spi.send_recv(send, receive, **kwargs)
         else:
-            end = min(len(send), len(receive))
-            send_mv = memoryview(send)
-            receive_mv = memoryview(receive)
-            for i in range(0, end):
-                utime.sleep_us(self.byte_delay)
-                DynamicSPI._spi.send_recv(send_mv[i:(i+1)], receive_mv[i:(i+1)])
+            self._byte_transfer(send, receive, min(len(send), len(receive)))
+        self.statistics.bytes += _length(receive)
         if auto_lock:
             if self._verbose:
                 print("Autorelease")
@@ -106,6 +106,197 @@ def qqgrey2qvga(src: ptr8, dst: ptr16):
             irow_screen += 2
             irow_screen_1 = irow_screen + 1
 
+@micropython.viper
+def qqgrey2qvga_palette(src: ptr8, dst: ptr32, palette: ptr16):
+    """ Single pass QQVGA grayscale to QVGA RGB565 through a palette (see create_palette).
+
+    Replaces to_rainbow + qqvga2qvga + the byte swap of the screen, each grey pixel is read once
+    and written as two 32 bit words (2 pixels of two screen lines).
+    """
+    columns_image = 160
+    rows_image = 120
+    image_size = columns_image * rows_image
+
+    columns_screen_words = 320 // 2
+    # assumption that the screen has double the lines of the image
+
+    index_image = 0
+    index_screen = 0
+    icolumn_image = 0
+    while index_image < image_size:
+        pixel = palette[src[index_image]]
+        pixels = pixel | (pixel << 16)
+        dst[index_screen] = pixels
+        dst[index_screen + columns_screen_words] = pixels
+        index_image += 1
+        index_screen += 1
+        icolumn_image += 1
+
+        if icolumn_image >= columns_image:
+            icolumn_image = 0
+            index_screen += columns_screen_words
+
+def create_palette(img, palette, color_palette=None, byteswap=True):
+    """ Fill palette (bytearray of 512) with the RGB565 color of every grey level for qqgrey2qvga_palette
+
+    The colors are the ones given by img.to_rainbow(color_palette) or img.to_rgb565() if
+    color_palette is None. With byteswap the bytes are already in the order of the screen.
+    img must be a GRAYSCALE image of at least 256 pixels (e.g. the sensor frame buffer), its
+    content is lost.
+    """
+    grey = img.bytearray()
+    for value in range(256):
+        grey[value] = value
+    if color_palette is None:
+        img.to_rgb565()
+    else:
+        img.to_rainbow(color_palette=color_palette)
+    rgb = img.bytearray()
+    for value in range(256):
+        if byteswap:
+            palette[2 * value] = rgb[2 * value + 1]
+            palette[2 * value + 1] = rgb[2 * value]
+        else:
+            palette[2 * value] = rgb[2 * value]
+            palette[2 * value + 1] = rgb[2 * value + 1]
+
+MIX_ALPHA_MAX = const(32)
+
+@micropython.viper
+def qqgrey2qvga_blend(
+    src: ptr8,
+    visual: ptr32,
+    dst: ptr32,
+    palette: ptr16,
+    alpha: int,
+    threshold_low: int,
+    threshold_high: int,
+    byteswap: int,
+):
+    """ Single pass blend of the QQVGA grayscale thermal image over the QVGA RGB565 visual image
+
+    The thermal color comes from palette (create_palette without byteswap), it is weighted with
+    alpha / MIX_ALPHA_MAX (fixed point, 0 only visual, MIX_ALPHA_MAX only thermal). Only the grey
+    levels from threshold_low to threshold_high are blended, the other pixels are the visual ones.
+    With byteswap the result is stored in the order of the screen.
+    The visual image is read and the result written as 32 bit words (the 2 screen pixels of a
+    thermal pixel in one line).
+    """
+    columns_image = 160
+    rows_image = 120
+    image_size = columns_image * rows_image
+
+    columns_screen_words = 320 // 2
+    # assumption that the screen has double the lines of the image
+
+    alpha_visual = MIX_ALPHA_MAX - alpha
+
+    index_image = 0
+    index_screen = 0
+    icolumn_image = 0
+    while index_image < image_size:
+        grey = src[index_image]
+        blend = grey >= threshold_low and grey <= threshold_high
+        # Thermal color already weighted, red and blue are kept apart from green to have room for the product
+        pixel = palette[grey]
+        thermal_red_blue = (pixel & 0xF81F) * alpha
+        thermal_green = (pixel & 0x07E0) * alpha
+
+        index = index_screen
+        irow_pixel = 0
+        while irow_pixel < 2:
+            pixels = visual[index]
+            if blend:
+                # >> 5 is the division by MIX_ALPHA_MAX
+                pixel = pixels & 0xFFFF
+                red_blue = (((pixel & 0xF81F) * alpha_visual + thermal_red_blue) >> 5) & 0xF81F
+                green = (((pixel & 0x07E0) * alpha_visual + thermal_green) >> 5) & 0x07E0
+                pixel_first = red_blue | green
+                pixel = (pixels >> 16) & 0xFFFF
+                red_blue = (((pixel & 0xF81F) * alpha_visual + thermal_red_blue) >> 5) & 0xF81F
+                green = (((pixel & 0x07E0) * alpha_visual + thermal_green) >> 5) & 0x07E0
+                pixels = pixel_first | ((red_blue | green) << 16)
+            if byteswap:
+                pixels = ((pixels >> 8) & 0x00FF00FF) | ((pixels & 0x00FF00FF) << 8)
+            dst[index] = pixels
+            index += columns_screen_words
+            irow_pixel += 1
+
+        index_image += 1
+        index_screen += 1
+        icolumn_image += 1
+
+        if icolumn_image >= columns_image:
+            icolumn_image = 0
+            index_screen += columns_screen_words
+
+@micropython.viper
+def qqgrey2qvga_blend_qqvga(
+    src: ptr8,
+    visual: ptr16,
+    dst: ptr32,
+    palette: ptr16,
+    alpha: int,
+    threshold_low: int,
+    threshold_high: int,
+    byteswap: int,
+):
+    """ qqgrey2qvga_blend with the QQVGA RGB565 visual image of the reduced frame format
+
+    Both images have the same resolution, every blended pixel is written as the 2x2 screen pixels.
+    """
+    columns_image = 160
+    rows_image = 120
+    image_size = columns_image * rows_image
+
+    columns_screen_words = 320 // 2
+
+    alpha_visual = MIX_ALPHA_MAX - alpha
+
+    index_image = 0
+    index_screen = 0
+    icolumn_image = 0
+    while index_image < image_size:
+        grey = src[index_image]
+        pixel = visual[index_image]
+        if grey >= threshold_low and grey <= threshold_high:
+            # >> 5 is the division by MIX_ALPHA_MAX
+            thermal = palette[grey]
+            red_blue = (((pixel & 0xF81F) * alpha_visual + (thermal & 0xF81F) * alpha) >> 5) & 0xF81F
+            green = (((pixel & 0x07E0) * alpha_visual + (thermal & 0x07E0) * alpha) >> 5) & 0x07E0
+            pixel = red_blue | green
+        if byteswap:
+            pixel = ((pixel >> 8) & 0xFF) | ((pixel & 0xFF) << 8)
+        pixels = pixel | (pixel << 16)
+        dst[index_screen] = pixels
+        dst[index_screen + columns_screen_words] = pixels
+
+        index_image += 1
+        index_screen += 1
+        icolumn_image += 1
+
+        if icolumn_image >= columns_image:
+            icolumn_image = 0
+            index_screen += columns_screen_words
+
+@micropython.viper
+def qvga2qqvga(src: ptr16, dst: ptr16):
+    """ QQVGA with every second column and row of a QVGA RGB565 image, src and dst can be the same """
+    columns_image = 160
+    rows_image = 120
+    columns_src = 320
+
+    index = 0
+    irow = 0
+    while irow < rows_image:
+        index_src = irow * 2 * columns_src
+        end = index + columns_image
+        while index < end:
+            dst[index] = src[index_src]
+            index += 1
+            index_src += 2
+        irow += 1
+
 @micropython.viper
 def increase_image_viper(src: ptr16, dst: ptr16, pixels: int):
     columns_image = 160
@@ -246,3 +437,484 @@ def qvgafov2qvga(
             irow_dst += 1
             if irow_dst >= rows or irow_src >= rows:
                 return
+
+FOV_TABLE_END = const(0xFFFF)
+
+
+def create_fov_tables():
+    """ Buffers for qvgafov2qvga_tables: columns of the first row, columns of the other rows, rows """
+    return bytearray(2 * (320 + 1)), bytearray(2 * (320 + 1)), bytearray(2 * (240 + 1))
+
+@micropython.viper
+def qvgafov2qvga_tables(
+    first_columns: ptr16,
+    columns_table: ptr16,
+    rows_table: ptr16,
+    column_offset: int,
+    row_offset: int,
+    column_zoom_numerator: int,
+    column_zoom_denominator: int,
+    row_zoom_numerator: int,
+    row_zoom_denominator: int,
+):
+    """ Source column/row of every destination pixel of qvgafov2qvga (approx time of one qvgafov2qvga)
+
+    Same walk as qvgafov2qvga but storing the indexes instead of copying the pixels. The column state
+    is not reset between rows, so the first row has its own table, all the following rows share the
+    second one. Every table ends with FOV_TABLE_END.
+    """
+    columns = 320
+    rows = 240
+
+    icolumn_src = column_offset
+    irow_src = row_offset
+    icolumn_dst = 0
+    irow_dst = 0
+
+    column_fraction_copy = column_zoom_numerator - column_zoom_denominator
+    row_fraction_copy = row_zoom_numerator - row_zoom_denominator
+
+    icolumn_action = 0
+    irow_action = 0
+
+    copies_per_column_copy = column_zoom_numerator // column_zoom_denominator
+    columns_to_copy = 0  # Per block columns to be copied
+    columns_copied = 0
+    column_copied = 0
+
+    copies_per_row_copy = row_zoom_numerator // row_zoom_numerator
+    rows_to_copy = 0
+    rows_copied = 0
+    row_copied = 0
+
+    first_columns[0] = FOV_TABLE_END
+    columns_table[0] = FOV_TABLE_END
+    while True:
+        if irow_dst == 0:
+            first_columns[icolumn_dst] = icolumn_src
+        elif irow_dst == 1:
+            columns_table[icolumn_dst] = icolumn_src
+
+        if columns_to_copy == 0 and column_copied != icolumn_src and columns_copied < column_fraction_copy:
+            columns_to_copy = copies_per_column_copy
+
+        if columns_to_copy > 0:
+            columns_to_copy -= 1
+            column_copied = icolumn_src
+            columns_copied += 1
+        else:
+            icolumn_src += 1
+
+        icolumn_action += 1
+        if icolumn_action >= column_zoom_numerator:
+            icolumn_action = 0
+            columns_copied = 0
+
+        icolumn_dst += 1
+        if icolumn_dst >= columns or icolumn_src >= columns:
+            if irow_dst == 0:
+                first_columns[icolumn_dst] = FOV_TABLE_END
+            elif irow_dst == 1:
+                columns_table[icolumn_dst] = FOV_TABLE_END
+            rows_table[irow_dst] = irow_src
+
+            icolumn_dst = 0
+            icolumn_src = column_offset
+            icolumn_action = 0
+            columns_copied = 0
+
+            if rows_to_copy == 0 and row_copied != irow_src and rows_copied < row_fraction_copy:
+                rows_to_copy = copies_per_row_copy
+
+            if rows_to_copy > 0:
+                rows_to_copy -= 1
+                row_copied = irow_src
+                rows_copied += 1
+            else:
+                irow_src += 1
+
+            irow_action += 1
+            if irow_action >= row_zoom_numerator:
+                irow_action = 0
+                rows_copied = 0
+
+            irow_dst += 1
+            if irow_dst >= rows or irow_src >= rows:
+                rows_table[irow_dst] = FOV_TABLE_END
+                return
+
+@micropython.viper
+def qvgafov2qvga_gather(src: ptr16, dst: ptr16, first_columns: ptr16, columns_table: ptr16, rows_table: ptr16):
+    """ Same result as qvgafov2qvga with the tables of qvgafov2qvga_tables, only copies pixels """
+    columns = 320
+
+    columns_row = first_columns
+    index_dst = 0
+    irow_dst = 0
+    irow_src = rows_table[0]
+    while irow_src != FOV_TABLE_END:
+        index_src = irow_src * columns
+        icolumn_dst = 0
+        icolumn_src = columns_row[0]
+        while icolumn_src != FOV_TABLE_END:
+            dst[index_dst + icolumn_dst] = src[index_src + icolumn_src]
+            icolumn_dst += 1
+            icolumn_src = columns_row[icolumn_dst]
+
+        columns_row = columns_table
+        index_dst += columns
+        irow_dst += 1
+        irow_src = rows_table[irow_dst]
+
+@micropython.viper
+def tile_checksums(src: ptr32, checksums: ptr32, dirty: ptr8, width: int, height: int, tile_width: int, tile_height: int) -> int:
+    """ Checksum of every tile of a RGB565 image (width and tile_width must be even)
+
+    The tiles are numbered row by row. dirty[tile] is set to 1 when the checksum differs from the
+    one in checksums (0 otherwise) and checksums is updated. Returns the number of dirty tiles.
+    """
+    words_row = width // 2
+    tile_words = tile_width // 2
+
+    dirty_tiles = 0
+    tile = 0
+    irow_tile = 0
+    while irow_tile < height:
+        irow_end = irow_tile + tile_height
+        if irow_end > height:
+            irow_end = height
+        icolumn_tile = 0
+        while icolumn_tile < words_row:
+            icolumn_end = icolumn_tile + tile_words
+            if icolumn_end > words_row:
+                icolumn_end = words_row
+
+            checksum = 0
+            irow = irow_tile
+            while irow < irow_end:
+                index = icolumn_tile + irow * words_row
+                index_end = icolumn_end + irow * words_row
+                while index < index_end:
+                    checksum = (checksum * 33 + src[index]) & 0x3FFFFFFF
+                    index += 1
+                irow += 1
+
+            if checksums[tile] != checksum:
+                checksums[tile] = checksum
+                dirty[tile] = 1
+                dirty_tiles += 1
+            else:
+                dirty[tile] = 0
+            tile += 1
+            icolumn_tile = icolumn_end
+        irow_tile = irow_end
+    return dirty_tiles
+
+@micropython.viper
+def blit_mask(dst: ptr16, dst_width: int, dst_height: int, mask: ptr8, x: int, y: int, width: int, height: int, color: int):
+    """ Sets to color the pixels of dst where the bit mask is set (e.g. the glyphs of utils/text.py)
+
+    mask has width x height bits, row by row, bit 0 of the first byte is the top left pixel.
+    The parts outside of dst are skipped.
+    """
+    irow = 0
+    if y < 0:
+        irow = 0 - y
+    irow_end = height
+    if y + height > dst_height:
+        irow_end = dst_height - y
+    icolumn_start = 0
+    if x < 0:
+        icolumn_start = 0 - x
+    icolumn_end = width
+    if x + width > dst_width:
+        icolumn_end = dst_width - x
+
+    while irow < irow_end:
+        bit = icolumn_start + irow * width
+        index = x + icolumn_start + (y + irow) * dst_width
+        icolumn = icolumn_start
+        while icolumn < icolumn_end:
+            if (mask[bit >> 3] >> (bit & 7)) & 1:
+                dst[index] = color
+            bit += 1
+            index += 1
+            icolumn += 1
+        irow += 1
+
+@micropython.viper
+def grey_statistics(src: ptr8, size: int, histogram: ptr32, result: ptr32):
+    """ Single pass statistics of a grayscale image of size pixels
+
+    histogram: 256 counters. result: minimum, maximum and sum of all the pixels.
+    """
+    index = 0
+    while index < 256:
+        histogram[index] = 0
+        index += 1
+
+    minimum = 255
+    maximum = 0
+    total = 0
+    index = 0
+    while index < size:
+        pixel = src[index]
+        histogram[pixel] += 1
+        total += pixel
+        if pixel < minimum:
+            minimum = pixel
+        if pixel > maximum:
+            maximum = pixel
+        index += 1
+
+    result[0] = minimum
+    result[1] = maximum
+    result[2] = total
+
+BLOB_STATS_SIZE = const(10)
+
+@micropython.viper
+def label_blobs(src: ptr8, width: int, height: int, threshold_low: int, threshold_high: int,
+                row_labels: ptr16, parents: ptr16, stats: ptr32, max_labels: int) -> int:
+    """ Connected components (8-connectivity) of the pixels from threshold_low to threshold_high
+
+    Single pass over horizontal runs with union find. row_labels: 2 * width labels of the previous
+    and current row. parents: max_labels + 1 labels, label 0 is the background. stats: BLOB_STATS_SIZE
+    words per label (pixels, sum of x, sum of y, sum of grey, x min, y min, x max, y max, grey min,
+    grey max), valid for the labels that are their own parent. Returns the number of labels used,
+    the runs which do not fit in max_labels are not labelled.
+    """
+    labels = 0
+    current = 0
+    previous = width
+    index = 0
+    while index < width:
+        row_labels[previous + index] = 0
+        index += 1
+
+    y = 0
+    row = 0
+    while y < height:
+        x = 0
+        while x < width:
+            pixel = src[row + x]
+            if pixel < threshold_low or pixel > threshold_high:
+                row_labels[current + x] = 0
+                x += 1
+                continue
+
+            # Run of pixels in the threshold
+            start = x
+            grey_sum = 0
+            grey_min = 255
+            grey_max = 0
+            while x < width:
+                pixel = src[row + x]
+                if pixel < threshold_low or pixel > threshold_high:
+                    break
+                grey_sum += pixel
+                if pixel < grey_min:
+                    grey_min = pixel
+                if pixel > grey_max:
+                    grey_max = pixel
+                x += 1
+
+            # Join the blobs of the previous row touching the run (diagonals included)
+            label = 0
+            column = start - 1 if start > 0 else 0
+            column_end = x + 1 if x < width else width
+            while column < column_end:
+                other = int(row_labels[previous + column])
+                column += 1
+                if other == 0:
+                    continue
+                while int(parents[other]) != other:
+                    parents[other] = parents[int(parents[other])]
+                    other = int(parents[other])
+                if label == 0:
+                    label = other
+                elif other != label:
+                    if other < label:
+                        swap = label
+                        label = other
+                        other = swap
+                    parents[other] = label
+                    offset = label * BLOB_STATS_SIZE
+                    other_offset = other * BLOB_STATS_SIZE
+                    stats[offset] += stats[other_offset]
+                    stats[offset + 1] += stats[other_offset + 1]
+                    stats[offset + 2] += stats[other_offset + 2]
+                    stats[offset + 3] += stats[other_offset + 3]
+                    if stats[other_offset + 4] < stats[offset + 4]:
+                        stats[offset + 4] = stats[other_offset + 4]
+                    if stats[other_offset + 5] < stats[offset + 5]:
+                        stats[offset + 5] = stats[other_offset + 5]
+                    if stats[other_offset + 6] > stats[offset + 6]:
+                        stats[offset + 6] = stats[other_offset + 6]
+                    if stats[other_offset + 7] > stats[offset + 7]:
+                        stats[offset + 7] = stats[other_offset + 7]
+                    if stats[other_offset + 8] < stats[offset + 8]:
+                        stats[offset + 8] = stats[other_offset + 8]
+                    if stats[other_offset + 9] > stats[offset + 9]:
+                        stats[offset + 9] = stats[other_offset + 9]
+
+            length = x - start
+            if label == 0 and labels < max_labels:
+                labels += 1
+                label = labels
+                parents[label] = label
+                offset = label * BLOB_STATS_SIZE
+                stats[offset] = length
+                stats[offset + 1] = (start + x - 1) * length // 2
+                stats[offset + 2] = y * length
+                stats[offset + 3] = grey_sum
+                stats[offset + 4] = start
+                stats[offset + 5] = y
+                stats[offset + 6] = x - 1
+                stats[offset + 7] = y
+                stats[offset + 8] = grey_min
+                stats[offset + 9] = grey_max
+            elif label != 0:
+                offset = label * BLOB_STATS_SIZE
+                stats[offset] += length
+                stats[offset + 1] += (start + x - 1) * length // 2
+                stats[offset + 2] += y * length
+                stats[offset + 3] += grey_sum
+                if start < stats[offset + 4]:
+                    stats[offset + 4] = start
+                if x - 1 > stats[offset + 6]:
+                    stats[offset + 6] = x - 1
+                stats[offset + 7] = y
+                if grey_min < stats[offset + 8]:
+                    stats[offset + 8] = grey_min
+                if grey_max > stats[offset + 9]:
+                    stats[offset + 9] = grey_max
+
+            while start < x:
+                row_labels[current + start] = label
+                start += 1
+
+        swap = current
+        current = previous
+        previous = swap
+        row += width
+        y += 1
+
+    return labels
+
+# Codec of the visual frames (RGB565) on the camera slave link. The stream is made of 16 bit words,
+# each token is a word with the kind in the 2 upper bits and the number of pixels in the others:
+RLE_LITERAL = const(0x0000) # followed by the pixels
+RLE_ABOVE = const(0x8000) # pixels equal to the ones of the row above
+RLE_LEFT = const(0x4000) # pixels equal to the previous one
+RLE_COUNT_MAX = const(0x3FFF)
+
+@micropython.viper
+def rle565_encode(src: ptr16, dst: ptr16, pixels: int, width: int, max_words: int) -> int:
+    """ Encodes the pixels of src in dst (see RLE_LITERAL), returns the words written or -1 when
+    they do not fit in max_words. Runs of 2 or more pixels are encoded, the longest one is used. """
+    index = 0
+    words = 0
+    literal = 0
+    literal_count = 0
+    while index < pixels:
+        pixel = src[index]
+
+        run_above = 0
+        if index >= width:
+            end = index
+            while end < pixels and run_above < RLE_COUNT_MAX and src[end] == src[end - width]:
+                end += 1
+                run_above += 1
+        run_left = 0
+        if index > 0:
+            previous = src[index - 1]
+            end = index
+            while end < pixels and run_left < RLE_COUNT_MAX and src[end] == previous:
+                end += 1
+                run_left += 1
+
+        if run_above >= 2 or run_left >= 2:
+            if words >= max_words:
+                return -1
+            if run_above >= run_left:
+                dst[words] = RLE_ABOVE | run_above
+                index += run_above
+            else:
+                dst[words] = RLE_LEFT | run_left
+                index += run_left
+            words += 1
+            literal_count = 0
+        else:
+            if literal_count == 0 or literal_count == RLE_COUNT_MAX:
+                if words >= max_words:
+                    return -1
+                literal = words
+                words += 1
+                literal_count = 0
+            if words >= max_words:
+                return -1
+            dst[words] = pixel
+            words += 1
+            literal_count += 1
+            dst[literal] = RLE_LITERAL | literal_count
+            index += 1
+    return words
+
+@micropython.viper
+def rle565_decode(src: ptr16, words: int, dst: ptr16, pixels: int, width: int) -> int:
+    """ Decodes the words of src (see rle565_encode) in dst, returns the pixels written or -1 when
+    the stream is not valid (nothing is written out of the pixels of dst) """
+    index = 0
+    pixel_index = 0
+    while index < words:
+        token = src[index]
+        index += 1
+        count = token & RLE_COUNT_MAX
+        end = pixel_index + count
+        if end > pixels:
+            return -1
+        kind = token & 0xC000
+        if kind == RLE_LITERAL:
+            if index + count > words:
+                return -1
+            while pixel_index < end:
+                dst[pixel_index] = src[index]
+                pixel_index += 1
+                index += 1
+        elif kind == RLE_ABOVE:
+            if pixel_index < width:
+                return -1
+            while pixel_index < end:
+                dst[pixel_index] = dst[pixel_index - width]
+                pixel_index += 1
+        elif kind == RLE_LEFT and pixel_index > 0:
+            pixel = dst[pixel_index - 1]
+            while pixel_index < end:
+                dst[pixel_index] = pixel
+                pixel_index += 1
+        else:
+            return -1
+    return pixel_index
+
+def create_crc16_table():
+    """ Table of crc16 (CRC-16/CCITT, polynomial 0x1021) """
+    table = bytearray(2 * 256)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        crc &= 0xFFFF
+        table[2 * byte] = crc & 0xFF
+        table[2 * byte + 1] = crc >> 8
+    return table
+
+@micropython.viper
+def crc16(src: ptr8, length: int, crc: int, table: ptr16) -> int:
+    """ CRC-16/CCITT of the first length bytes of src continuing from crc (0xFFFF to start),
+    table from create_crc16_table """
+    index = 0
+    while index < length:
+        crc = ((crc << 8) ^ table[((crc >> 8) ^ src[index]) & 0xFF]) & 0xFFFF
+        index += 1
+    return crc
@@ -0,0 +1,118 @@
+#MIT License
+
+#Copyright (c) 2021 Jonatan Asensio Palao
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+
+from ucollections import namedtuple
+import sensor
+
+from utils.image import blit_mask
+
+class GlyphCache():
+    """ Text drawn by copying cached glyph bitmaps (blit_mask) instead of rasterising the font again
+
+    Every (character, scale, mono_space) is drawn once with draw_string in a small scratch image, the
+    set pixels are kept as a bit mask with the advance to the next character. The result is the same
+    text as draw_string.
+    """
+
+    Glyph = namedtuple("Glyph", ("x", "y", "width", "height", "advance", "mask"))
+
+    def __init__(self, max_scale=2.5):
+        size = round(24 * max_scale)
+        self.scratch = sensor.alloc_extra_fb(size, size, sensor.GRAYSCALE)
+        self.glyphs = {}
+        self.line_heights = {}
+        self.hits = 0
+        self.misses = 0
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+
+    def _render(self, text, scale, mono_space=True):
+        """ (x, y) of the pixels set by draw_string """
+        scratch = self.scratch
+        width = scratch.width()
+        scratch.draw_rectangle(0, 0, width, scratch.height(), color=0, fill=True)
+        scratch.draw_string(0, 0, text, color=255, scale=scale, mono_space=mono_space)
+        data = scratch.bytearray()
+        return [(index % width, index // width) for index in range(width * scratch.height()) if data[index]]
+
+    def glyph(self, char, scale, mono_space=True):
+        key = (char, scale, mono_space)
+        glyph = self.glyphs.get(key)
+        if glyph is not None:
+            self.hits += 1
+            return glyph
+        self.misses += 1
+
+        pixels = self._render(char, scale, mono_space)
+        # The advance is where a following marker starts compared with the marker alone
+        marker = self._render("|", scale, mono_space)
+        following = set(self._render(char + "|", scale, mono_space)) - set(pixels)
+        advance = min(x for x, _ in following) - min(x for x, _ in marker)
+
+        if pixels:
+            x = min(x for x, _ in pixels)
+            y = min(y for _, y in pixels)
+            width = max(x for x, _ in pixels) - x + 1
+            height = max(y for _, y in pixels) - y + 1
+            mask = bytearray((width * height + 7) // 8)
+            for pixel_x, pixel_y in pixels:
+                bit = (pixel_x - x) + (pixel_y - y) * width
+                mask[bit >> 3] |= 1 << (bit & 7)
+        else:
+            x = y = width = height = 0
+            mask = None
+
+        glyph = GlyphCache.Glyph(x, y, width, height, advance, mask)
+        self.glyphs[key] = glyph
+        return glyph
+
+    def line_height(self, scale):
+        line_height = self.line_heights.get(scale)
+        if line_height is None:
+            marker = self._render("|", scale)
+            following = set(self._render("|\n|", scale)) - set(marker)
+            line_height = min(y for _, y in following) - min(y for _, y in marker)
+            self.line_heights[scale] = line_height
+        return line_height
+
+    def draw_string(self, img, x, y, text, color=(255, 255, 255), scale=1.0, mono_space=True):
+        """ Same as img.draw_string(x, y, text, color=color, scale=scale, mono_space=mono_space) for a RGB565 img.
+        An int color is used as it is (e.g. already byte swapped for the screen). """
+        if isinstance(color, tuple):
+            r, g, b = color
+            color = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+        width = img.width()
+        height = img.height()
+        x = int(x)
+        y = int(y)
+        x_start = x
+        for char in text:
+            if char == "\n":
+                x = x_start
+                y += self.line_height(scale)
+                continue
+            glyph = self.glyph(char, scale, mono_space)
+            if glyph.mask:
+                blit_mask(img, width, height, glyph.mask, x + glyph.x, y + glyph.y, glyph.width, glyph.height, color)
+            x += glyph.advance